@@ -0,0 +1,42 @@
+"""
+Bulk load throughput in pellets per second, presorted and shuffled.
+
+    python benchmarks/bench_bulk.py [count]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from s_cat import bulk
+from s_cat import key
+
+
+def pairs(numbers):
+    for n in numbers:
+        yield (key.NumberKey(n), [b"value %d" % n])
+
+
+def main(count=200000):
+    numbers = list(range(count))
+    shuffled = list(numbers)
+    random.Random(0).shuffle(shuffled)
+    directory = tempfile.mkdtemp()
+    try:
+        for (label, order, presorted) in [("presorted", numbers, True), ("shuffled", shuffled, False)]:
+            path = os.path.join(directory, label + ".scat")
+            start = time.time()
+            bulk.bulk_load_file(path, pairs(order), presorted=presorted, temp_dir=directory)
+            elapsed = time.time() - start
+            print("%10s %8d pellets %8.3f s %10.0f pellets/s %10d bytes" % (
+                label, count, elapsed, count / elapsed, os.path.getsize(path)))
+            os.remove(path)
+    finally:
+        os.rmdir(directory)
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,44 @@
+"""
+Time BytesSource appends: the cost per append should stay flat as the
+source grows (amortized constant time appends).
+
+    python benchmarks/bench_bytes_source.py
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from s_cat import data_source
+from s_cat import key
+from s_cat import pellet
+from s_cat import value
+
+
+def pellet_bytes(i):
+    p = pellet.Pellet(key.NumberKey(i), value.Values([b"value %d" % i]))
+    return b"\n" + p.to_bytes()
+
+
+def time_appends(count, chunks):
+    source = data_source.BytesSource(b"", writeable=True)
+    start = time.time()
+    for i in range(count):
+        source.append(chunks[i])
+    elapsed = time.time() - start
+    return (elapsed, source.length())
+
+
+def main(max_count=100000):
+    chunks = [pellet_bytes(i) for i in range(max_count)]
+    count = max_count // 8
+    while count <= max_count:
+        (elapsed, nbytes) = time_appends(count, chunks)
+        print("%8d appends %10d bytes %8.3f s %8.3f us/append" % (
+            count, nbytes, elapsed, 1e6 * elapsed / count))
+        count *= 2
+
+if __name__ == "__main__":
+    main()
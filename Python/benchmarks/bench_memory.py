@@ -0,0 +1,72 @@
+"""
+Bytes per in memory key and pellet for the slotted classes compared with
+dict backed equivalents (subclasses without __slots__, as before).
+
+    python benchmarks/bench_memory.py [count]
+"""
+
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from s_cat import key
+from s_cat import pellet
+from s_cat import value
+
+
+class DictNumberKey(key.NumberKey):
+    pass
+
+class DictStringKey(key.StringKey):
+    pass
+
+class DictCompositeKey(key.CompositeKey):
+    pass
+
+class DictValues(value.Values):
+    pass
+
+class DictPellet(pellet.Pellet):
+
+    def set_offsets(self, payload_length, offsets):
+        self.payload_length = payload_length
+        self.list_skips = [(offset, count) for (offset, count) in offsets]
+
+
+def make_keys(count, NumberKey, StringKey, CompositeKey, Values, Pellet):
+    return [CompositeKey(StringKey(u"tenant"), NumberKey(i)) for i in range(count)]
+
+
+def make_pellets(count, NumberKey, StringKey, CompositeKey, Values, Pellet):
+    result = []
+    for i in range(count):
+        k = CompositeKey(StringKey(u"tenant"), NumberKey(i))
+        p = Pellet(k, Values([b"v"]))
+        p.set_offsets(100, [(50, 1), (120, 2)])
+        result.append(p)
+    return result
+
+
+def measure(make, count, classes):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objects = make(count, *classes)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del objects
+    return (after - before) / float(count)
+
+
+def main(count=100000):
+    dict_backed = (DictNumberKey, DictStringKey, DictCompositeKey, DictValues, DictPellet)
+    slotted = (key.NumberKey, key.StringKey, key.CompositeKey, value.Values, pellet.Pellet)
+    for (label, classes) in [("dict backed", dict_backed), ("slotted", slotted)]:
+        print("%12s %8.1f bytes per key (composite of string and number)" % (
+            label, measure(make_keys, count, classes)))
+        print("%12s %8.1f bytes per pellet (same key, one value, two skips)" % (
+            label, measure(make_pellets, count, classes)))
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:]])
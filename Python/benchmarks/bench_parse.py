@@ -0,0 +1,48 @@
+"""
+Pellet decoding cost: reference pellet.pellet_from_bytes against
+fast_parse.pellet_from_bytes over one buffer of consecutive pellets.
+
+    python benchmarks/bench_parse.py [count]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from s_cat import fast_parse
+from s_cat import key
+from s_cat import pellet
+from s_cat import value
+
+
+def make_data(count):
+    encoded = []
+    for i in range(count):
+        k = key.CompositeKey(key.StringKey(u"tenant"), key.NumberKey(i))
+        p = pellet.Pellet(k, value.Values([b"x" * 40, b"y" * 10]))
+        p.set_offsets(None, [(120, 1), (240, 2)])
+        encoded.append(p.to_bytes())
+    return b"\n".join(encoded)
+
+
+def scan(parse, data):
+    position = 0
+    count = 0
+    while position < len(data):
+        (p, position) = parse(data, position)
+        count += 1
+    return count
+
+
+def main(count=100000):
+    data = make_data(count)
+    for (label, parse) in [("reference", pellet.pellet_from_bytes), ("fast_parse", fast_parse.pellet_from_bytes)]:
+        start = time.time()
+        scan(parse, data)
+        elapsed = time.time() - start
+        print("%12s %8d pellets %8.3f s %8.2f us/pellet" % (label, count, elapsed, 1e6 * elapsed / count))
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:]])
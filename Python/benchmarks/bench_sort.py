@@ -0,0 +1,60 @@
+"""
+Sorting keys: the class_order/less_than comparison (as Key.__lt__ used to
+work) against Key.sort_key byte strings.
+
+    python benchmarks/bench_sort.py [count]
+"""
+
+import functools
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from s_cat import key
+
+
+def legacy_cmp(k1, k2):
+    class_test = key.class_cmp(type(k1), type(k2))
+    if class_test:
+        return class_test
+    if isinstance(k1, key.CompositeKey):
+        return legacy_cmp(k1.key1, k2.key1) or legacy_cmp(k1.key2, k2.key2)
+    if k1.less_than(k2):
+        return -1
+    if k2.less_than(k1):
+        return 1
+    return 0
+
+
+def make_keys(count):
+    rng = random.Random(0)
+    keys = []
+    for i in range(count):
+        tenant = key.StringKey(u"tenant%d" % rng.randint(0, 100))
+        day = key.NumberKey(rng.randint(0, 1000))
+        keys.append(key.CompositeKey(tenant, key.CompositeKey(day, key.NumberKey(i))))
+    return keys
+
+
+def main(count=1000000):
+    keys = make_keys(count)
+    start = time.time()
+    legacy = sorted(keys, key=functools.cmp_to_key(legacy_cmp))
+    legacy_time = time.time() - start
+    start = time.time()
+    encoded = sorted(keys, key=key.Key.sort_key)
+    encode_time = time.time() - start
+    start = time.time()
+    sorted(keys, key=key.Key.sort_key)
+    cached_time = time.time() - start
+    assert [k.value() for k in legacy] == [k.value() for k in encoded]
+    print("%8d composite keys" % count)
+    print("legacy __lt__             %8.3f s" % legacy_time)
+    print("sort_key (encoding)       %8.3f s" % encode_time)
+    print("sort_key (cached)         %8.3f s" % cached_time)
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,199 @@
+"""
+asyncio interface to s_cat data.
+
+AsyncDataSource mirrors data_source.DataSource with awaitable reads.
+ExecutorSource runs the reads of a thread safe DataSource in a bounded
+thread pool, so many lookups may be in flight at once without a thread
+for each, and concurrent requests for the same bytes share one read.
+The fetch functions here are the async counterparts of
+key.key_from_data_source_seek, pellet.pellet_from_data_source_seek and
+index.KeyIndex.get.
+"""
+
+from . import data_source
+from . import file_source
+from . import index
+from . import key
+from . import pellet
+from . import value
+import asyncio
+import concurrent.futures
+
+
+class AsyncDataSource(object):
+
+    """
+    Abstract superclass: awaitable interface to an indexed byte resource
+    (see data_source.DataSource for the meaning of the methods).
+    """
+
+    async def get_bytes(self, start_seek, length, strict=True):
+        raise NotImplementedError("Implement at subclass")
+
+    async def length(self):
+        raise NotImplementedError("Implement at subclass")
+
+    async def get_bytes_from_ws_to_eof(self, initial_length=128, max_seek=1000000, end_seek=None):
+        if end_seek is None:
+            end_seek = await self.length()
+        searched_seek = end_seek
+        chunks = []
+        seek_offset = initial_length
+        while seek_offset < max_seek:
+            seek_position = max(0, end_seek - seek_offset)
+            if seek_position < searched_seek:
+                (bytes_read, at_eof) = await self.get_bytes(seek_position, searched_seek - seek_position, strict=False)
+                last_ws = data_source.rfind_white(bytes(bytes_read))
+                if last_ws >= 0:
+                    found = bytes_read[last_ws + 1:]
+                    if chunks:
+                        chunks.append(found)
+                        found = b"".join(reversed(chunks))
+                    return (found, seek_position + last_ws + 1)
+                chunks.append(bytes_read)
+                searched_seek = seek_position
+            if seek_position == 0:
+                return None
+            seek_offset += seek_offset
+        return None
+
+    async def get_bytes_to_ws_or_eof(self, start_seek, initial_length=128, max_length=1000000):
+        length = initial_length
+        while length < max_length:
+            (bytes_read, at_eof) = await self.get_bytes(start_seek, length, strict=False)
+            match = data_source.ws_pattern.search(bytes_read)
+            if match:
+                return bytes_read[:match.start()]
+            if at_eof:
+                return bytes_read
+            length += length
+        return None
+
+
+class ExecutorSource(AsyncDataSource):
+
+    """
+    Async view of a data source whose reads are safe from many threads at
+    once (a positional file_source.FileSource, a snapshot.Snapshot, a
+    data_source.BytesSource).  Reads run in executor, by default a thread
+    pool of max_workers threads, and a read requested again while in flight
+    is not repeated: the requests share the result.
+    """
+
+    def __init__(self, source, max_workers=8, executor=None):
+        self.source = source
+        self.own_executor = executor is None
+        if executor is None:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        self.executor = executor
+        # (start_seek, length, strict) --> future of the read in flight.
+        self.in_flight = {}
+        # reads made by the executor.
+        self.reads = 0
+
+    def close(self):
+        if self.own_executor:
+            self.executor.shutdown()
+
+    async def run(self, function, *arguments):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, function, *arguments)
+
+    def read(self, start_seek, length, strict):
+        self.reads += 1
+        return self.source.get_bytes(start_seek, length, strict)
+
+    async def get_bytes(self, start_seek, length, strict=True):
+        request = (start_seek, length, strict)
+        in_flight = self.in_flight
+        future = in_flight.get(request)
+        if future is None:
+            future = asyncio.ensure_future(self.run(self.read, start_seek, length, strict))
+            in_flight[request] = future
+            future.add_done_callback(lambda done: in_flight.pop(request, None))
+        # a cancelled request must not cancel the read for the others.
+        return await asyncio.shield(future)
+
+    async def length(self):
+        return await self.run(self.source.length)
+
+
+class AsyncFileSource(ExecutorSource):
+
+    "Async source reading an open binary file with positional reads in a bounded thread pool."
+
+    def __init__(self, open_file, max_workers=8, executor=None):
+        source = file_source.FileSource(open_file, positional=True)
+        ExecutorSource.__init__(self, source, max_workers, executor)
+
+    @classmethod
+    def open(cls, path, max_workers=8, executor=None):
+        return cls(open(path, "rb"), max_workers, executor)
+
+    def close(self):
+        ExecutorSource.close(self)
+        self.source.close()
+
+    async def length(self):
+        # cached: no file system access.
+        return self.source.length()
+
+    async def refresh_length(self):
+        "Pick up bytes appended since opening (see FileSource.refresh_length)."
+        return await self.run(self.source.refresh_length)
+
+
+async def run_reads(source, plan):
+    "Async pellet.run_reads: make the reads requested by plan from the async source."
+    try:
+        (start_seek, length) = next(plan)
+        while True:
+            found = await source.get_bytes(start_seek, length, strict=False)
+            (start_seek, length) = plan.send(found)
+    except StopIteration as stop:
+        return stop.value
+
+
+async def pellet_from_data_source_seek(source, seek, payload_length=None, estimate=None, lazy=False):
+    "Async pellet.pellet_from_data_source_seek: return (pellet, end_seek)."
+    return await run_reads(source, pellet.pellet_reads(seek, payload_length, estimate, lazy))
+
+
+async def key_from_data_source_seek(source, seek):
+    "Async key.key_from_data_source_seek: return (key, end_seek)."
+    first_chunk = await source.get_bytes_to_ws_or_eof(seek)
+    indicator = first_chunk[0:1]
+    next_seek = seek + len(first_chunk) + 1  # skip ws
+    if indicator == key.NumberKey.INDICATOR:
+        (number, num_end) = key.white_delimited_number(first_chunk, 1)
+        return (key.NumberKey(number), next_seek)
+    if indicator == key.StringKey.INDICATOR:
+        (length, len_end) = key.white_delimited_int(first_chunk, 1)
+        if (length < 0):
+            raise key.FormatError("invalid length " + repr((length, len_end)))
+        (chunk, at_eof) = await source.get_bytes(next_seek, length + 1)  # include ws at tail
+        key.assert_is_white(chunk[-1:], 0)
+        return (key.StringKey(chunk[:-1]), next_seek + len(chunk))
+    if indicator == key.CompositeKey.INDICATOR:
+        if len(first_chunk) != 1:
+            raise key.FormatError("Expected whitepace not found.")
+        (key1, end1) = await key_from_data_source_seek(source, next_seek)
+        (key2, end) = await key_from_data_source_seek(source, end1)
+        return (key.CompositeKey(key1, key2), end)
+    raise key.FormatError("unknown key indicator " + repr(indicator))
+
+
+async def index_get(key_index, source, k, lazy=False):
+    """
+    Async index.KeyIndex.get: the values container for k read from the
+    async source, or None if absent or deleted.
+    """
+    found = key_index.find(k)
+    if found is None:
+        return None
+    (seek, payload_length) = found
+    (payload, at_eof) = await source.get_bytes(seek, payload_length)
+    result = index.payload_values(payload, lazy)
+    if isinstance(result, value.Deleted):
+        return None
+    return result
@@ -0,0 +1,185 @@
+"""
+Bloom filter over the sort keys (Key.sort_key()) of the pellets in a
+data source, so lookups of absent keys can usually be answered without
+reading the data.  Sort keys, not encodings, since that is how the store
+matches keys: NumberKey(3) and NumberKey(3.0) are encoded differently
+but find the same pellets.
+
+The filter grows by adding layers as keys are added (a scalable Bloom
+filter): each layer holds twice as many keys as the one before at half
+its false positive rate, so the overall rate stays below the configured
+one however many keys arrive.  Like index.KeyIndex it can be saved as a
+sidecar file recording the length and a fingerprint of the data it
+covers, and catches up
+with pellets appended since.
+"""
+
+from . import index
+from . import pellet
+import hashlib
+import math
+import struct
+
+SIDECAR_MAGIC = b"SCATBLM3"
+SIDECAR_HEADER = struct.Struct("<QdQQ16s")
+LAYER_HEADER = struct.Struct("<QQQQ")
+
+
+def key_hashes(sort_key):
+    "Two independent 64 bit hashes of sort_key (the second odd) for double hashing."
+    digest = hashlib.blake2b(sort_key, digest_size=16).digest()
+    return (int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1)
+
+
+class BloomLayer(object):
+
+    "Fixed size Bloom filter for up to capacity keys at false_positive_rate."
+
+    __slots__ = ("nbits", "nhashes", "capacity", "count", "bits")
+
+    def __init__(self, nbits, nhashes, capacity, count=0, bits=None):
+        self.nbits = nbits
+        self.nhashes = nhashes
+        self.capacity = capacity
+        self.count = count
+        if bits is None:
+            bits = bytearray((nbits + 7) // 8)
+        self.bits = bits
+
+    @classmethod
+    def sized(cls, capacity, false_positive_rate):
+        nbits = max(8, int(math.ceil(-capacity * math.log(false_positive_rate) / math.log(2) ** 2)))
+        nhashes = max(1, int(round(nbits / float(capacity) * math.log(2))))
+        return cls(nbits, nhashes, capacity)
+
+    def add(self, hashes):
+        (h1, h2) = hashes
+        nbits = self.nbits
+        bits = self.bits
+        for i in range(self.nhashes):
+            bit = (h1 + i * h2) % nbits
+            bits[bit >> 3] |= 1 << (bit & 7)
+        self.count += 1
+
+    def contains(self, hashes):
+        (h1, h2) = hashes
+        nbits = self.nbits
+        bits = self.bits
+        for i in range(self.nhashes):
+            bit = (h1 + i * h2) % nbits
+            if not bits[bit >> 3] & (1 << (bit & 7)):
+                return False
+        return True
+
+
+class BloomFilter(object):
+
+    """
+    Bloom filter of the keys of the pellets in data_source (up to
+    covered_length) with false positive rate at most false_positive_rate.
+    The first layer holds capacity keys.
+    """
+
+    def __init__(self, data_source, false_positive_rate=0.01, capacity=1024, covered_length=0, layers=None):
+        if not 0 < false_positive_rate < 1:
+            raise ValueError("false positive rate must be between 0 and 1.")
+        self.data_source = data_source
+        self.false_positive_rate = false_positive_rate
+        self.capacity = capacity
+        self.covered_length = covered_length
+        self.layers = [] if layers is None else layers
+
+    def __len__(self):
+        "Number of distinct keys added (up to false positives)."
+        return sum(layer.count for layer in self.layers)
+
+    def __contains__(self, sort_key):
+        hashes = key_hashes(sort_key)
+        for layer in self.layers:
+            if layer.contains(hashes):
+                return True
+        return False
+
+    def might_contain(self, k):
+        "False if no pellet for the key k has been added."
+        return k.sort_key() in self
+
+    def add(self, sort_key):
+        hashes = key_hashes(sort_key)
+        layers = self.layers
+        for layer in layers:
+            if layer.contains(hashes):
+                # (probably) present: adding again would only fill the layer.
+                return
+        if not layers or layers[-1].count >= layers[-1].capacity:
+            number = len(layers)
+            # rates halve from half the target, so their sum stays below it.
+            rate = self.false_positive_rate / 2 ** (number + 1)
+            layers.append(BloomLayer.sized(self.capacity << number, rate))
+        layers[-1].add(hashes)
+
+    def catch_up(self):
+        "Add the keys of any pellets past the covered length.  Return the number of pellets read."
+        source = self.data_source
+        end_seek = source.length()
+        count = 0
+        for (seek, result) in pellet.iter_pellets(source, self.covered_length, lazy=True):
+            self.add(result.key.sort_key())
+            count += 1
+        self.covered_length = end_seek
+        return count
+
+    def record(self, sort_key, seek, payload_length, covered_length):
+        "Add the sort key of a pellet just written, covering data up to covered_length."
+        self.add(sort_key)
+        self.covered_length = covered_length
+
+    def to_bytes(self):
+        layers = self.layers
+        fingerprint = index.data_fingerprint(self.data_source, self.covered_length)
+        header = SIDECAR_HEADER.pack(self.covered_length, self.false_positive_rate, self.capacity, len(layers), fingerprint)
+        chunks = [SIDECAR_MAGIC, header]
+        for layer in layers:
+            chunks.append(LAYER_HEADER.pack(layer.nbits, layer.nhashes, layer.capacity, layer.count))
+            chunks.append(bytes(layer.bits))
+        return b"".join(chunks)
+
+    def save(self, path):
+        "Write the sidecar file, replacing any previous one atomically."
+        index.save_sidecar(path, self.to_bytes())
+
+    @classmethod
+    def from_bytes(cls, data_source, encoded):
+        encoded = memoryview(encoded)
+        nmagic = len(SIDECAR_MAGIC)
+        start = nmagic + SIDECAR_HEADER.size
+        if encoded[:nmagic] != SIDECAR_MAGIC or len(encoded) < start:
+            raise index.SidecarError("not a sidecar Bloom filter")
+        (covered_length, rate, capacity, nlayers, fingerprint) = SIDECAR_HEADER.unpack(encoded[nmagic:start])
+        index.check_fingerprint(data_source, covered_length, fingerprint, "Bloom filter")
+        layers = []
+        for i in range(nlayers):
+            end = start + LAYER_HEADER.size
+            if end > len(encoded):
+                raise index.SidecarError("truncated sidecar Bloom filter")
+            (nbits, nhashes, layer_capacity, count) = LAYER_HEADER.unpack(encoded[start:end])
+            start = end
+            end = start + (nbits + 7) // 8
+            if end > len(encoded):
+                raise index.SidecarError("truncated sidecar Bloom filter")
+            layers.append(BloomLayer(nbits, nhashes, layer_capacity, count, bytearray(encoded[start:end])))
+            start = end
+        return cls(data_source, rate, capacity, covered_length, layers)
+
+    @classmethod
+    def load(cls, data_source, path):
+        return cls.from_bytes(data_source, index.read_sidecar(path))
+
+    @classmethod
+    def open(cls, data_source, path, false_positive_rate=0.01, capacity=1024, save=True):
+        """
+        Load the sidecar filter at path if it is usable, else start afresh,
+        then add pellets past the covered length, saving if any were added.
+        """
+        return index.open_sidecar(path, lambda encoded: cls.from_bytes(data_source, encoded),
+                                  lambda: cls(data_source, false_positive_rate, capacity), save)
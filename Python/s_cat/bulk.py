@@ -0,0 +1,148 @@
+"""
+Streaming bulk load of (key, values) pairs into a sorted s_cat store.
+
+Unsorted input is sorted externally: runs of at most run_size pairs are
+sorted in memory and spilled to temporary s_cat files which are then
+merged, so memory use stays bounded however large the input is.  At most
+fan_in runs are merged at once (in several passes if need be), so the
+number of open files is bounded too.
+Pairs with equal keys keep their input order, so the last one wins.
+"""
+
+from . import file_source
+from . import pellet
+from . import store
+from . import value
+import heapq
+import tempfile
+
+# buffered output is written in chunks of this size.
+WRITE_CHUNK = 1 << 20
+# at most this many spilled runs are open and merged at once.
+MERGE_FAN_IN = 64
+
+
+def as_values(pvalues):
+    "Accept a values container or a sequence of byte strings."
+    if isinstance(pvalues, value.ValuesContainer):
+        return pvalues
+    return value.Values(pvalues)
+
+
+def pair_key(pair):
+    return pair[0].sort_key()
+
+
+def bulk_load(data_source, items, presorted=False, run_size=100000, temp_dir=None, index=None, bloom=None,
+              compressor=None):
+    """
+    Write (key, values) pairs from the items iterator to data_source as a
+    sorted store with skip offsets, keeping index (a KeyIndex) and bloom
+    (a BloomFilter) current if given and compressing values with
+    compressor (a compress.Compressor) if given.
+    With presorted=True pairs are written as they arrive (store.OrderError
+    if they are not in order).  Return the number of pellets written.
+    """
+    # index entries are collected in compact arrays rather than a dictionary.
+    builder = None if index is None else index.builder()
+    writer = store.SCatWriter(data_source, index=builder, bloom=bloom, compressor=compressor)
+    if presorted:
+        pairs = items
+    else:
+        pairs = sorted_pairs(items, run_size, temp_dir)
+    count = 0
+    add = writer.add
+    try:
+        for (pkey, pvalues) in pairs:
+            add(pkey, as_values(pvalues))
+            count += 1
+    finally:
+        if builder is not None:
+            index.absorb(builder)
+    return count
+
+
+def bulk_load_file(path, items, presorted=False, run_size=100000, temp_dir=None, index=None, bloom=None,
+                   compressor=None):
+    "Bulk load into the file at path (appending) through a buffered writer."
+    # readable too: a writer on a non empty file recovers from its tail.
+    with open(path, "a+b") as f:
+        source = file_source.BufferedFileSource(f, flush_policy=file_source.every_bytes(WRITE_CHUNK))
+        try:
+            return bulk_load(source, items, presorted, run_size, temp_dir, index, bloom, compressor)
+        finally:
+            source.close()
+
+
+def sorted_pairs(items, run_size=100000, temp_dir=None, fan_in=MERGE_FAN_IN):
+    "Generate the pairs from items in stable key order using bounded memory."
+    runs = []
+    # every temporary file, closed at the end even if a merge pass fails.
+    spilled = []
+    try:
+        iterator = iter(items)
+        while True:
+            run = []
+            for pair in iterator:
+                run.append(pair)
+                if len(run) >= run_size:
+                    break
+            run.sort(key=pair_key)
+            if not runs and len(run) < run_size:
+                # everything fit in memory.
+                for pair in run:
+                    yield pair
+                return
+            if run:
+                runs.append(spill(run, temp_dir))
+                spilled.append(runs[-1])
+            if len(run) < run_size:
+                break
+        while len(runs) > fan_in:
+            # merge consecutive groups, so equal keys stay in input order.
+            merged = []
+            for start in range(0, len(runs), fan_in):
+                group = runs[start:start + fan_in]
+                if len(group) == 1:
+                    merged.append(group[0])
+                    continue
+                merged.append(spill(merge_runs(group), temp_dir))
+                spilled.append(merged[-1])
+                for f in group:
+                    f.close()
+            runs = merged
+        for pair in merge_runs(runs):
+            yield pair
+    finally:
+        for f in spilled:
+            f.close()
+
+
+def merge_runs(runs):
+    "Generate the pairs of sorted spilled runs in stable key order."
+    return heapq.merge(*[run_pairs(f) for f in runs], key=pair_key)
+
+
+def spill(run, temp_dir=None):
+    "Write sorted pairs to a temporary s_cat file."
+    f = tempfile.TemporaryFile(dir=temp_dir)
+    chunk = []
+    chunk_size = 0
+    for (pkey, pvalues) in run:
+        encoded = pellet.Pellet(pkey, as_values(pvalues)).to_bytes()
+        chunk.append(encoded)
+        chunk_size += len(encoded)
+        if chunk_size >= WRITE_CHUNK:
+            f.write(b"\n".join(chunk) + b"\n")
+            chunk = []
+            chunk_size = 0
+    f.write(b"\n".join(chunk))
+    f.flush()
+    return f
+
+
+def run_pairs(f):
+    "Generate the (key, values) pairs spilled to f."
+    source = file_source.FileSource(f, positional=True)
+    for (seek, result) in pellet.iter_pellets(source):
+        yield (result.key, result.values)
@@ -0,0 +1,112 @@
+from . import data_source
+from collections import OrderedDict
+import threading
+
+
+class CachingDataSource(data_source.DataSource):
+
+    """
+    Wrap another data source, keeping recently read fixed size aligned
+    blocks in a bounded least recently used cache.
+
+    Small overlapping reads (for example the repeated probes made while
+    parsing a key) are then served from a few block fetches.
+    """
+
+    def __init__(self, source, block_size=4096, max_bytes=4 * 1024 * 1024):
+        if block_size <= 0:
+            raise ValueError("block_size must be positive.")
+        self.source = source
+        self.writeable = source.writeable
+        self.block_size = block_size
+        self.max_bytes = max_bytes
+        self.blocks = OrderedDict()
+        self.cached_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def stats(self):
+        "Return a dictionary of cache counters."
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            blocks=len(self.blocks),
+            cached_bytes=self.cached_bytes,
+        )
+
+    def clear(self):
+        "Discard all cached blocks."
+        with self.lock:
+            self.blocks.clear()
+            self.cached_bytes = 0
+
+    def length(self):
+        return self.source.length()
+
+    def snapshot_length(self):
+        return self.source.snapshot_length()
+
+    def append(self, add_bytes):
+        seek = self.source.append(add_bytes)
+        # the block holding the old end of data may be cached short.
+        with self.lock:
+            self.discard_block(seek // self.block_size)
+        return seek
+
+    def get_bytes(self, start_seek, length, strict=True):
+        nbytes = self.length()
+        end_seek = start_seek + length
+        if start_seek > nbytes:
+            raise IndexError("seek start past end of file.")
+        if strict and end_seek > nbytes:
+            return None
+        at_eof = (end_seek >= nbytes)
+        end_seek = min(end_seek, nbytes)
+        if end_seek <= start_seek:
+            return (b"", at_eof)
+        block_size = self.block_size
+        first_block = start_seek // block_size
+        last_block = (end_seek - 1) // block_size
+        pieces = []
+        for block_index in range(first_block, last_block + 1):
+            block = self.get_block(block_index, nbytes)
+            block_start = block_index * block_size
+            pieces.append(block[max(0, start_seek - block_start): end_seek - block_start])
+        if len(pieces) == 1:
+            return (pieces[0], at_eof)
+        return (b"".join(pieces), at_eof)
+
+    def get_block(self, block_index, nbytes):
+        "Get the aligned block with this index, reading it on a miss."
+        block_size = self.block_size
+        block_start = block_index * block_size
+        # a block cached before the data grew past it is stale.
+        expected = min(block_size, nbytes - block_start)
+        with self.lock:
+            block = self.blocks.get(block_index)
+            if block is not None and len(block) >= expected:
+                self.blocks.move_to_end(block_index)
+                self.hits += 1
+                return block
+            self.misses += 1
+        (block, at_eof) = self.source.get_bytes(block_start, block_size, strict=False)
+        block = bytes(block)
+        with self.lock:
+            self.discard_block(block_index)
+            if len(block) <= self.max_bytes:
+                self.blocks[block_index] = block
+                self.cached_bytes += len(block)
+                while self.cached_bytes > self.max_bytes:
+                    (dummy, evicted) = self.blocks.popitem(last=False)
+                    self.cached_bytes -= len(evicted)
+                    self.evictions += 1
+        return block
+
+    def discard_block(self, block_index):
+        "Remove a block from the cache (caller holds the lock)."
+        block = self.blocks.pop(block_index, None)
+        if block is not None:
+            self.cached_bytes -= len(block)
@@ -0,0 +1,101 @@
+"""
+Compaction: rewrite one or more s_cat sources as a sorted store holding
+only the latest live pellet for each key, dropping deleted keys and
+superseded pellets.  Later sources (and later pellets within a source)
+override earlier ones.  Pellets are sorted externally (see bulk), so
+memory use is bounded however large the sources are.
+
+    python -m s_cat.compact OUTPUT INPUT [INPUT ...]
+"""
+
+from . import bulk
+from . import compress
+from . import file_source
+from . import pellet
+from . import store
+import argparse
+import os
+import sys
+import time
+
+
+def compact(sources, target_path, run_size=100000, temp_dir=None):
+    """
+    Write the live pellets of the data sources (oldest first) to a new
+    sorted store at target_path, replacing any file there only once it
+    is complete (so a source may be the target).  Compressed values are
+    copied as they are, so the compression dictionary of the sources (see
+    compress.sources_dictionary) starts the new store.  Return a
+    dictionary of statistics: pellets read and written, bytes read,
+    written and reclaimed, seconds and bytes read per second.
+    """
+    start = time.time()
+    dictionary = compress.sources_dictionary(sources)
+    stats = {"pellets_read": 0, "bytes_read": 0}
+
+    def all_pairs():
+        for source in sources:
+            stats["bytes_read"] += source.length()
+            for (seek, result) in pellet.iter_pellets(source):
+                stats["pellets_read"] += 1
+                yield (result.key, result.values)
+
+    pairs = store.latest_pairs(bulk.sorted_pairs(all_pairs(), run_size, temp_dir))
+    return write_store(pairs, target_path, stats, start, dictionary)
+
+
+def write_store(pairs, target_path, stats, start, dictionary=None):
+    """
+    Write pairs in key order as a new sorted store replacing target_path
+    once complete, and complete the statistics started at time start.
+    The store starts with the compression dictionary if one is given.
+    """
+    temp_path = target_path + ".tmp"
+    with open(temp_path, "wb") as f:
+        if dictionary is not None:
+            f.write(compress.dictionary_block(dictionary))
+    stats["pellets_written"] = bulk.bulk_load_file(temp_path, pairs, presorted=True)
+    os.replace(temp_path, target_path)
+    seconds = time.time() - start
+    stats["bytes_written"] = os.path.getsize(target_path)
+    stats["bytes_reclaimed"] = stats["bytes_read"] - stats["bytes_written"]
+    stats["seconds"] = seconds
+    stats["bytes_per_second"] = stats["bytes_read"] / seconds if seconds > 0 else None
+    return stats
+
+
+def compact_files(paths, target_path, run_size=100000, temp_dir=None):
+    "compact the s_cat files at paths (oldest first) into target_path."
+    sources = [file_source.FileSource(open(path, "rb"), positional=True) for path in paths]
+    try:
+        return compact(sources, target_path, run_size, temp_dir)
+    finally:
+        for source in sources:
+            source.close()
+
+
+def report(stats):
+    "Human readable summary of compaction statistics."
+    read = stats["bytes_read"]
+    reclaimed = stats["bytes_reclaimed"]
+    fraction = 100.0 * reclaimed / read if read else 0.0
+    rate = stats["bytes_per_second"]
+    rate = "%.1f MB/s" % (rate / 1e6) if rate is not None else "-"
+    return ("%d pellets read, %d written; %d bytes read, %d written, %d reclaimed (%.1f%%); %.2f s, %s" %
+            (stats["pellets_read"], stats["pellets_written"], read, stats["bytes_written"],
+             reclaimed, fraction, stats["seconds"], rate))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compact s_cat files into a sorted store of live pellets.")
+    parser.add_argument("output", help="path of the compacted file")
+    parser.add_argument("inputs", nargs="+", help="s_cat files, oldest first")
+    parser.add_argument("--run-size", type=int, default=100000, help="pellets sorted in memory at a time")
+    parser.add_argument("--temp-dir", default=None, help="directory for sorted runs")
+    arguments = parser.parse_args(argv)
+    stats = compact_files(arguments.inputs, arguments.output, arguments.run_size, arguments.temp_dir)
+    print(report(stats))
+    return stats
+
+if __name__ == "__main__":   # pragma: no cover
+    main(sys.argv[1:])
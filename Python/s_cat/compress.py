@@ -0,0 +1,170 @@
+"""
+Compressed values.  A value may be stored as
+
+    Z<length>\\n<codec><compressed bytes>
+
+in place of V<length>\\n<bytes>, where codec is one byte naming a standard
+library codec and length counts the codec byte, so the framing (and so
+skipping over values) is as for V.  Values are decompressed on access
+(value.PackedValues).
+
+A zlib shared dictionary helps with many small similar values.  Such a
+value has codec "d" and its compressed bytes follow the 8 byte id of the
+dictionary, which must be registered (register_dictionary) to decode it.
+A file may carry its dictionary as a leading amends token (see
+dictionary_block), which readers opening the file register (see
+source_dictionary), so a fresh process can decode the file.
+"""
+
+from . import key
+import base64
+import bz2
+import hashlib
+import lzma
+import weakref
+import zlib
+
+PACKED_INDICATOR = b"Z"
+ZLIB = b"z"
+LZMA = b"x"
+BZ2 = b"b"
+ZLIB_DICTIONARY = b"d"
+# codec bytes by name.
+CODECS = {"zlib": ZLIB, "lzma": LZMA, "bz2": BZ2}
+DICTIONARY_INDICATOR = b">D"
+DICTIONARY_ID_SIZE = 8
+# values shorter than this seldom shrink.
+DEFAULT_THRESHOLD = 128
+
+# registered dictionaries by id.
+dictionaries = {}
+# id (or None) of the dictionary block of data sources already looked at.
+source_dictionaries = weakref.WeakKeyDictionary()
+
+
+def dictionary_id(dictionary):
+    return hashlib.blake2b(dictionary, digest_size=DICTIONARY_ID_SIZE).digest()
+
+
+def register_dictionary(dictionary):
+    "Make dictionary available for decoding.  Return its id."
+    dictionary = bytes(dictionary)
+    ident = dictionary_id(dictionary)
+    dictionaries[ident] = dictionary
+    return ident
+
+
+def decompress(packed):
+    "The value bytes for packed: a codec byte then compressed bytes."
+    codec = bytes(packed[:1])
+    body = packed[1:]
+    if codec == ZLIB:
+        return zlib.decompress(body)
+    if codec == LZMA:
+        return lzma.decompress(body)
+    if codec == BZ2:
+        return bz2.decompress(body)
+    if codec == ZLIB_DICTIONARY:
+        ident = bytes(body[:DICTIONARY_ID_SIZE])
+        dictionary = dictionaries.get(ident)
+        if dictionary is None:
+            raise key.FormatError("unregistered compression dictionary " + repr(ident))
+        decompressor = zlib.decompressobj(zdict=dictionary)
+        return decompressor.decompress(body[DICTIONARY_ID_SIZE:]) + decompressor.flush()
+    raise key.FormatError("unknown compression codec " + repr(codec))
+
+
+class Compressor(object):
+
+    """
+    Compress values of at least threshold bytes with codec (a name in
+    CODECS) at level (the codec default if None), using dictionary if
+    given (zlib only).  Values which would not shrink are stored raw.
+    """
+
+    def __init__(self, codec="zlib", threshold=DEFAULT_THRESHOLD, level=None, dictionary=None):
+        if codec not in CODECS:
+            raise ValueError("unknown codec " + repr(codec))
+        if dictionary is not None and codec != "zlib":
+            raise ValueError("dictionaries are only supported by zlib")
+        self.codec = codec
+        self.threshold = threshold
+        self.level = level
+        self.dictionary = None
+        self.prefix = CODECS[codec]
+        if dictionary is not None:
+            self.dictionary = bytes(dictionary)
+            self.prefix = ZLIB_DICTIONARY + register_dictionary(dictionary)
+
+    def compress(self, value_bytes):
+        level = self.level
+        codec = self.codec
+        if self.dictionary is not None:
+            compressor = zlib.compressobj(-1 if level is None else level, zdict=self.dictionary)
+            return compressor.compress(value_bytes) + compressor.flush()
+        if codec == "zlib":
+            return zlib.compress(value_bytes, -1 if level is None else level)
+        if codec == "lzma":
+            return lzma.compress(value_bytes, preset=level)
+        return bz2.compress(value_bytes, 9 if level is None else level)
+
+    def pack(self, value_bytes):
+        "Codec byte and compressed bytes for value_bytes, or None to store it raw."
+        if len(value_bytes) < self.threshold:
+            return None
+        packed = self.prefix + self.compress(value_bytes)
+        if len(packed) >= len(value_bytes):
+            return None
+        return packed
+
+
+def dictionary_block(dictionary):
+    "Amends token carrying dictionary, to start a file."
+    return DICTIONARY_INDICATOR + base64.b64encode(bytes(dictionary))
+
+
+def read_dictionary(source):
+    "Register the dictionary at the start of source if any.  Return its id or None."
+    if not source.length():
+        return None
+    first = bytes(source.get_bytes_to_ws_or_eof(0))
+    if not first.startswith(DICTIONARY_INDICATOR):
+        return None
+    return register_dictionary(base64.b64decode(first[len(DICTIONARY_INDICATOR):]))
+
+
+def source_dictionary(source):
+    """
+    Make sure the dictionary at the start of source, if any, is registered.
+    The start of a non empty source is read only once per source object
+    (unless the dictionary has since been dropped from the registry).
+    Return the dictionary id or None.
+    """
+    if source in source_dictionaries:
+        ident = source_dictionaries[source]
+        if ident is None or ident in dictionaries:
+            return ident
+    ident = read_dictionary(source)
+    if ident is not None or source.length():
+        source_dictionaries[source] = ident
+    return ident
+
+
+def started_source(source, dictionary=None):
+    "Note that source was started with dictionary (or none), so readers need not look."
+    source_dictionaries[source] = None if dictionary is None else dictionary_id(dictionary)
+
+
+def sources_dictionary(sources):
+    """
+    The dictionary carried by any of the data sources, or None if none
+    carries one, so values copied from them can still be decoded.
+    Raise ValueError if they carry different dictionaries.
+    """
+    idents = set(source_dictionary(source) for source in sources)
+    idents.discard(None)
+    if len(idents) > 1:
+        raise ValueError("sources carry different compression dictionaries")
+    if not idents:
+        return None
+    return dictionaries[idents.pop()]
@@ -3,6 +3,14 @@ import re
 
 ws_re = br"\s"
 ws_pattern = re.compile(ws_re)
+# the single byte strings matched by ws_re
+ws_bytes = (b" ", b"\t", b"\n", b"\r", b"\f", b"\v")
+
+def rfind_white(data, start=0, end=None):
+    "Index of the last white space byte in data[start:end] (bytes or mmap), or -1."
+    if end is None:
+        end = len(data)
+    return max(data.rfind(ws, start, end) for ws in ws_bytes)
 
 class ReadOnlyError(IOError):
     "Object is read only: mutation not permitted"
@@ -44,27 +52,49 @@ class DataSource:
         """
         raise ReadOnlyError("Operation not implemented.")
 
-    def get_bytes_from_ws_to_eof(self, initial_length=128, max_seek=1000000):
+    def snapshot_length(self):
+        """
+        Length of the data which other readers may rely on: it ends on an
+        append boundary and the bytes before it never change.
+        """
+        return self.length()
+
+    def read_at(self, start_seek, length):
+        """
+        Get up to length bytes from start_seek, which is within
+        snapshot_length(), for a reader which may run concurrently with
+        appends (see snapshot.Snapshot).
+        """
+        (bytes_read, at_eof) = self.get_bytes(start_seek, length, strict=False)
+        return bytes_read
+
+    def get_bytes_from_ws_to_eof(self, initial_length=128, max_seek=1000000, end_seek=None):
         """
-        Get bytes from last whitespace character to eof.
+        Get bytes from last whitespace character to eof (or to end_seek).
         return (bytes, start_seek) on success or None on failure.
+        Reads double in reach, but each reads and searches only bytes
+        not already searched.
         """
-        buffer_length = self.length()
+        if end_seek is None:
+            end_seek = self.length()
+        # bytes from searched_seek to end_seek hold no white space.
+        searched_seek = end_seek
+        chunks = []
         seek_offset = initial_length
         while seek_offset < max_seek:
-            seek_position = max(0, buffer_length - seek_offset)
-            (bytes_read, at_eof) = self.get_bytes(seek_position, seek_offset, strict=False)
-            assert at_eof, "read should reach or exceed eof"
-            match = None
-            for match in ws_pattern.finditer(bytes_read):
-                #print repr(bytes_read), "match is", match, match.span()
-                pass
-            if match is not None:
-                start_seek = match.span()[1]
-                bytes_match = bytes_read[start_seek:]
-                absolute_seek = seek_position + start_seek
-                return (bytes_match, absolute_seek)
-            if seek_offset > buffer_length:
+            seek_position = max(0, end_seek - seek_offset)
+            if seek_position < searched_seek:
+                (bytes_read, at_eof) = self.get_bytes(seek_position, searched_seek - seek_position, strict=False)
+                last_ws = rfind_white(bytes(bytes_read))
+                if last_ws >= 0:
+                    found = bytes_read[last_ws + 1:]
+                    if chunks:
+                        chunks.append(found)
+                        found = b"".join(reversed(chunks))
+                    return (found, seek_position + last_ws + 1)
+                chunks.append(bytes_read)
+                searched_seek = seek_position
+            if seek_position == 0:
                 return None
             seek_offset += seek_offset
         return None
@@ -88,26 +118,52 @@ class DataSource:
 
 class BytesSource(DataSource):
 
+    """
+    In memory data source.  Appends go into spare capacity of a buffer
+    which doubles when full, so building up n bytes is amortized linear.
+    get_bytes returns read only memoryview slices of the buffer: appending
+    never modifies bytes already written, and a buffer which is outgrown
+    is left intact for any views still referring to it.
+    """
+
     def __init__(self, byte_data, writeable=False):
-        self.byte_data = bytes(byte_data)
+        self.nbytes = len(byte_data)
+        self.set_buffer(bytearray(byte_data) if writeable else bytes(byte_data))
         self.writeable = writeable
 
+    def set_buffer(self, buffer):
+        self.buffer = buffer
+        self.view = memoryview(buffer).toreadonly()
+
+    @property
+    def byte_data(self):
+        "The content as a bytes copy."
+        return self.view[:self.nbytes].tobytes()
+
     def get_bytes(self, start_seek, length, strict=True):
         end_seek = start_seek + length
-        byte_data = self.byte_data
-        nbytes = len(byte_data)
+        nbytes = self.nbytes
         if start_seek > nbytes:
             raise IndexError("seek start past end of file.")
         if strict and end_seek > nbytes:
             return None
         at_eof = (end_seek >= nbytes)
-        return (byte_data[start_seek:end_seek], at_eof)
+        return (self.view[start_seek:min(end_seek, nbytes)], at_eof)
 
     def append(self, add_bytes):
         self.assertIsWriteable()
-        seek = self.length()
-        self.byte_data = self.byte_data + bytes(add_bytes)
+        seek = self.nbytes
+        end_seek = seek + len(add_bytes)
+        buffer = self.buffer
+        if end_seek > len(buffer):
+            # outgrown: copy into a fresh buffer of double capacity.
+            grown = bytearray(max(end_seek, 2 * len(buffer), 64))
+            grown[:seek] = self.view[:seek]
+            self.set_buffer(grown)
+            buffer = grown
+        buffer[seek:end_seek] = add_bytes
+        self.nbytes = end_seek
         return seek
 
     def length(self):
-        return len(self.byte_data)
+        return self.nbytes
@@ -0,0 +1,301 @@
+"""
+Fast decoding of keys, values, offsets and pellets from bytes.
+
+These functions give the same results as key.key_from_bytes,
+value.values_from_bytes, pellet.offsets_from_bytes and
+pellet.pellet_from_bytes (the reference implementations) but find
+tokens with bytes.split instead of a regular expression and convert
+numbers straight from bytes.  The input must be bytes or a bytearray
+(not a memoryview): values are returned as slices of it.
+"""
+
+from . import key
+from . import value
+from . import pellet
+from array import array
+
+# code points of the bytes matched by data_source.ws_re
+WHITE = frozenset(b" \t\n\r\f\v")
+
+NUMBER = ord(b"N")
+STRING = ord(b"S")
+COMPOSITE = ord(b"C")
+VALUE = ord(b"V")
+PACKED = ord(b"Z")
+DELETED = ord(b"D")
+REFERENCE = ord(b"R")
+OFFSET = ord(b"O")
+VALUE_INDICATORS = frozenset([VALUE, PACKED])
+
+
+def token(data, start, max_length=20):
+    """
+    Like key.white_delimited but undecoded: return (token_bytes, end) for the
+    bytes from start to the first whitespace within max_length bytes, or to
+    the end of data if that is near enough.  Raise FormatError otherwise.
+    """
+    # common case: a newline delimited token without other white space.
+    end = data.find(b"\n", start, start + max_length)
+    if end >= 0:
+        found = data[start:end]
+        if not found or found.split() == [found]:
+            return (found, end + 1)
+    segment = data[start:start + max_length]
+    if segment[:1] and segment[0] in WHITE:
+        return (b"", start + 1)
+    parts = segment.split(None, 1)
+    if parts:
+        found = parts[0]
+        length = len(found)
+        if length < len(segment):
+            # split stopped at white space inside the segment.
+            return (found, start + length + 1)
+        if start + length == len(data):
+            return (found, start + length)
+    raise key.FormatError("white delimited chunk not found")
+
+
+def int_token(data, start, max_length=20):
+    """
+    Return (int, end) for the white delimited token at start, trying a
+    newline delimited run of digits (as written by to_bytes) first.
+    """
+    end = data.find(b"\n", start, start + max_length)
+    if end > start:
+        found = data[start:end]
+        if found.isdigit():
+            return (int(found), end + 1)
+    (found, end) = token(data, start, max_length)
+    return (int(found), end)
+
+
+def number_from_token(found):
+    if found.isdigit() or (found[:1] == b"-" and found[1:].isdigit()):
+        return int(found)
+    try:
+        return int(found)
+    except ValueError:
+        return float(found)
+
+
+def key_from_bytes(data, start=0):
+    "Decode a key from a byte sequence prefix. Return (key, end_index)."
+    nbytes = len(data)
+    if nbytes < start + 2:
+        raise key.FormatError("too few bytes for a key")
+    indicator = data[start]
+    if indicator == NUMBER:
+        (found, end) = token(data, start + 1, 32)
+        return (key.NumberKey(number_from_token(found)), end)
+    if indicator == STRING:
+        (length, len_end) = int_token(data, start + 1)
+        end = len_end + length
+        if (length < 0) or (end > nbytes):
+            raise key.FormatError("invalid length " + repr((length, len_end, nbytes)))
+        result = key.StringKey(data[len_end:end].decode("utf8"))
+        # also consume the white delimiter if available
+        if end < nbytes:
+            if data[end] not in WHITE:
+                raise key.FormatError("Expected whitepace not found.")
+            end += 1
+        return (result, end)
+    if indicator == COMPOSITE:
+        if data[start + 1] not in WHITE:
+            raise key.FormatError("Expected whitepace not found.")
+        (key1, end1) = key_from_bytes(data, start + 2)
+        (key2, end) = key_from_bytes(data, end1)
+        return (key.CompositeKey(key1, key2), end)
+    raise key.FormatError("unknown key indicator " + repr(data[start:start + 1]))
+
+
+def value_from_bytes(data, start):
+    "Decode the value (or reference) bytes at start. Return (value_bytes, end_index)."
+    nbytes = len(data)
+    (length, len_end) = int_token(data, start + 1)
+    end = len_end + length
+    value_bytes = data[len_end:end]
+    # also consume the white delimiter if available
+    if end < nbytes:
+        if data[end] not in WHITE:
+            raise key.FormatError("Expected whitepace not found.")
+        end += 1
+    return (value_bytes, end)
+
+
+def values_from_bytes(data, start=0, lazy=False):
+    """
+    Decode a values container. Return (values, end_index).
+    If lazy, values are only located: the result is a value.LazyValues.
+    Values some of which are compressed give a value.PackedValues.
+    """
+    nbytes = len(data)
+    indicator = data[start] if start < nbytes else None
+    if indicator == VALUE and lazy:
+        first = start
+        bounds = array("q")
+        while indicator == VALUE:
+            (length, len_end) = int_token(data, start + 1)
+            start = len_end + length
+            if start > nbytes:
+                raise key.FormatError("value extends past end of data")
+            bounds.append(len_end)
+            bounds.append(start)
+            if start < nbytes:
+                if data[start] not in WHITE:
+                    raise key.FormatError("Expected whitepace not found.")
+                start += 1
+            indicator = data[start] if start < nbytes else None
+        if indicator == PACKED:
+            # compressed values follow.
+            return packed_values_from_bytes(data, first)
+        return (value.LazyValues(data, first, bounds[-1], bounds), start)
+    if indicator == VALUE:
+        first = start
+        sequence = []
+        while indicator == VALUE:
+            # value_from_bytes, inline
+            (length, len_end) = int_token(data, start + 1)
+            start = len_end + length
+            sequence.append(data[len_end:start])
+            if start < nbytes:
+                if data[start] not in WHITE:
+                    raise key.FormatError("Expected whitepace not found.")
+                start += 1
+            indicator = data[start] if start < nbytes else None
+        if indicator == PACKED:
+            # compressed values follow.
+            return packed_values_from_bytes(data, first)
+        return (value.Values(sequence), start)
+    if indicator == PACKED:
+        return packed_values_from_bytes(data, start)
+    if indicator == DELETED:
+        end = start + 1
+        # also consume the white delimiter if available
+        if end < nbytes:
+            if data[end] not in WHITE:
+                raise key.FormatError("Expected whitepace not found.")
+            end += 1
+        return (value.Deleted(), end)
+    if indicator == REFERENCE:
+        (reference_bytes, end) = value_from_bytes(data, start)
+        return (value.Reference(reference_bytes), end)
+    raise key.FormatError("unknown values indicator " + repr(data[start:start + 1]))
+
+
+def packed_values_from_bytes(data, start):
+    "Decode values some of which are compressed. Return (value.PackedValues, end_index)."
+    nbytes = len(data)
+    indicator = data[start] if start < nbytes else None
+    items = []
+    while indicator == VALUE or indicator == PACKED:
+        (length, len_end) = int_token(data, start + 1)
+        end = len_end + length
+        if end > nbytes:
+            raise key.FormatError("value extends past end of data")
+        items.append((indicator == PACKED, data[len_end:end]))
+        start = end
+        if start < nbytes:
+            if data[start] not in WHITE:
+                raise key.FormatError("Expected whitepace not found.")
+            start += 1
+        indicator = data[start] if start < nbytes else None
+    return (value.PackedValues(items), start)
+
+
+def offsets_from_bytes(data, start=0, max_length=4048):
+    "Decode offsets. Return (payload_length, [(offset, count), ...], end_index)."
+    if data[start:start + 1] != pellet.OFFSET_INDICATOR:
+        raise key.FormatError("unknown key indicator " + repr(data[start:start + 1]))
+    try:
+        (found, end) = token(data, start + 1, max_length)
+    except key.FormatError:
+        raise key.FormatError("Could not find end of offsets within limit.")
+    (payload_length, skips) = skips_from_token(found)
+    return (payload_length, list(zip(skips[0::2], skips[1::2])), end)
+
+
+def skips_from_token(found):
+    "Return (payload_length, flattened skips array) from offsets token bytes."
+    parts = found.split(b"-")
+    skips = array("q")
+    for pair in parts[1:]:
+        [offset, count] = pair.split(b":")
+        skips.append(int(offset))
+        skips.append(int(count))
+    return (int(parts[0]), skips if skips else pellet.NO_SKIPS)
+
+
+def pellet_from_bytes(data, start=0, with_offsets=True, lazy=False):
+    "Decode a pellet (with lazy values if lazy). Return (pellet, end_index)."
+    (pkey, key_end) = key_from_bytes(data, start)
+    (pvalues, end) = values_from_bytes(data, key_end, lazy)
+    result = pellet.Pellet(pkey, pvalues)
+    if with_offsets:
+        # offsets_from_bytes, keeping the skips flat
+        if data[end:end + 1] != pellet.OFFSET_INDICATOR:
+            raise key.FormatError("unknown key indicator " + repr(data[end:end + 1]))
+        try:
+            (found, end) = token(data, end + 1, 4048)
+        except key.FormatError:
+            raise key.FormatError("Could not find end of offsets within limit.")
+        (result.payload_length, result.skips) = skips_from_token(found)
+    return (result, end)
+
+
+def payload_extent(data, start=0):
+    """
+    Follow the length headers of the possibly truncated pellet at start
+    without decoding keys or values.  Return (position, complete): if
+    complete, position is the index of the offsets indicator (the end of the
+    payload plus its delimiter); otherwise the pellet extends at least to
+    position, which is as far as the headers present could be followed.
+    """
+    nbytes = len(data)
+    position = start
+    try:
+        pending_keys = 1
+        while pending_keys:
+            pending_keys -= 1
+            indicator = data[position]
+            if position + 1 >= nbytes:
+                return (position, False)
+            if indicator == COMPOSITE:
+                pending_keys += 2
+                position += 2
+            elif indicator == STRING:
+                (length, len_end) = int_token(data, position + 1)
+                if len_end >= nbytes:
+                    return (position, False)
+                if length < 0:
+                    raise key.FormatError("invalid length " + repr(length))
+                position = len_end + length + 1
+            elif indicator == NUMBER:
+                (found, end) = token(data, position + 1, 32)
+                if end >= nbytes:
+                    return (position, False)
+                position = end
+            else:
+                raise key.FormatError("unknown key indicator " + repr(data[position:position + 1]))
+        indicator = data[position]
+        if indicator == DELETED:
+            position += 2
+        elif indicator == REFERENCE or indicator == VALUE or indicator == PACKED:
+            while True:
+                if position + 1 >= nbytes:
+                    return (position, False)
+                (length, len_end) = int_token(data, position + 1)
+                if len_end >= nbytes:
+                    return (position, False)
+                if length < 0:
+                    raise key.FormatError("invalid length " + repr(length))
+                position = len_end + length + 1
+                if indicator == REFERENCE or data[position] not in VALUE_INDICATORS:
+                    break
+        else:
+            raise key.FormatError("unknown values indicator " + repr(data[position:position + 1]))
+        if data[position] != OFFSET:
+            raise key.FormatError("offsets not found at end of payload")
+        return (position, True)
+    except IndexError:
+        # the pellet continues past the data.
+        return (position, False)
@@ -1,16 +1,48 @@
 from . import data_source
+import mmap
 import os
+import threading
+import time
 
 class FileSource(data_source.DataSource):
 
-    def __init__(self, open_file, writeable=False):
+    """
+    Data source reading an open binary file.
+
+    With positional=True reads use os.pread so no shared file position is
+    involved and one source may serve many reader threads without locking.
+    The length is then cached: appends through this source keep it current
+    and refresh_length() picks up bytes appended by other writers.
+    """
+
+    def __init__(self, open_file, writeable=False, positional=False):
         self.open_file = open_file
         self.writeable = writeable
+        self.positional = positional
+        self.cached_length = None
+        self.append_lock = None
+        if positional:
+            if not hasattr(os, "pread"):
+                raise ValueError("positional reads are not supported on this platform.")
+            # pending buffered writes are invisible to pread.
+            open_file.flush()
+            self.append_lock = threading.Lock()
+            self.refresh_length()
 
     def close(self):
         self.open_file.close()
         self.open_file = None
 
+    def refresh_length(self):
+        """
+        Reset the cached length from the file system and return it.
+        """
+        f = self.open_file
+        if f is None:
+            raise IOError("No open file.")
+        self.cached_length = os.fstat(f.fileno()).st_size
+        return self.cached_length
+
     def get_bytes(self, start_seek, length, strict=True):
         f = self.open_file
         if f is None:
@@ -20,21 +52,298 @@ class FileSource(data_source.DataSource):
             raise IndexError("seek past end of file.")
         if strict and start_seek + length > end_seek:
             return None
-        f.seek(start_seek)
-        result = f.read(length)
-        this_seek = f.tell()
+        if self.positional:
+            # never read past the cached length.
+            result = os.pread(f.fileno(), min(length, end_seek - start_seek), start_seek)
+            this_seek = start_seek + len(result)
+        else:
+            f.seek(start_seek)
+            result = f.read(length)
+            this_seek = f.tell()
         at_eof = (this_seek >= end_seek)
         return (result, at_eof)
 
+    def snapshot_length(self):
+        """
+        With positional=True the cached length, which grows only when an
+        append completes.  Otherwise the file length, which is only
+        reliable in the thread doing the appends.
+        """
+        return self.length()
+
+    def read_at(self, start_seek, length):
+        "Positional read which neither moves nor depends on the file position."
+        f = self.open_file
+        if f is None:
+            raise IOError("No open file.")
+        return os.pread(f.fileno(), length, start_seek)
+
     def append(self, add_bytes):
         self.assertIsWriteable()
+        if self.positional:
+            with self.append_lock:
+                seek = self.cached_length
+                fileno = self.open_file.fileno()
+                view = memoryview(add_bytes)
+                written = 0
+                while written < len(view):
+                    written += os.pwrite(fileno, view[written:], seek + written)
+                self.cached_length = seek + written
+            return seek
         # length seeks to eof
         seek = self.length()
         self.open_file.write(add_bytes)
         return seek
 
     def length(self):
+        if self.positional:
+            return self.cached_length
         f = self.open_file
         f.seek(0, os.SEEK_END)
         end_seek = f.tell()
         return end_seek
+
+
+class CommitPolicy(object):
+
+    """
+    When buffered appends are flushed (or fsynced): after every append,
+    once at least nbytes are outstanding, once milliseconds have passed
+    since the last commit, or (with no options) only when asked explicitly.
+    """
+
+    def __init__(self, each=False, nbytes=None, milliseconds=None):
+        self.each = each
+        self.nbytes = nbytes
+        self.milliseconds = milliseconds
+
+    def due(self, outstanding_bytes, elapsed_milliseconds):
+        if outstanding_bytes <= 0:
+            return False
+        if self.each:
+            return True
+        if self.nbytes is not None and outstanding_bytes >= self.nbytes:
+            return True
+        if self.milliseconds is not None and elapsed_milliseconds >= self.milliseconds:
+            return True
+        return False
+
+EACH_APPEND = CommitPolicy(each=True)
+EXPLICIT = CommitPolicy()
+
+def every_bytes(nbytes):
+    return CommitPolicy(nbytes=nbytes)
+
+def every_milliseconds(milliseconds):
+    return CommitPolicy(milliseconds=milliseconds)
+
+
+class BufferedFileSource(FileSource):
+
+    """
+    Writeable file source which keeps the logical end of data in memory and
+    coalesces appends into large writes according to flush_policy.
+    fsync_policy decides when flushed data is also forced to disk.
+    append returns the final seek of the appended bytes immediately.
+    Reads of not yet flushed bytes flush first.
+    Time based policies hold while the writer is idle too: an append
+    leaving bytes outstanding arms a timer thread which commits them when
+    due.  Appends, reads and commits may then run on different threads,
+    so they are serialized by a lock.
+    """
+
+    def __init__(self, open_file, flush_policy=EXPLICIT, fsync_policy=EXPLICIT, positional=False):
+        FileSource.__init__(self, open_file, writeable=True, positional=positional)
+        open_file.flush()
+        self.flush_policy = flush_policy
+        self.fsync_policy = fsync_policy
+        self.flushed_length = os.fstat(open_file.fileno()).st_size
+        self.synced_length = self.flushed_length
+        self.end_seek = self.flushed_length
+        self.pending = []
+        now = time.time()
+        self.flush_time = self.sync_time = now
+        self.lock = threading.RLock()
+        self.timer = None
+
+    def length(self):
+        return self.end_seek
+
+    def snapshot_length(self):
+        "Only flushed appends are visible to readers of the file."
+        return self.flushed_length
+
+    def append(self, add_bytes):
+        self.assertIsWriteable()
+        with self.lock:
+            seek = self.end_seek
+            self.pending.append(bytes(add_bytes))
+            self.end_seek = seek + len(add_bytes)
+            self.commit_due()
+            return seek
+
+    def commit_due(self):
+        "Flush or sync if a policy says so, and arm the timer for what is left."
+        now = time.time()
+        if self.fsync_policy.due(self.end_seek - self.synced_length, 1000.0 * (now - self.sync_time)):
+            self.sync()
+        elif self.flush_policy.due(self.end_seek - self.flushed_length, 1000.0 * (now - self.flush_time)):
+            self.flush()
+        self.arm_timer(now)
+
+    def arm_timer(self, now):
+        "Start the timer for the earliest time based commit of outstanding bytes, if any."
+        if self.timer is not None or self.open_file is None:
+            return
+        delays = []
+        for (policy, committed_length, committed_time) in (
+                (self.flush_policy, self.flushed_length, self.flush_time),
+                (self.fsync_policy, self.synced_length, self.sync_time)):
+            if policy.milliseconds is not None and self.end_seek > committed_length:
+                delays.append(committed_time + policy.milliseconds / 1000.0 - now)
+        if delays:
+            self.timer = threading.Timer(max(0.0, min(delays)), self.on_timer)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def on_timer(self):
+        with self.lock:
+            self.timer = None
+            if self.open_file is not None:
+                self.commit_due()
+
+    def flush(self):
+        "Write all pending appends to the file."
+        with self.lock:
+            end_seek = self.end_seek
+            if self.pending:
+                data = b"".join(self.pending)
+                self.pending = []
+                if self.positional:
+                    FileSource.append(self, data)
+                else:
+                    f = self.open_file
+                    f.seek(0, os.SEEK_END)
+                    f.write(data)
+            self.open_file.flush()
+            # only now may readers (see snapshot_length) rely on the data.
+            self.flushed_length = end_seek
+            self.flush_time = time.time()
+
+    def sync(self):
+        "Flush pending appends and force them to disk."
+        with self.lock:
+            self.flush()
+            os.fsync(self.open_file.fileno())
+            self.synced_length = self.flushed_length
+            self.sync_time = self.flush_time
+
+    def get_bytes(self, start_seek, length, strict=True):
+        with self.lock:
+            if self.pending and start_seek + length > self.flushed_length:
+                self.flush()
+            return FileSource.get_bytes(self, start_seek, length, strict)
+
+    def close(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            self.flush()
+            if self.fsync_policy is not EXPLICIT:
+                self.sync()
+            FileSource.close(self)
+
+
+class MmapSource(data_source.DataSource):
+
+    """
+    Read only data source which maps the whole file into memory.
+    Reads return memoryview slices into the map rather than copies.
+    A map replaced by refresh() or dropped by close() is not closed
+    explicitly: it is unmapped once the last slice of it is gone.
+
+    Only callers parsing the slices themselves (pellet.pellet_from_bytes,
+    value.LazyValues) avoid copying: the store and index readers parse
+    with fast_parse, which needs bytes, so they copy what they read and
+    gain only the saved read system calls.
+    """
+
+    def __init__(self, open_file):
+        self.open_file = open_file
+        self.mapped = None
+        self.view = None
+        self.refresh()
+
+    def refresh(self):
+        """
+        Remap the file, picking up bytes appended since the last mapping.
+        """
+        self.release()
+        f = self.open_file
+        if f is None:
+            raise IOError("No open file.")
+        f.flush()
+        size = os.fstat(f.fileno()).st_size
+        if size > 0:
+            self.mapped = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+            self.view = memoryview(self.mapped)
+        else:
+            # zero length files cannot be mapped.
+            self.view = memoryview(b"")
+
+    def release(self):
+        # slices of the old map may still be alive (in pellet values, say):
+        # closing it would fail, so leave it to be collected after them.
+        self.view = None
+        self.mapped = None
+
+    def close(self):
+        self.release()
+        self.open_file.close()
+        self.open_file = None
+
+    def length(self):
+        view = self.view
+        if view is None:
+            raise IOError("No open file.")
+        return len(view)
+
+    def get_bytes(self, start_seek, length, strict=True):
+        view = self.view
+        if view is None:
+            raise IOError("No open file.")
+        nbytes = len(view)
+        end_seek = start_seek + length
+        if start_seek > nbytes:
+            raise IndexError("seek past end of file.")
+        if strict and end_seek > nbytes:
+            return None
+        at_eof = (end_seek >= nbytes)
+        return (view[start_seek:end_seek], at_eof)
+
+    def get_bytes_from_ws_to_eof(self, initial_length=128, max_seek=1000000, end_seek=None):
+        # search the map directly instead of re-reading growing suffixes.
+        nbytes = self.length() if end_seek is None else end_seek
+        if nbytes == 0:
+            return None
+        limit = max(0, nbytes - max_seek)
+        last_ws = data_source.rfind_white(self.mapped, limit, nbytes)
+        if last_ws < 0:
+            return None
+        start_seek = last_ws + 1
+        return (self.view[start_seek:nbytes], start_seek)
+
+    def get_bytes_to_ws_or_eof(self, start_seek, initial_length=128, max_length=1000000):
+        nbytes = self.length()
+        if start_seek > nbytes:
+            raise IndexError("seek past end of file.")
+        if nbytes == 0:
+            return self.view[0:0]
+        end_seek = min(nbytes, start_seek + max_length)
+        match = data_source.ws_pattern.search(self.mapped, start_seek, end_seek)
+        if match:
+            return self.view[start_seek:match.start()]
+        if end_seek >= nbytes:
+            return self.view[start_seek:]
+        return None
@@ -0,0 +1,139 @@
+"""
+Footer: a fixed width amends token at the end of a file recording the
+seek of the last pellet and of an optional index block, so a reader opening
+the file reads a few bytes from the end instead of searching back for
+white space, and can load the index without scanning the pellets.
+
+    >F<last pellet seek><index block seek><index block length>
+
+with each field 16 hex digits.  The index block is the amends token
+
+    >I<base64 of an index.KeyIndex sidecar>
+
+covering the pellets before it.  Scans skip amends, so pellets may be
+appended after a footer (the footer is then stale: tails are found the
+old way until a new footer is written).  format.html gives the grammar,
+including where amends may appear.
+"""
+
+from . import data_source
+from . import index
+from . import key
+from . import pellet
+import base64
+
+FOOTER_INDICATOR = b">F"
+INDEX_INDICATOR = b">I"
+FIELD_WIDTH = 16
+FOOTER_SIZE = len(FOOTER_INDICATOR) + 3 * FIELD_WIDTH
+FIELD_FORMAT = "%016x"
+
+
+class Footer(object):
+
+    "Seeks recorded by a footer: index_length is 0 if there is no index block."
+
+    __slots__ = ("last_seek", "index_seek", "index_length")
+
+    def __init__(self, last_seek, index_seek=0, index_length=0):
+        self.last_seek = last_seek
+        self.index_seek = index_seek
+        self.index_length = index_length
+
+    def to_bytes(self):
+        fields = (FIELD_FORMAT * 3) % (self.last_seek, self.index_seek, self.index_length)
+        return FOOTER_INDICATOR + fields.encode("ascii")
+
+    @classmethod
+    def from_bytes(cls, encoded):
+        "The footer encoded in exactly FOOTER_SIZE bytes, or None if they are not a footer."
+        encoded = bytes(encoded)
+        if len(encoded) != FOOTER_SIZE or not encoded.startswith(FOOTER_INDICATOR):
+            return None
+        start = len(FOOTER_INDICATOR)
+        fields = []
+        for i in range(3):
+            field = encoded[start:start + FIELD_WIDTH]
+            try:
+                fields.append(int(field, 16))
+            except ValueError:
+                return None
+            start += FIELD_WIDTH
+        return cls(*fields)
+
+
+def footer_block(last_seek, end_seek, key_index=None):
+    """
+    Bytes to append to data of length end_seek: a delimiter, the index
+    block of key_index if given, and the footer.
+    """
+    chunks = []
+    footer = Footer(last_seek)
+    if key_index is not None:
+        block = INDEX_INDICATOR + base64.b64encode(key_index.to_bytes())
+        footer.index_seek = end_seek + 1
+        footer.index_length = len(block)
+        chunks.append(block)
+    chunks.append(footer.to_bytes())
+    return b"\n" + b"\n".join(chunks)
+
+
+def read_footer(source):
+    "The footer ending source, or None if it does not end with one."
+    nbytes = source.length()
+    if nbytes < FOOTER_SIZE + 1:
+        return None
+    (tail_bytes, at_eof) = source.get_bytes(nbytes - FOOTER_SIZE - 1, FOOTER_SIZE + 1)
+    # the footer is a whole token.
+    if not data_source.ws_pattern.match(bytes(tail_bytes[:1])):
+        return None
+    return Footer.from_bytes(tail_bytes[1:])
+
+
+def read_index(source, footer):
+    "The index.KeyIndex in the index block recorded by footer, or None if there is none."
+    if not footer.index_length:
+        return None
+    block = source.get_bytes(footer.index_seek, footer.index_length)
+    if block is None:
+        raise key.FormatError("index block extends past end of data")
+    block = bytes(block[0])
+    if not block.startswith(INDEX_INDICATOR):
+        raise key.FormatError("no index block at seek " + repr(footer.index_seek))
+    encoded = base64.b64decode(block[len(INDEX_INDICATOR):])
+    # the block is part of the data it indexes.
+    return index.KeyIndex.from_bytes(source, encoded, verify=False)
+
+
+def open_index(source):
+    """
+    An index.KeyIndex of source loaded from the index block named by the
+    footer if there is one (else empty), caught up with any later pellets.
+    """
+    footer = read_footer(source)
+    key_index = None
+    if footer is not None:
+        key_index = read_index(source, footer)
+    if key_index is None:
+        key_index = index.KeyIndex(source)
+    key_index.catch_up()
+    return key_index
+
+
+def last_token(source):
+    """
+    (bytes, seek) of the last white delimited token in source which is not
+    an amends, or None if there is none.
+    """
+    end_seek = None
+    while True:
+        found = source.get_bytes_from_ws_to_eof(end_seek=end_seek)
+        if found is None:
+            return None
+        (tail_bytes, tail_seek) = found
+        if bytes(tail_bytes[:1]) != pellet.AMENDS_INDICATOR:
+            return found
+        # step back over the amends and its delimiter.
+        end_seek = tail_seek - 1
+        if end_seek <= 0:
+            return None
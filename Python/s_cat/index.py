@@ -0,0 +1,516 @@
+"""
+Key index for (not necessarily sorted) s_cat data: maps each key to the
+seek and payload length of the last pellet written for it, so a lookup is
+one probe plus one read of exactly the payload bytes.
+
+The index may be saved as a compact sidecar file recording the length of
+data it covers and a fingerprint of that data; opening it later loads
+the arrays directly and indexes only the pellets appended since.
+"""
+
+from . import compress
+from . import key
+from . import value
+from . import pellet
+from . import fast_parse
+from array import array
+import bisect
+import hashlib
+import os
+import struct
+import sys
+import tempfile
+
+SIDECAR_MAGIC = b"SCATIDX2"
+SIDECAR_HEADER = struct.Struct("<QQQ16s")
+# sidecar fingerprints hash this many bytes from each end of the covered data.
+FINGERPRINT_BYTES = 4096
+# get_many joins reads of payloads at most this many bytes apart...
+COALESCE_GAP = 4096
+# ...into reads of at most this many bytes (unless one payload is longer).
+MAX_COALESCED_READ = 1 << 20
+
+
+class SidecarError(key.FormatError):
+    "Sidecar index file is not recognized."
+    pass
+
+
+def data_fingerprint(data_source, covered_length):
+    """
+    Hash of covered_length and the first and last FINGERPRINT_BYTES of
+    the data up to it, or None if the data source is shorter.
+    """
+    if covered_length > data_source.length():
+        return None
+    digest = hashlib.blake2b(struct.pack("<Q", covered_length), digest_size=16)
+    if covered_length <= 2 * FINGERPRINT_BYTES:
+        extents = [(0, covered_length)]
+    else:
+        extents = [(0, FINGERPRINT_BYTES), (covered_length - FINGERPRINT_BYTES, FINGERPRINT_BYTES)]
+    for (seek, length) in extents:
+        if length > 0:
+            digest.update(data_source.get_bytes(seek, length)[0])
+    return digest.digest()
+
+
+def check_fingerprint(data_source, covered_length, fingerprint, kind):
+    "Raise SidecarError unless a sidecar of kind was made for the data of data_source."
+    if fingerprint != data_fingerprint(data_source, covered_length):
+        raise SidecarError("sidecar " + kind + " is for other data")
+
+
+def save_sidecar(path, encoded):
+    """
+    Write the sidecar bytes encoded to path, replacing any previous file
+    atomically through a temporary file of its own in the same directory
+    (so concurrent saves do not share one).
+    """
+    (fd, temp_path) = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp",
+                                       dir=os.path.dirname(path) or None)
+    try:
+        # the permissions open() would have given, not mkstemp's owner only ones.
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(temp_path, 0o666 & ~umask)
+        with os.fdopen(fd, "wb") as f:
+            f.write(encoded)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def read_sidecar(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def open_sidecar(path, decode, fresh, save=True):
+    """
+    A sidecar (KeyIndex or bloom.BloomFilter) decoded from the file at
+    path by decode(bytes) if it is usable, else fresh(), then caught up
+    with pellets past the covered length and saved if save and any were
+    added (or there was no file).
+    """
+    sidecar = None
+    if os.path.exists(path):
+        try:
+            sidecar = decode(read_sidecar(path))
+        except SidecarError:
+            # damaged, or made for some other data.
+            sidecar = None
+    if sidecar is None:
+        sidecar = fresh()
+    added = sidecar.catch_up()
+    if save and (added or not os.path.exists(path)):
+        sidecar.save(path)
+    return sidecar
+
+
+def unsigned_array(data=b""):
+    "array of 64 bit unsigned ints from little endian bytes"
+    result = array("Q")
+    result.frombytes(data)
+    if sys.byteorder != "little":   # pragma: no cover
+        result.byteswap()
+    return result
+
+def array_bytes(a):
+    if sys.byteorder != "little":   # pragma: no cover
+        a = array(a.typecode, a)
+        a.byteswap()
+    return a.tobytes()
+
+
+class KeyTable(object):
+
+    "Immutable sorted table of encoded keys with their seeks and payload lengths."
+
+    def __init__(self, seeks, payload_lengths, key_offsets, blob):
+        self.seeks = seeks
+        self.payload_lengths = payload_lengths
+        self.key_offsets = key_offsets
+        self.blob = blob
+
+    @classmethod
+    def from_entries(cls, entries):
+        "Build from a dictionary of key_bytes --> (seek, payload_length)."
+        seeks = array("Q")
+        payload_lengths = array("Q")
+        key_offsets = array("Q", [0])
+        keys = sorted(entries)
+        for key_bytes in keys:
+            (seek, payload_length) = entries[key_bytes]
+            seeks.append(seek)
+            payload_lengths.append(payload_length)
+            key_offsets.append(key_offsets[-1] + len(key_bytes))
+        return cls(seeks, payload_lengths, key_offsets, b"".join(keys))
+
+    def __len__(self):
+        return len(self.seeks)
+
+    def key_at(self, i):
+        offsets = self.key_offsets
+        return self.blob[offsets[i]: offsets[i + 1]]
+
+    def items(self):
+        for i in range(len(self)):
+            yield (bytes(self.key_at(i)), (self.seeks[i], self.payload_lengths[i]))
+
+    def find(self, key_bytes):
+        "Binary search for key_bytes: return (seek, payload_length) or None."
+        low = 0
+        high = len(self.seeks)
+        while low < high:
+            middle = (low + high) // 2
+            if self.key_at(middle) < key_bytes:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self.seeks) and self.key_at(low) == key_bytes:
+            return (self.seeks[low], self.payload_lengths[low])
+        return None
+
+
+class TableBuilder(object):
+
+    """
+    Collects index entries in compact arrays, for indexing many pellets
+    (a bulk load, say) without a dictionary entry per key.  It has the
+    record method of KeyIndex, so a writer can keep it current; see
+    KeyIndex.absorb.
+    """
+
+    def __init__(self):
+        self.seeks = array("Q")
+        self.payload_lengths = array("Q")
+        self.key_offsets = array("Q", [0])
+        self.blob = bytearray()
+        self.covered_length = None
+
+    def __len__(self):
+        return len(self.seeks)
+
+    def record(self, key_bytes, seek, payload_length, covered_length):
+        "Collect the entry of a pellet just written, covering data up to covered_length."
+        self.seeks.append(seek)
+        self.payload_lengths.append(payload_length)
+        self.blob += key_bytes
+        self.key_offsets.append(len(self.blob))
+        self.covered_length = covered_length
+
+    def table(self):
+        "KeyTable of the entries collected, the last entry for a key winning."
+        blob = bytes(self.blob)
+        offsets = self.key_offsets
+        def key_at(i):
+            return blob[offsets[i]:offsets[i + 1]]
+        # stable: equal keys stay in recording order.
+        order = sorted(range(len(self.seeks)), key=key_at)
+        seeks = array("Q")
+        payload_lengths = array("Q")
+        key_offsets = array("Q", [0])
+        keys = []
+        for (position, i) in enumerate(order):
+            key_bytes = key_at(i)
+            if position + 1 < len(order) and key_at(order[position + 1]) == key_bytes:
+                # superseded by a later entry.
+                continue
+            seeks.append(self.seeks[i])
+            payload_lengths.append(self.payload_lengths[i])
+            key_offsets.append(key_offsets[-1] + len(key_bytes))
+            keys.append(key_bytes)
+        return KeyTable(seeks, payload_lengths, key_offsets, b"".join(keys))
+
+
+class KeyIndex(object):
+
+    """
+    Index of the pellets in a data source.  Later pellets for a key
+    override earlier ones.  Entries for deleted keys are kept so they shadow
+    earlier pellets; get() reports them as absent.  A compression
+    dictionary carried by the source is registered.
+    """
+
+    def __init__(self, data_source, table=None, covered_length=0):
+        compress.source_dictionary(data_source)
+        self.data_source = data_source
+        self.table = table
+        # entries indexed since the table was built.
+        self.entries = {}
+        self.covered_length = covered_length
+        # (sort keys, key bytes) of all keys in key order, built on demand.
+        self.ordered = None
+        # close() closes the data source only if the index opened it.
+        self.owns_source = False
+
+    def close(self):
+        "Close the data source if the index owns it (see parallel.build_index)."
+        if self.owns_source:
+            self.data_source.close()
+            self.owns_source = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        if self.table is None:
+            return len(self.entries)
+        return len(self.table) + sum(1 for k in self.entries if self.table.find(k) is None)
+
+    def catch_up(self):
+        "Index any pellets past the covered length.  Return the number indexed."
+        source = self.data_source
+        entries = self.entries
+        end_seek = source.length()
+        count = 0
+        for (seek, result) in pellet.iter_pellets(source, self.covered_length, lazy=True):
+            entries[result.key.to_bytes()] = (seek, result.payload_length)
+            count += 1
+        if count:
+            self.ordered = None
+        self.covered_length = end_seek
+        return count
+
+    def record(self, key_bytes, seek, payload_length, covered_length):
+        "Index a pellet just written, covering data up to covered_length."
+        if key_bytes not in self.entries:
+            self.ordered = None
+        self.entries[key_bytes] = (seek, payload_length)
+        self.covered_length = covered_length
+
+    def builder(self):
+        "A TableBuilder to collect entries for pellets appended next (see absorb)."
+        return TableBuilder()
+
+    def absorb(self, builder):
+        "Add the entries collected by builder, which override those already indexed."
+        if builder.covered_length is None:
+            return
+        table = builder.table()
+        if self.table is None and not self.entries:
+            self.table = table
+        else:
+            entries = dict(self.items())
+            entries.update(table.items())
+            self.table = KeyTable.from_entries(entries)
+            self.entries = {}
+        self.ordered = None
+        self.covered_length = builder.covered_length
+
+    def find_bytes(self, key_bytes):
+        "Return (seek, payload_length) for the encoded key, or None."
+        found = self.entries.get(key_bytes)
+        if found is None and self.table is not None:
+            found = self.table.find(key_bytes)
+        return found
+
+    def find(self, k):
+        "Return (seek, payload_length) of the last pellet for k, or None."
+        return self.find_bytes(k.to_bytes())
+
+    def get(self, k, lazy=False):
+        """
+        Return the values container stored for k, or None if absent or deleted.
+        If lazy, values are decoded on demand (value.LazyValues).
+        """
+        found = self.find(k)
+        if found is None:
+            return None
+        (seek, payload_length) = found
+        result = self.values_at(seek, payload_length, lazy)
+        if isinstance(result, value.Deleted):
+            return None
+        return result
+
+    def get_many(self, keys, lazy=False, gap=COALESCE_GAP, max_read=MAX_COALESCED_READ):
+        """
+        Look up a batch of keys.  Return (results, missing) where results[i]
+        is the values container for keys[i] or None if it is absent or
+        deleted, and missing lists those keys in request order.
+        The payloads are read in seek order, with payloads less than gap
+        bytes apart fetched by one read of at most max_read bytes.
+        """
+        results = [None] * len(keys)
+        extents = []
+        for (i, k) in enumerate(keys):
+            found = self.find(k)
+            if found is not None:
+                (seek, payload_length) = found
+                extents.append((seek, seek + payload_length, i))
+        extents.sort()
+        get_bytes = self.data_source.get_bytes
+        for group in coalesce(extents, gap, max_read):
+            start = group[0][0]
+            end = max(extent[1] for extent in group)
+            (chunk, at_eof) = get_bytes(start, end - start)
+            data = bytes(chunk)
+            for (seek, payload_end, i) in group:
+                (pkey, key_end) = fast_parse.key_from_bytes(data, seek - start)
+                (values, values_end) = fast_parse.values_from_bytes(data, key_end, lazy)
+                if not isinstance(values, value.Deleted):
+                    results[i] = values
+        missing = [k for (k, result) in zip(keys, results) if result is None]
+        return (results, missing)
+
+    def values_at(self, seek, payload_length, lazy=False):
+        "Decode the values of the pellet whose payload has this extent."
+        (payload, at_eof) = self.data_source.get_bytes(seek, payload_length)
+        return payload_values(payload, lazy)
+
+    def key_order(self):
+        "Return (sort keys, key bytes) for all indexed keys in key order."
+        if self.ordered is None:
+            pairs = sorted((key.key_from_bytes(key_bytes)[0].sort_key(), key_bytes)
+                           for (key_bytes, found) in self.items())
+            self.ordered = ([sort_key for (sort_key, key_bytes) in pairs],
+                            [key_bytes for (sort_key, key_bytes) in pairs])
+        return self.ordered
+
+    def scan(self, start_key=None, end_key=None, lazy=False):
+        """
+        Generate (key, values) in key order for the keys k with
+        start_key <= k < end_key (either bound may be None), omitting
+        deleted keys.  Only the pellets in the range are read.
+        """
+        low = None if start_key is None else start_key.sort_key()
+        high = None if end_key is None else end_key.sort_key()
+        return self.scan_sort_keys(low, high, lazy)
+
+    def prefix_scan(self, prefix, lazy=False):
+        """
+        Generate (key, values) like scan for the key prefix and the keys
+        extending it (see key.prefix_sort_key_ranges).
+        """
+        for (low, high) in key.prefix_sort_key_ranges(prefix):
+            for item in self.scan_sort_keys(low, high, lazy):
+                yield item
+
+    def scan_sort_keys(self, low, high, lazy=False):
+        "scan for keys with low <= k.sort_key() < high, found by bisection."
+        (sort_keys, key_list) = self.key_order()
+        first = 0 if low is None else bisect.bisect_left(sort_keys, low)
+        last = len(sort_keys) if high is None else bisect.bisect_left(sort_keys, high)
+        for i in range(first, last):
+            key_bytes = key_list[i]
+            (seek, payload_length) = self.find_bytes(key_bytes)
+            values = self.values_at(seek, payload_length, lazy)
+            if not isinstance(values, value.Deleted):
+                yield (key.key_from_bytes(key_bytes)[0], values)
+
+    def items(self):
+        "Generate (key_bytes, (seek, payload_length)) in no particular order."
+        entries = self.entries
+        if self.table is not None:
+            for (key_bytes, found) in self.table.items():
+                if key_bytes not in entries:
+                    yield (key_bytes, found)
+        for item in entries.items():
+            yield item
+
+    def freeze(self):
+        "Merge recently indexed entries into the sorted table."
+        if self.entries or self.table is None:
+            self.table = KeyTable.from_entries(dict(self.items()))
+            self.entries = {}
+        return self.table
+
+    def to_bytes(self):
+        table = self.freeze()
+        fingerprint = data_fingerprint(self.data_source, self.covered_length)
+        header = SIDECAR_HEADER.pack(self.covered_length, len(table), len(table.blob), fingerprint)
+        return b"".join([
+            SIDECAR_MAGIC,
+            header,
+            array_bytes(table.seeks),
+            array_bytes(table.payload_lengths),
+            array_bytes(table.key_offsets),
+            table.blob,
+        ])
+
+    def save(self, path):
+        "Write the sidecar file, replacing any previous one atomically."
+        save_sidecar(path, self.to_bytes())
+
+    @classmethod
+    def from_bytes(cls, data_source, encoded, verify=True):
+        """
+        Index decoded from sidecar bytes.  Unless verify is false (the
+        caller knows they belong to data_source) raise SidecarError if
+        they were made for other data.
+        """
+        encoded = memoryview(encoded)
+        nmagic = len(SIDECAR_MAGIC)
+        start = nmagic + SIDECAR_HEADER.size
+        if encoded[:nmagic] != SIDECAR_MAGIC or len(encoded) < start:
+            raise SidecarError("not a sidecar index")
+        (covered_length, count, blob_length, fingerprint) = SIDECAR_HEADER.unpack(encoded[nmagic:start])
+        if verify:
+            check_fingerprint(data_source, covered_length, fingerprint, "index")
+        arrays = []
+        for size in (count, count, count + 1):
+            end = start + 8 * size
+            if end > len(encoded):
+                raise SidecarError("truncated sidecar index")
+            arrays.append(unsigned_array(encoded[start:end]))
+            start = end
+        blob = encoded[start:start + blob_length].tobytes()
+        if len(blob) != blob_length:
+            raise SidecarError("truncated sidecar index")
+        [seeks, payload_lengths, key_offsets] = arrays
+        table = KeyTable(seeks, payload_lengths, key_offsets, blob)
+        return cls(data_source, table, covered_length)
+
+    @classmethod
+    def load(cls, data_source, path):
+        return cls.from_bytes(data_source, read_sidecar(path))
+
+    @classmethod
+    def open(cls, data_source, path, save=True):
+        """
+        Load the sidecar index at path if it is usable, else start afresh,
+        then index pellets past the covered length, saving if any were added.
+        """
+        return open_sidecar(path, lambda encoded: cls.from_bytes(data_source, encoded),
+                            lambda: cls(data_source), save)
+
+
+def coalesce(extents, gap=COALESCE_GAP, max_read=MAX_COALESCED_READ):
+    """
+    Group sorted (start, end, ...) extents into lists whose extents are less
+    than gap bytes apart and span at most max_read bytes (or one extent).
+    """
+    group = []
+    group_start = group_end = None
+    for extent in extents:
+        (start, end) = extent[:2]
+        if group and (start - group_end >= gap or max(end, group_end) - group_start > max_read):
+            yield group
+            group = []
+        if not group:
+            group_start = start
+            group_end = end
+        group.append(extent)
+        group_end = max(group_end, end)
+    if group:
+        yield group
+
+
+def payload_values(payload, lazy=False):
+    "Decode the values container from pellet payload bytes (key and values)."
+    (pkey, key_end) = key.key_from_bytes(payload)
+    if lazy:
+        # the values run to the end of the payload: locate them on demand
+        # unless compressed values (which LazyValues does not hold) follow.
+        start = key_end
+        if payload[start:start + 1] == b"V":
+            (bounds, values_end) = value.value_bounds(payload, start)
+            if values_end >= len(payload):
+                return value.LazyValues(payload, start, values_end, bounds)
+    (result, end) = value.values_from_bytes(payload, key_end)
+    return result
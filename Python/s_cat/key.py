@@ -1,5 +1,6 @@
 
 from . import data_source
+import struct
 
 # py3 hack
 try:   # pragma: no cover
@@ -17,6 +18,11 @@ class Key(object):
 
     "Abstract superclass: an index key."
 
+    __slots__ = ("cached_sort_key",)
+
+    def __init__(self):
+        self.cached_sort_key = None
+
     def less_than(self, other):
         "compare self to other of same kind."
         raise NotImplementedError("Implement at subclass")
@@ -25,13 +31,21 @@ class Key(object):
         "representation as byte sequence."
         raise NotImplementedError("Implement at subclass")
 
+    def sort_key(self):
+        """
+        Order preserving byte encoding (cached):
+        k1 < k2 exactly when k1.sort_key() < k2.sort_key().
+        """
+        result = self.cached_sort_key
+        if result is None:
+            result = self.cached_sort_key = self.encode_sort_key()
+        return result
+
+    def encode_sort_key(self):
+        raise ValueError("Key class has no order: " + repr(type(self)))
+
     def __lt__(self, other):
-        class_test = class_cmp(type(self), type(other))
-        if class_test < 0:
-            return True
-        if class_test > 0:
-            return False
-        return self.less_than(other)
+        return self.sort_key() < other.sort_key()
 
     def __eq__(self, other):
         return self.value() == other.value()
@@ -49,8 +63,11 @@ class NumberKey(Key):
 
     INDICATOR = b'N'
 
+    __slots__ = ("number",)
+
     def __init__(self, number):
         self.number = number
+        self.cached_sort_key = None
 
     def less_than(self, other):
         return self.number < other.number
@@ -58,6 +75,9 @@ class NumberKey(Key):
     def value(self):
         return self.number
 
+    def encode_sort_key(self):
+        return NUMBER_SORT_TAG + number_sort_bytes(self.number)
+
     def to_bytes(self):
         return self.INDICATOR + unicode_(self.number).encode("ascii")
 
@@ -68,13 +88,17 @@ class StringKey(Key):
 
     INDICATOR = b'S'
 
+    __slots__ = ("string",)
+
     def __init__(self, string):
         ts = type(string)
-        if ts is bytes:
+        if ts is not unicode_:
+            # bytes or any other utf8 buffer (bytearray, memoryview...)
             string = unicode_(string, "utf8")
             ts = type(string)
         assert ts is unicode_
         self.string = string
+        self.cached_sort_key = None
 
     def less_than(self, other):
         return self.string < other.string
@@ -82,6 +106,9 @@ class StringKey(Key):
     def value(self):
         return self.string
 
+    def encode_sort_key(self):
+        return STRING_SORT_TAG + string_sort_bytes(self.string)
+
     def to_bytes(self):
         byt = self.string.encode("utf8")
         length = len(byt)
@@ -96,11 +123,14 @@ class CompositeKey(Key):
 
     INDICATOR = b'C'
 
+    __slots__ = ("key1", "key2")
+
     def __init__(self, key1, key2):
         assert isinstance(key1, Key)
         assert isinstance(key2, Key)
         self.key1 = key1
         self.key2 = key2
+        self.cached_sort_key = None
 
     def less_than(self, other):
         if self.key1 < other.key1:
@@ -112,6 +142,10 @@ class CompositeKey(Key):
     def value(self):
         return (self.key1.value(), self.key2.value())
 
+    def encode_sort_key(self):
+        # component encodings are prefix free so concatenation keeps the order.
+        return COMPOSITE_SORT_TAG + self.key1.sort_key() + self.key2.sort_key()
+
     def to_bytes(self):
         byt1 = self.key1.to_bytes()
         byt2 = self.key2.to_bytes()
@@ -124,6 +158,91 @@ def class_cmp(class1, class2):
     index2 = class_order.index(class2)
     return index1 - index2
 
+# sort key type tags follow class_order.
+NUMBER_SORT_TAG = b"\x10"
+STRING_SORT_TAG = b"\x20"
+COMPOSITE_SORT_TAG = b"\x30"
+
+DOUBLE = struct.Struct(">d")
+SIGN_BIT = 1 << 63
+ALL_BITS = (1 << 64) - 1
+MAX_FLOAT = 1.7976931348623157e308
+# ints of at most this size are exact as floats.
+EXACT_INT = 2 ** 53
+
+def float_sort_bytes(number):
+    "8 bytes ordered like the float: flip the sign bit of positives, all bits of negatives."
+    if number == 0:
+        number = 0.0  # -0.0 == 0.0
+    (bits,) = struct.unpack(">Q", DOUBLE.pack(number))
+    if bits & SIGN_BIT:
+        bits = ALL_BITS ^ bits
+    else:
+        bits = bits | SIGN_BIT
+    return struct.pack(">Q", bits)
+
+def int_sort_bytes(number):
+    "Self delimiting order preserving encoding of an int."
+    if number == 0:
+        return b"\x80"
+    magnitude = abs(number)
+    nbytes = (magnitude.bit_length() + 7) // 8
+    if nbytes <= 126:
+        length = struct.pack("B", 0x80 + nbytes if number > 0 else 0x80 - nbytes)
+    else:
+        # longer numbers: a marker byte and a 4 byte length.
+        if number > 0:
+            length = b"\xff" + struct.pack(">I", nbytes)
+        else:
+            length = b"\x00" + struct.pack(">I", 0xffffffff - nbytes)
+    if number < 0:
+        magnitude = (1 << (8 * nbytes)) - 1 - magnitude
+    return length + magnitude.to_bytes(nbytes, "big")
+
+def number_sort_bytes(number):
+    """
+    Order preserving encoding of an int or float: the float nearest the
+    number followed by the exact (integer) remainder.  Rounding to float is
+    monotonic, so numbers with different floats are ordered by the float
+    and numbers with the same float by the remainder.
+    """
+    if isinstance(number, float) or -EXACT_INT <= number <= EXACT_INT:
+        return float_sort_bytes(number) + b"\x80"
+    try:
+        approximation = float(number)
+    except OverflowError:
+        approximation = MAX_FLOAT if number > 0 else -MAX_FLOAT
+    return float_sort_bytes(approximation) + int_sort_bytes(number - int(approximation))
+
+def string_sort_bytes(string):
+    "utf8 (ordered like code points) with zero bytes escaped, zero terminated."
+    return string.encode("utf8").replace(b"\x00", b"\x00\xff") + b"\x00\x01"
+
+def sort_key_successor(sort_key):
+    "Least byte string above every string starting with sort_key (None if there is none)."
+    stripped = sort_key.rstrip(b"\xff")
+    if not stripped:
+        return None
+    return stripped[:-1] + struct.pack("B", stripped[-1] + 1)
+
+def prefix_sort_key_ranges(prefix):
+    """
+    Sort key ranges [(low, high), ...] (low inclusive, high exclusive) of
+    the keys extending the composite (cons list) key prefix: the prefix
+    itself, then the keys with the last component c of the prefix replaced
+    by CompositeKey(c, anything).  So for prefix C(t, d) the ranges cover
+    C(t, d) and C(t, C(d, x)) for every x.
+    """
+    head = []
+    last = prefix
+    while isinstance(last, CompositeKey):
+        head.append(COMPOSITE_SORT_TAG + last.key1.sort_key())
+        last = last.key2
+    head = b"".join(head)
+    exact = head + last.sort_key()
+    extended = head + COMPOSITE_SORT_TAG + last.sort_key()
+    return [(exact, exact + b"\x00"), (extended, sort_key_successor(extended))]
+
 def key_from_bytes(encoded_bytes, start=0):
     "Decode a key from a byte sequence prefix. Return (key, end_index)."
     key = end = None
@@ -197,13 +316,14 @@ def assert_is_white(encoded_bytes, index):
         raise FormatError("Expected whitepace not found.")
 
 def white_delimited_int(encoded_bytes, start=0, max_length=20):
-    (chunk, end) = white_delimited(encoded_bytes, start, max_length=20)
+    (chunk, end) = white_delimited(encoded_bytes, start, max_length=max_length)
     if chunk is None:
         raise FormatError("white delimited chunk not found")
     return (int(chunk), end)
 
-def white_delimited_number(encoded_bytes, start=0, max_length=20):
-    (chunk, end) = white_delimited(encoded_bytes, start, max_length=20)
+def white_delimited_number(encoded_bytes, start=0, max_length=32):
+    # long enough for any float repr, such as -1.2345678901234567e-300
+    (chunk, end) = white_delimited(encoded_bytes, start, max_length=max_length)
     if chunk is None:
         raise FormatError("white delimited chunk not found")
     try:
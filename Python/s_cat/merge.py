@@ -0,0 +1,140 @@
+"""
+Merging sorted s_cat segments, as in a log structured merge tree: small
+sorted stores are written continuously and merged into larger ones.
+
+merge streams a k-way merge of the segments by key into one new sorted
+store (with fresh skip offsets) keeping the last pellet for each key,
+where later segments override earlier ones.  Deletions are dropped, or
+kept (keep_deleted=True) when the output must still shadow older
+segments left out of the merge.  SegmentView answers queries over
+several segments newest first.
+
+    python -m s_cat.merge OUTPUT INPUT [INPUT ...]
+"""
+
+from . import compact
+from . import compress
+from . import file_source
+from . import key
+from . import pellet
+from . import store
+from . import value
+import argparse
+import heapq
+import sys
+import time
+
+
+def pellet_key(p):
+    return p.key.sort_key()
+
+
+def merged_pairs(sources):
+    """
+    Generate (key, values) from the sorted sources (oldest first) in key
+    order; equal keys come oldest first, in file order within a source.
+    """
+    def pellets(source):
+        for (seek, result) in pellet.iter_pellets(source):
+            yield result
+    # heapq.merge is stable: ties keep the order of the sources.
+    for result in heapq.merge(*[pellets(source) for source in sources], key=pellet_key):
+        yield (result.key, result.values)
+
+
+def merge(sources, target_path, keep_deleted=False):
+    """
+    Merge the sorted data sources (oldest first) into a new sorted store at
+    target_path, replacing any file there once complete.  The sources'
+    compression dictionary is carried over as by compact.compact.  Return
+    statistics as for compact.compact.
+    """
+    start = time.time()
+    dictionary = compress.sources_dictionary(sources)
+    stats = {"pellets_read": 0, "bytes_read": sum(source.length() for source in sources)}
+
+    def counted(pairs):
+        for pair in pairs:
+            stats["pellets_read"] += 1
+            yield pair
+
+    pairs = store.latest_pairs(counted(merged_pairs(sources)), keep_deleted)
+    return compact.write_store(pairs, target_path, stats, start, dictionary)
+
+
+def merge_files(paths, target_path, keep_deleted=False):
+    "merge the sorted s_cat files at paths (oldest first) into target_path."
+    sources = [file_source.FileSource(open(path, "rb"), positional=True) for path in paths]
+    try:
+        return merge(sources, target_path, keep_deleted)
+    finally:
+        for source in sources:
+            source.close()
+
+
+class SegmentView(object):
+
+    """
+    Queries over sorted segments (data sources, oldest first) where later
+    segments override earlier ones and deletions shadow older values.
+    A lookup reads each segment at most once, newest first, so read
+    amplification is bounded by the number of segments, and segments
+    whose Bloom filter (blooms, one per source or None) excludes the key
+    are not read at all.
+    """
+
+    def __init__(self, sources, lazy=False, blooms=None):
+        self.lazy = lazy
+        if blooms is None:
+            blooms = [None] * len(sources)
+        self.readers = [store.SCatReader(source, lazy, bloom) for (source, bloom) in zip(sources, blooms)]
+
+    def find(self, target):
+        "Return (segment number, seek, pellet) of the newest pellet for target, or None."
+        for number in range(len(self.readers) - 1, -1, -1):
+            found = self.readers[number].find(target)
+            if found is not None:
+                (seek, result) = found
+                return (number, seek, result)
+        return None
+
+    def get(self, target):
+        "Return the newest values container for target, or None if absent or deleted."
+        found = self.find(target)
+        if found is None:
+            return None
+        values = found[2].values
+        if isinstance(values, value.Deleted):
+            return None
+        return values
+
+    def scan(self, start_key=None, end_key=None):
+        "Generate (key, values) for start_key <= k < end_key as store.SCatReader.scan."
+        low = None if start_key is None else start_key.sort_key()
+        high = None if end_key is None else end_key.sort_key()
+        return self.scan_sort_keys(low, high)
+
+    def prefix_scan(self, prefix):
+        "Generate (key, values) for the key prefix and its extensions as store.SCatReader.prefix_scan."
+        for (low, high) in key.prefix_sort_key_ranges(prefix):
+            for item in self.scan_sort_keys(low, high):
+                yield item
+
+    def scan_sort_keys(self, low, high):
+        segments = [reader.pellets_in_range(low, high) for reader in self.readers]
+        return store.latest_values(heapq.merge(*segments, key=pellet_key), self.lazy)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Merge sorted s_cat segments into one sorted store.")
+    parser.add_argument("output", help="path of the merged file")
+    parser.add_argument("inputs", nargs="+", help="sorted s_cat files, oldest first")
+    parser.add_argument("--keep-deleted", action="store_true",
+                        help="keep deletion markers (when older segments remain)")
+    arguments = parser.parse_args(argv)
+    stats = merge_files(arguments.inputs, arguments.output, arguments.keep_deleted)
+    print(compact.report(stats))
+    return stats
+
+if __name__ == "__main__":   # pragma: no cover
+    main(sys.argv[1:])
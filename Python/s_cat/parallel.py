@@ -0,0 +1,171 @@
+"""
+Parallel index build: the file is split into byte ranges which worker
+processes scan independently, and their partial indexes are merged in
+file order (so later pellets still override earlier ones).
+
+A range generally starts inside some pellet, so a worker first resyncs:
+it tries each position following white space until the bytes there parse
+as a complete pellet whose recorded payload length matches its parsed
+payload.  Value bytes could still imitate a pellet, so the merge checks
+the chain: each range must start where the scan of the range before it
+stopped.  A range failing the check is scanned again from there.
+"""
+
+from . import data_source
+from . import fast_parse
+from . import file_source
+from . import index
+from . import pellet
+import concurrent.futures
+import os
+
+# ranges smaller than this are not worth a worker.
+MIN_RANGE_BYTES = 1 << 22
+# resync reads windows of this size (larger if a candidate pellet is).
+RESYNC_WINDOW = 1 << 16
+
+
+def pellet_starts(data, start, at_eof):
+    """
+    True if a complete pellet starts at start in data, False if not, or
+    None if data ends too soon to tell (and at_eof is false).
+    """
+    try:
+        (position, complete) = fast_parse.payload_extent(data, start)
+    except ValueError:
+        return False
+    if not complete:
+        return False if at_eof else None
+    try:
+        (payload_length, offsets, end) = fast_parse.offsets_from_bytes(data, position)
+    except ValueError:
+        # the offsets may be cut by the end of data.
+        return False if at_eof or len(data) - position > 4096 else None
+    if end >= len(data) and not at_eof:
+        return None
+    if payload_length != position - 1 - start:
+        return False
+    try:
+        fast_parse.pellet_from_bytes(data, start)
+    except (ValueError, AssertionError):
+        return False
+    return True
+
+
+def resync(source, start, window=RESYNC_WINDOW):
+    "Seek of the first pellet starting at or after start (source.length() if none)."
+    end_seek = source.length()
+    if start <= 0:
+        return 0
+    candidate = start
+    while candidate < end_seek:
+        # include the byte before the candidate: is it white space?
+        base = candidate - 1
+        (chunk, at_eof) = source.get_bytes(base, window + 1, strict=False)
+        data = bytes(chunk)
+        starts = (match.end() for match in data_source.ws_pattern.finditer(data))
+        truncated = None
+        for i in starts:
+            if i < len(data) and data[i] not in fast_parse.WHITE:
+                verdict = pellet_starts(data, i, at_eof)
+                if verdict:
+                    return base + i
+                if verdict is None:
+                    truncated = i
+                    break
+        if truncated is None:
+            if at_eof:
+                return end_seek
+            candidate = base + len(data)
+        elif truncated == 1:
+            window += window
+        else:
+            candidate = base + truncated
+    return end_seek
+
+
+def scan_source(source, first_seek, stop):
+    """
+    Index the pellets of source starting before stop, beginning with the
+    pellet at first_seek.  Return (next_seek, entries) where next_seek is
+    where the next pellet starts and entries maps key bytes to
+    (seek, payload_length) as in index.KeyIndex.
+    """
+    entries = {}
+    next_seek = source.length()
+    for (seek, result) in pellet.iter_pellets(source, first_seek, lazy=True):
+        if seek >= stop:
+            next_seek = seek
+            break
+        entries[result.key.to_bytes()] = (seek, result.payload_length)
+    return (next_seek, entries)
+
+
+def scan_range(path, start, stop):
+    """
+    Worker: resync at start and index the range.
+    Return (first_seek, next_seek, entries) (see scan_source), with
+    first_seek None if the scan failed.
+    """
+    with open(path, "rb") as f:
+        source = file_source.FileSource(f, positional=True)
+        first_seek = resync(source, start)
+        try:
+            return (first_seek,) + scan_source(source, first_seek, stop)
+        except ValueError:
+            # resync was fooled into a value: the merge scans this range again.
+            return (None, None, {})
+
+
+def split(length, count):
+    "Boundaries of count nearly equal ranges covering length bytes."
+    return [(length * i) // count for i in range(count + 1)]
+
+
+def build_index(path, source=None, processes=None, range_count=None, min_range=MIN_RANGE_BYTES):
+    """
+    Build an index.KeyIndex for the s_cat file at path using processes
+    worker processes (by default one per cpu) scanning range_count ranges
+    (by default one per process) of at least min_range bytes.  The index
+    is over source, by default a positional FileSource reading path which
+    the index then owns: close it with the index (KeyIndex.close, or use
+    the index as a context manager).  It is closed here on failure.
+    """
+    if source is not None:
+        return index_source(path, source, processes, range_count, min_range)
+    source = file_source.FileSource(open(path, "rb"), positional=True)
+    try:
+        result = index_source(path, source, processes, range_count, min_range)
+    except BaseException:
+        source.close()
+        raise
+    result.owns_source = True
+    return result
+
+
+def index_source(path, source, processes, range_count, min_range):
+    "build_index over the given source."
+    length = source.length()
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if range_count is None:
+        range_count = processes
+    range_count = max(1, min(range_count, length // max(1, min_range)))
+    boundaries = split(length, range_count)
+    ranges = list(zip(boundaries[:-1], boundaries[1:]))
+    if processes > 1 and range_count > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = [executor.submit(scan_range, path, start, stop) for (start, stop) in ranges]
+            results = [future.result() for future in futures]
+    else:
+        results = [scan_range(path, start, stop) for (start, stop) in ranges]
+    entries = {}
+    next_seek = 0
+    for ((start, stop), result) in zip(ranges, results):
+        if result[0] != next_seek:
+            # resync was fooled (or the file changed): scan from the true start.
+            result = (next_seek,) + scan_source(source, next_seek, stop)
+        (first_seek, next_seek, range_entries) = result
+        entries.update(range_entries)
+    table = index.KeyTable.from_entries(entries)
+    return index.KeyIndex(source, table, length)
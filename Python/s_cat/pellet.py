@@ -1,32 +1,68 @@
 
+from . import data_source
 from . import key
 from . import value
+from . import fast_parse
+from array import array
+from collections import deque
 
 OFFSET_INDICATOR = b'O'
+AMENDS_INDICATOR = b'>'
+SCAN_CHUNK_SIZE = 1 << 20
+# shared by pellets without skips: never mutated.
+NO_SKIPS = array("q")
+# first guesses for speculative reads before any pellets are seen.
+INITIAL_READ_SIZE = 256
+INITIAL_TRAILER_SIZE = 64
+# an offsets token longer than this is malformed.
+MAX_OFFSETS_LENGTH = 4096
 
 class Pellet(object):
 
+    # skips holds the flattened (offset, count) pairs.
+    __slots__ = ("key", "values", "offset_seek", "skips", "payload_length")
+
     def __init__(self, pkey, pvalues):
         assert isinstance(pkey, key.Key)
         assert isinstance(pvalues, value.ValuesContainer)
         self.key = pkey
         self.values = pvalues
         self.offset_seek = None
-        self.skips_offsets_and_counts = []
+        self.skips = NO_SKIPS
         self.payload_length = None
 
     def set_offsets(self, payload_length, offsets):
         self.payload_length = payload_length
+        skips = array("q")
         # validate list content
-        self.skips_offsets_and_counts = []
         for (offset, count) in offsets:
-            self.skips_offsets_and_counts.append((offset, count))
+            skips.append(offset)
+            skips.append(count)
+        self.skips = skips if skips else NO_SKIPS
+
+    @property
+    def skips_offsets_and_counts(self):
+        "List of (offset, count) pairs."
+        skips = self.skips
+        return list(zip(skips[0::2], skips[1::2]))
+
+    def skip_levels(self):
+        "Number of (offset, count) pairs, without building the list."
+        return len(self.skips) >> 1
+
+    def skip(self, level):
+        "The (offset, count) pair for level (negative levels count from the end)."
+        if level < 0:
+            level += len(self.skips) >> 1
+        skips = self.skips
+        return (skips[2 * level], skips[2 * level + 1])
 
     def to_bytes(self):
         key_bytes = self.key.to_bytes()
         values_bytes = self.values.to_bytes()
         payload = b"\n".join([key_bytes, values_bytes])
         lpayload = len(payload)
+        self.payload_length = lpayload
         offsets_list = [key.unicode_(lpayload)]
         for (offset, count) in self.skips_offsets_and_counts:
             pair = key.unicode_(offset) + u":" + key.unicode_(count)
@@ -35,10 +71,10 @@ class Pellet(object):
         offsets_bytes = b"O" + offsets.encode("utf8")
         return b"\n".join([payload, offsets_bytes])
 
-def pellet_from_bytes(encoded_bytes, start=0, with_offsets=True):
+def pellet_from_bytes(encoded_bytes, start=0, with_offsets=True, lazy=False):
     nbytes = len(encoded_bytes)
     (pkey, key_end) = key.key_from_bytes(encoded_bytes, start)
-    (pvalues, values_end) = value.values_from_bytes(encoded_bytes, key_end)
+    (pvalues, values_end) = value.values_from_bytes(encoded_bytes, key_end, lazy)
     result = Pellet(pkey, pvalues)
     if not with_offsets:
         end = values_end
@@ -75,3 +111,155 @@ def offsets_from_bytes(encoded_bytes, start=0, max_length=4048):
         payload_end = end
     payload_length = int(offsets_str[:payload_end])
     return (payload_length, offsets, end)
+
+def cut_by_buffer(buffer, position):
+    """
+    True if the pellet at position in buffer may fail to parse only
+    because it continues past the end of buffer, False if it is malformed.
+    """
+    try:
+        (extent, complete) = fast_parse.payload_extent(buffer, position)
+    except ValueError:
+        return False
+    if not complete:
+        return True
+    # the payload is whole, so only the offsets may be cut.
+    if data_source.ws_pattern.search(buffer, extent):
+        return False
+    return len(buffer) - extent <= MAX_OFFSETS_LENGTH
+
+def iter_pellets(source, start=0, chunk_size=SCAN_CHUNK_SIZE, lazy=False):
+    """
+    Generate (seek, pellet) for the pellets of source from seek start onward,
+    reading forward in chunks of about chunk_size bytes.  A pellet cut by
+    the end of a chunk is carried into the next chunk, which grows if
+    needed to hold it.  Amends (">...") are skipped.
+    Chunks are copied to bytes and parsed with fast_parse, with lazy values
+    (views of the chunk) if lazy.
+    """
+    buffer = b""
+    buffer_seek = start
+    position = 0
+    at_eof = False
+    ws_match = data_source.ws_pattern.match
+    while True:
+        nbuffer = len(buffer)
+        if position < nbuffer:
+            if ws_match(buffer, position):
+                position += 1
+                continue
+            if buffer[position:position + 1] == AMENDS_INDICATOR:
+                match = data_source.ws_pattern.search(buffer, position)
+                if match:
+                    position = match.end()
+                    continue
+                if at_eof:
+                    return
+            else:
+                try:
+                    (result, end) = fast_parse.pellet_from_bytes(buffer, position, lazy=lazy)
+                except (ValueError, AssertionError):
+                    if at_eof:
+                        raise key.FormatError("incomplete pellet at seek " + repr(buffer_seek + position))
+                    if not cut_by_buffer(buffer, position):
+                        # reading on would not help (and could read the rest of the source).
+                        raise key.FormatError("malformed pellet at seek " + repr(buffer_seek + position))
+                else:
+                    # the offsets must be seen to end before the buffer does.
+                    if end < nbuffer or at_eof:
+                        yield (buffer_seek + position, result)
+                        position = end
+                        continue
+        elif at_eof:
+            return
+        # carry the unparsed tail of the buffer into the next read.
+        carry = buffer[position:]
+        read_seek = buffer_seek + nbuffer
+        (chunk, at_eof) = source.get_bytes(read_seek, max(chunk_size, 2 * len(carry)), strict=False)
+        buffer = b"".join([carry, chunk])
+        buffer_seek = read_seek - len(carry)
+        position = 0
+
+
+class ReadEstimate(object):
+
+    """
+    Sizes of recently read pellets (including the delimiter following them)
+    and of their offsets trailers, for sizing speculative reads.
+    """
+
+    def __init__(self, history=16):
+        self.sizes = deque([INITIAL_READ_SIZE], maxlen=history)
+        self.trailer_sizes = deque([INITIAL_TRAILER_SIZE], maxlen=history)
+
+    def observe(self, size, trailer_size):
+        self.sizes.append(size)
+        self.trailer_sizes.append(trailer_size)
+
+    def guess(self):
+        return max(self.sizes)
+
+    def trailer_guess(self):
+        return max(self.trailer_sizes)
+
+# used when the caller does not keep an estimate of its own.
+default_estimate = ReadEstimate()
+
+def pellet_from_data_source_seek(source, seek, payload_length=None, estimate=None, lazy=False):
+    """
+    Read the pellet starting at seek.  Return (pellet, end_seek) where
+    end_seek follows the white delimiter if any.
+
+    The first read is a prefix sized from payload_length if it is known, else
+    from the estimate of recent pellet sizes.  The offsets (with the payload
+    length) follow the payload, so if the prefix is short the length headers
+    of the key and values in it give the extent of the rest, which is
+    usually fetched in one more read.  If lazy the values are decoded on
+    demand (value.LazyValues).
+    """
+    return run_reads(source, pellet_reads(seek, payload_length, estimate, lazy))
+
+def run_reads(source, plan):
+    """
+    Make the reads requested by the generator plan from source and return
+    the plan's result.  The plan yields (start_seek, length) and is sent
+    (bytes, at_eof) for each (reads are not strict).
+    """
+    try:
+        (start_seek, length) = next(plan)
+        while True:
+            (start_seek, length) = plan.send(source.get_bytes(start_seek, length, strict=False))
+    except StopIteration as stop:
+        return stop.value
+
+def pellet_reads(seek, payload_length=None, estimate=None, lazy=False):
+    "Read plan (see run_reads) of pellet_from_data_source_seek."
+    if estimate is None:
+        estimate = default_estimate
+    slack = estimate.trailer_guess()
+    if payload_length is None:
+        length = estimate.guess()
+    else:
+        length = payload_length + 1 + slack
+    (chunk, at_eof) = yield (seek, length)
+    data = bytes(chunk)
+    while True:
+        try:
+            (result, end) = fast_parse.pellet_from_bytes(data, lazy=lazy)
+        except (ValueError, AssertionError):
+            # truncated (or corrupt) pellet.
+            if at_eof:
+                raise key.FormatError("no complete pellet at seek " + repr(seek))
+        else:
+            # the offsets must be seen to end at a delimiter or eof.
+            if at_eof or data[end - 1] in fast_parse.WHITE:
+                estimate.observe(end, end - result.payload_length)
+                return (result, seek + end)
+        if payload_length is None:
+            (position, complete) = fast_parse.payload_extent(data)
+        else:
+            position = payload_length + 1
+        needed = max(position, len(data)) + slack
+        (chunk, at_eof) = yield (seek + len(data), needed - len(data))
+        data = b"".join([data, chunk])
+        slack += slack
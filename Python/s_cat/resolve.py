@@ -0,0 +1,442 @@
+"""
+Resolution of value.Reference values.  The reference bytes name a scheme
+and a target,
+
+    scat:<path>\\n<key bytes>          the values for a key in an s_cat file
+    range:<path>\\n<start>:<length>    a byte range of a file (one value)
+
+and a Resolver maps each scheme to a handler (more may be registered).
+Paths are taken relative to the resolver's base directory, and paths
+leading outside it (absolute, through "..", or by symbolic links) are
+refused.
+Files are opened once and kept in a pool of open handles, resolved values
+are kept in a least recently used cache (results read from an s_cat file
+are dropped once its length changes), and batches of references are
+resolved together: the keys of a file in key order, and byte ranges
+coalesced into few reads.  A reference may resolve to another reference,
+which is followed in turn up to a maximum chain depth.
+"""
+
+from . import file_source
+from . import footer
+from . import index
+from . import key
+from . import store
+from . import value
+from collections import OrderedDict
+import os
+
+SCAT_SCHEME = b"scat"
+RANGE_SCHEME = b"range"
+MAX_OPEN = 64
+CACHE_ENTRIES = 10000
+MAX_DEPTH = 8
+# cached result of a reference to nothing.
+ABSENT = object()
+
+
+class ResolveError(ValueError):
+    "Reference cannot be resolved."
+    pass
+
+
+def scat_reference(path, k):
+    "Reference to the values for key k in the s_cat file at path."
+    return value.Reference(b"".join([SCAT_SCHEME, b":", os.fsencode(path), b"\n", k.to_bytes()]))
+
+
+def range_reference(path, start, length):
+    "Reference to length bytes from seek start of the file at path."
+    extent = ("%d:%d" % (start, length)).encode("ascii")
+    return value.Reference(b"".join([RANGE_SCHEME, b":", os.fsencode(path), b"\n", extent]))
+
+
+def reference_key(reference):
+    "Reference bytes of a value.Reference (or of reference bytes)."
+    if isinstance(reference, value.Reference):
+        return bytes(reference.reference_bytes)
+    return bytes(reference)
+
+
+def split_target(target):
+    "(path, detail) from target bytes path\\ndetail."
+    (path, separator, detail) = bytes(target).partition(b"\n")
+    if not separator:
+        raise ResolveError("no path in reference target " + repr(target))
+    return (os.fsdecode(path), detail)
+
+
+def confined_path(root, path):
+    """
+    The real path of path taken relative to the real directory root.
+    Raise ResolveError if it lies outside root.
+    """
+    full = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, full]) != root:
+        raise ResolveError("reference path outside " + repr(root) + ": " + repr(path))
+    return full
+
+
+def current_length(source):
+    "Length of source, refreshed first if it caches it (a positional FileSource)."
+    refresh_length = getattr(source, "refresh_length", None)
+    if refresh_length is not None:
+        return refresh_length()
+    return source.length()
+
+
+class Handle(object):
+
+    """
+    An open data source in a HandlePool, with state handlers attach to
+    it and the length of the source that state covers.
+    """
+
+    __slots__ = ("path", "source", "reader", "index", "length")
+
+    def __init__(self, path, source):
+        self.path = path
+        self.source = source
+        self.reader = None
+        self.index = None
+        self.length = None
+
+    def close(self):
+        self.source.close()
+
+
+class HandlePool(object):
+
+    """
+    At most max_open open data sources (positional file_source.FileSource
+    by default, else made by opener(path)), closing the least recently
+    used to make room.  If root (a real directory path) is given, paths
+    outside it are refused.
+    """
+
+    def __init__(self, max_open=MAX_OPEN, opener=None, root=None):
+        self.max_open = max_open
+        self.opener = opener
+        self.root = root
+        self.handles = OrderedDict()
+        self.opens = 0
+
+    def open_source(self, path):
+        if self.opener is not None:
+            return self.opener(path)
+        return file_source.FileSource(open(path, "rb"), positional=True)
+
+    def get(self, path):
+        if self.root is not None:
+            path = confined_path(self.root, path)
+        handles = self.handles
+        handle = handles.get(path)
+        if handle is not None:
+            handles.move_to_end(path)
+            return handle
+        try:
+            source = self.open_source(path)
+        except (IOError, OSError) as e:
+            raise ResolveError("cannot open " + repr(path) + ": " + str(e))
+        self.opens += 1
+        handle = handles[path] = Handle(path, source)
+        while len(handles) > self.max_open:
+            (evicted_path, evicted) = handles.popitem(last=False)
+            evicted.close()
+        return handle
+
+    def close(self):
+        for handle in self.handles.values():
+            handle.close()
+        self.handles.clear()
+
+
+class ScatHandler(object):
+
+    """
+    Resolve "scat" references: the values for a key in an s_cat file, or
+    None if the key is absent or deleted.  A file whose footer records an
+    index block (see footer) is looked up through that index, the keys of
+    a batch read together (index.KeyIndex.get_many).  A file ending with
+    a footer without an index was written by store.SCatWriter, so it is
+    searched as a sorted store (store.SCatReader).  Other files, which
+    need not be sorted, are indexed on first use.  A file which has grown
+    since is indexed up to its new end, or examined afresh.
+    """
+
+    def resolve_batch(self, resolver, targets):
+        results = [None] * len(targets)
+        by_path = {}
+        for (i, target) in enumerate(targets):
+            (path, key_bytes) = split_target(target)
+            try:
+                (k, end) = key.key_from_bytes(key_bytes)
+            except (ValueError, IndexError):
+                raise ResolveError("bad key in reference target " + repr(target))
+            by_path.setdefault(resolver.path(path), []).append((k, i))
+        for (path, requests) in by_path.items():
+            handle = resolver.pool.get(path)
+            self.prepare(handle)
+            resolver.covered(path, handle.length)
+            if handle.index is None:
+                # in key order, so successive searches read nearby pellets.
+                requests.sort(key=lambda request: request[0].sort_key())
+                for (k, i) in requests:
+                    results[i] = handle.reader.get(k)
+            else:
+                (found, missing) = handle.index.get_many([k for (k, i) in requests])
+                for ((k, i), values) in zip(requests, found):
+                    results[i] = values
+        return results
+
+    def prepare(self, handle):
+        "Attach an index or a reader to handle, current with the length of its source."
+        source = handle.source
+        length = current_length(source)
+        if length == handle.length:
+            return
+        if handle.index is not None and handle.length is not None and length > handle.length:
+            # appends only add pellets past the covered length.
+            handle.index.catch_up()
+            handle.length = length
+            return
+        handle.index = handle.reader = None
+        last = footer.read_footer(source)
+        if last is not None and not last.index_length:
+            handle.reader = store.SCatReader(source)
+        else:
+            handle.index = footer.open_index(source)
+        handle.length = length
+
+
+class RangeHandler(object):
+
+    """
+    Resolve "range" references: the bytes of a range of a file as a single
+    value.  Ranges of a file less than gap bytes apart are read together
+    (see index.coalesce).
+    """
+
+    def __init__(self, gap=index.COALESCE_GAP, max_read=index.MAX_COALESCED_READ):
+        self.gap = gap
+        self.max_read = max_read
+
+    def resolve_batch(self, resolver, targets):
+        results = [None] * len(targets)
+        by_path = {}
+        for (i, target) in enumerate(targets):
+            (path, extent) = split_target(target)
+            try:
+                (start, length) = [int(part) for part in extent.split(b":")]
+            except ValueError:
+                raise ResolveError("bad range in reference target " + repr(target))
+            if start < 0 or length < 0:
+                raise ResolveError("bad range in reference target " + repr(target))
+            by_path.setdefault(resolver.path(path), []).append((start, start + length, i))
+        for (path, extents) in by_path.items():
+            source = resolver.pool.get(path).source
+            extents.sort()
+            for group in index.coalesce(extents, self.gap, self.max_read):
+                start = group[0][0]
+                end = max(extent[1] for extent in group)
+                try:
+                    found = source.get_bytes(start, end - start)
+                except IndexError:
+                    found = None
+                if found is None:
+                    raise ResolveError("range past end of " + repr(path))
+                data = bytes(found[0])
+                for (extent_start, extent_end, i) in group:
+                    results[i] = value.Values([data[extent_start - start:extent_end - start]])
+        return results
+
+
+class Resolver(object):
+
+    """
+    Resolve references through the handlers registered for their schemes.
+    Paths are taken from base_directory (the current directory if None)
+    and must lead to files inside it.  At most max_open files are held
+    open and cache_entries results cached; chains of more than max_depth
+    references raise ResolveError.  A cached result is served only while
+    the s_cat files it was read from keep the length they had then.
+    """
+
+    def __init__(self, base_directory=None, max_open=MAX_OPEN, cache_entries=CACHE_ENTRIES,
+                 max_depth=MAX_DEPTH, opener=None):
+        self.base_directory = base_directory
+        self.root = os.path.realpath(os.getcwd() if base_directory is None else base_directory)
+        self.pool = HandlePool(max_open, opener, self.root)
+        self.cache_entries = cache_entries
+        self.cache = OrderedDict()
+        # reference bytes of cached results by s_cat file path, and the
+        # lengths of the files they were read at.
+        self.dependents = {}
+        self.lengths = {}
+        self.max_depth = max_depth
+        self.handlers = {}
+        self.register(SCAT_SCHEME, ScatHandler())
+        self.register(RANGE_SCHEME, RangeHandler())
+        self.hits = self.misses = 0
+
+    def register(self, scheme, handler):
+        """
+        Resolve references with scheme (bytes) by handler, whose method
+        resolve_batch(resolver, targets) returns for each target bytes a
+        values container or None.
+        """
+        self.handlers[scheme] = handler
+
+    def path(self, path):
+        "The real path of a reference path (see confined_path)."
+        return confined_path(self.root, path)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "opens": self.pool.opens,
+                "open": len(self.pool.handles), "cached": len(self.cache)}
+
+    def clear(self):
+        "Forget cached results (for example after referenced files are rewritten in place)."
+        self.cache.clear()
+        self.dependents.clear()
+        self.lengths.clear()
+
+    def close(self):
+        self.pool.close()
+        self.clear()
+
+    def covered(self, path, length):
+        "Note that results are read from the s_cat file at path at length, forgetting older ones."
+        if self.lengths.get(path, length) != length:
+            self.forget(path)
+        self.lengths[path] = length
+
+    def forget(self, path):
+        "Drop the cached results read from the s_cat file at path."
+        cache = self.cache
+        for reference_bytes in self.dependents.pop(path, ()):
+            cache.pop(reference_bytes, None)
+        self.lengths.pop(path, None)
+
+    def changed(self, path):
+        "True if the s_cat file at path no longer has the length cached results were read at."
+        handle = self.pool.handles.get(path)
+        try:
+            if handle is not None:
+                length = current_length(handle.source)
+            else:
+                # without reopening a file closed to make room.
+                length = os.path.getsize(path)
+        except (IOError, OSError):
+            return True
+        return length != self.lengths.get(path)
+
+    def scat_paths(self, reference_bytes):
+        "Tuple of the s_cat file path reference_bytes reads from, if any."
+        (scheme, separator, target) = reference_bytes.partition(b":")
+        if scheme != SCAT_SCHEME:
+            return ()
+        return (self.path(split_target(target)[0]),)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def resolve(self, reference):
+        "The values container reference resolves to, or None if it names nothing."
+        return self.resolve_many([reference])[0]
+
+    def resolve_many(self, references):
+        """
+        Resolve a batch of references (value.Reference or reference bytes).
+        Return a list of results in request order (see resolve).
+        """
+        results = [None] * len(references)
+        # (request number, reference bytes, earlier reference bytes of the chain,
+        #  s_cat file paths the chain read from)
+        pending = [(i, reference_key(reference), [], ()) for (i, reference) in enumerate(references)]
+        # whether the cached results of each s_cat file path are current, checked once a batch.
+        checked = {}
+        depth = 0
+        while pending:
+            if depth > self.max_depth:
+                raise ResolveError("reference chain longer than %d: %r" % (self.max_depth, pending[0][1]))
+            misses = []
+            for request in pending:
+                cached = self.cached(request[1], checked)
+                if cached is None:
+                    misses.append(request)
+                else:
+                    (found, paths) = cached
+                    self.settle(request, found, paths, results)
+            pending = []
+            for (request, found) in zip(misses, self.fetch([request[1] for request in misses])):
+                (i, reference_bytes, chain, paths) = request
+                paths = paths + self.scat_paths(reference_bytes)
+                if isinstance(found, value.Reference):
+                    pending.append((i, found.reference_bytes, chain + [reference_bytes], paths))
+                else:
+                    self.settle(request, ABSENT if found is None else found, paths, results)
+            depth += 1
+        return results
+
+    def fetch(self, reference_list):
+        "Uncached results of references, by batches per scheme (each distinct reference once)."
+        found = {}
+        by_scheme = {}
+        for reference_bytes in reference_list:
+            if reference_bytes in found:
+                continue
+            found[reference_bytes] = None
+            (scheme, separator, target) = reference_bytes.partition(b":")
+            handler = self.handlers.get(scheme)
+            if not separator or handler is None:
+                raise ResolveError("no resolver for reference " + repr(reference_bytes))
+            by_scheme.setdefault(scheme, []).append((reference_bytes, target))
+        for (scheme, requests) in by_scheme.items():
+            batch = self.handlers[scheme].resolve_batch(self, [target for (reference_bytes, target) in requests])
+            for ((reference_bytes, target), result) in zip(requests, batch):
+                found[reference_bytes] = result
+        return [found[reference_bytes] for reference_bytes in reference_list]
+
+    def cached(self, reference_bytes, checked):
+        "The cached (result, s_cat file paths) for reference_bytes if current, else None."
+        entry = self.cache.get(reference_bytes)
+        if entry is not None:
+            for path in entry[1]:
+                current = checked.get(path)
+                if current is None:
+                    current = checked[path] = not self.changed(path)
+                    if not current:
+                        self.forget(path)
+                if not current:
+                    entry = None
+                    break
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.cache.move_to_end(reference_bytes)
+        return entry
+
+    def settle(self, request, found, paths, results):
+        """
+        Record the final result of request, read from the s_cat files at
+        paths, caching it for each reference of its chain.
+        """
+        (i, reference_bytes, chain, request_paths) = request
+        results[i] = None if found is ABSENT else found
+        paths = tuple(set(request_paths + paths))
+        cache = self.cache
+        dependents = self.dependents
+        for chained in chain + [reference_bytes]:
+            cache[chained] = (found, paths)
+            cache.move_to_end(chained)
+            for path in paths:
+                dependents.setdefault(path, set()).add(chained)
+        while len(cache) > self.cache_entries:
+            (evicted, (found, paths)) = cache.popitem(last=False)
+            for path in paths:
+                dependents.get(path, set()).discard(evicted)
@@ -0,0 +1,84 @@
+"""
+Snapshots: read only views of a data source pinned at a length.
+
+s_cat data is write once and append only, so the bytes before a length
+reached by a completed append never change.  A snapshot pinned at such a
+length sees a consistent tail (and so a consistent store or index) however
+much a writer appends afterwards.  Snapshot reads go through
+DataSource.read_at, which for file sources is a positional read, so
+readers share no file position with the writer and never block it.
+
+Snapshots may be shared by threads.  Other processes can open their own
+view of the same file at the same length with Snapshot.open.
+"""
+
+from . import data_source
+from . import file_source
+from . import index
+from . import store
+
+
+class Snapshot(data_source.DataSource):
+
+    """
+    Read only data source showing the first length bytes of source
+    (by default source.snapshot_length(), the end of the last append
+    visible to readers).
+    """
+
+    def __init__(self, source, length=None):
+        if length is None:
+            length = source.snapshot_length()
+        self.source = source
+        self.pinned_length = length
+
+    @classmethod
+    def open(cls, path, length=None):
+        "Snapshot of the file at path, with its own open file."
+        source = file_source.FileSource(open(path, "rb"), positional=True)
+        return cls(source, length)
+
+    def close(self):
+        "Close the underlying source (only for snapshots made by open)."
+        self.source.close()
+
+    def length(self):
+        return self.pinned_length
+
+    def snapshot_length(self):
+        return self.pinned_length
+
+    def get_bytes(self, start_seek, length, strict=True):
+        end_seek = self.pinned_length
+        if start_seek > end_seek:
+            raise IndexError("seek past end of snapshot.")
+        if strict and start_seek + length > end_seek:
+            return None
+        # never read past the pinned length.
+        nbytes = min(length, end_seek - start_seek)
+        result = self.source.read_at(start_seek, nbytes) if nbytes else b""
+        if len(result) < nbytes:
+            raise IOError("data source is shorter than its snapshot.")
+        return (result, start_seek + length >= end_seek)
+
+    def read_at(self, start_seek, length):
+        return self.get_bytes(start_seek, length, strict=False)[0]
+
+    def reader(self, lazy=False):
+        "store.SCatReader for the sorted store as of this snapshot."
+        return store.SCatReader(self, lazy)
+
+    def key_index(self, base=None):
+        """
+        index.KeyIndex of the pellets as of this snapshot.  A base index
+        (not being updated meanwhile, such as one loaded from a sidecar)
+        covering no more than the snapshot is copied and caught up, else
+        the index is built from the start.
+        """
+        if base is not None and base.covered_length <= self.pinned_length:
+            result = index.KeyIndex(self, base.table, base.covered_length)
+            result.entries = dict(base.entries)
+        else:
+            result = index.KeyIndex(self)
+        result.catch_up()
+        return result
@@ -0,0 +1,373 @@
+"""
+Sorted s_cat store: pellets appended in key order with skip list back
+pointers in the pellet offsets, supporting logarithmic keyed lookup
+starting from the tail of the file.
+
+Pellet number i (counting from 0) records a pointer to pellet i - 2**l
+for every l with 2**l dividing i.  Each pointer is an (offset, count)
+pair where offset is the distance in bytes back from the start of the
+pellet to the start of the target pellet and count is 2**l.
+"""
+
+from . import compress
+from . import footer
+from . import key
+from . import value
+from . import pellet
+import itertools
+
+# forward reads of range scans.
+SCAN_CHUNK_SIZE = 1 << 16
+
+
+class OrderError(ValueError):
+    "Keys were not appended in sorted order."
+    pass
+
+
+def read_pellet(data_source, seek, payload_length=None, estimate=None, lazy=False):
+    """
+    Read the pellet starting at seek, usually in one or two reads
+    (see pellet.pellet_from_data_source_seek).
+    Return (pellet, end_seek) where end_seek follows the white delimiter if any.
+    """
+    return pellet.pellet_from_data_source_seek(data_source, seek, payload_length, estimate, lazy)
+
+
+def in_range(pellets, low, high):
+    "Pellets with low <= key.sort_key() < high (None bounds are open), stopping after high."
+    for current in pellets:
+        sort_key = current.key.sort_key()
+        if low is not None and sort_key < low:
+            continue
+        if high is not None and not (sort_key < high):
+            return
+        yield current
+
+
+def latest_pairs(pairs, keep_deleted=False):
+    """
+    From (key, values) pairs in key order, the last of each run of equal
+    keys, omitting deleted keys unless keep_deleted.
+    """
+    previous = None
+    for pair in itertools.chain(pairs, [None]):
+        if previous is not None:
+            if pair is not None and pair[0].sort_key() == previous[0].sort_key():
+                # superseded by pair.
+                previous = pair
+                continue
+            if keep_deleted or not isinstance(previous[1], value.Deleted):
+                yield previous
+        previous = pair
+
+
+def latest_values(pellets, lazy=False):
+    "latest_pairs of pellets in key order, copying lazy values unless lazy."
+    for (k, values) in latest_pairs((p.key, p.values) for p in pellets):
+        if not lazy and isinstance(values, value.LazyValues):
+            values = values.materialize()
+        yield (k, values)
+
+
+def lowest_level(index):
+    "Highest l such that 2**l divides index > 0."
+    return (index & -index).bit_length() - 1
+
+
+class SCatReader(object):
+
+    """
+    Keyed lookup in a sorted s_cat data source.  Pellets passed over in a
+    search are read with lazy values; found values are lazy
+    (value.LazyValues) only if lazy is True.
+    If a bloom.BloomFilter of the source is given, lookups of keys it
+    excludes return without reading, as long as it covers the source.
+    A compression dictionary carried by the source is registered.
+    """
+
+    def __init__(self, data_source, lazy=False, bloom=None):
+        compress.source_dictionary(data_source)
+        self.data_source = data_source
+        self.lazy = lazy
+        self.bloom = bloom
+        # sizes of the pellets this reader has seen.
+        self.estimate = pellet.ReadEstimate()
+
+    def tail(self):
+        "Return (seek, pellet) for the last pellet, or None if there are none."
+        return self.settle(self.last_pellet())
+
+    def last_pellet(self):
+        """
+        tail with lazy values.  A footer (see footer) gives the seek
+        directly; otherwise the offsets ending the last pellet (skipping
+        any amends) give it.
+        """
+        last = footer.read_footer(self.data_source)
+        if last is not None:
+            (result, end) = read_pellet(self.data_source, last.last_seek, None, self.estimate, lazy=True)
+            return (last.last_seek, result)
+        found = footer.last_token(self.data_source)
+        if found is None:
+            return None
+        (tail_bytes, tail_seek) = found
+        (payload_length, offsets, end) = pellet.offsets_from_bytes(tail_bytes)
+        seek = tail_seek - payload_length - 1
+        (result, end) = read_pellet(self.data_source, seek, payload_length, self.estimate, lazy=True)
+        return (seek, result)
+
+    def find(self, target):
+        "Return (seek, pellet) for the last pellet with key equal to target, or None."
+        if self.excludes(target):
+            return None
+        found = self.find_at_most(target)
+        if found is not None and not (found[1].key < target):
+            return found
+        return None
+
+    def excludes(self, target):
+        "True if the Bloom filter shows there is no pellet for target."
+        bloom = self.bloom
+        if bloom is None or bloom.covered_length < self.data_source.length():
+            return False
+        return not bloom.might_contain(target)
+
+    def settle(self, found):
+        "Copy the lazy values of a found pellet unless the reader is lazy."
+        if found is not None and not self.lazy:
+            result = found[1]
+            if isinstance(result.values, value.LazyValues):
+                result.values = result.values.materialize()
+        return found
+
+    def get(self, target):
+        "Return the values container stored for target, or None if absent or deleted."
+        found = self.find(target)
+        if found is None:
+            return None
+        values = found[1].values
+        if isinstance(values, value.Deleted):
+            return None
+        return values
+
+    def find_at_most(self, target):
+        """
+        Return (seek, pellet) for the last pellet with key less than or equal
+        to target, or None.  Reads O(log(number of pellets)) pellets.
+        """
+        return self.settle(self.find_last(lambda k: target < k))
+
+    def find_last(self, beyond):
+        """
+        Return (seek, pellet) for the last pellet whose key is not beyond,
+        or None, where beyond(key) is false for keys up to some point in the
+        key order and true after it.  The pellet values are lazy.
+        """
+        tail = self.last_pellet()
+        if tail is None:
+            return None
+        (seek, current) = tail
+        if not beyond(current.key):
+            return tail
+        # climb: follow the longest pointers until passing below target.
+        while True:
+            level = current.skip_levels() - 1
+            if level < 0:
+                # the first pellet is already beyond target.
+                return None
+            (offset, count) = current.skip(level)
+            best = self.pellet_at(seek - offset)
+            if not beyond(best[1].key):
+                break
+            (seek, current) = best
+        # descend: the answer lies between best and the current pellet.
+        while level > 0:
+            level -= 1
+            (offset, count) = current.skip(level)
+            candidate = self.pellet_at(seek - offset)
+            if beyond(candidate[1].key):
+                (seek, current) = candidate
+            else:
+                best = candidate
+        return best
+
+    def scan(self, start_key=None, end_key=None):
+        """
+        Generate (key, values) in key order for the keys k with
+        start_key <= k < end_key (either bound may be None), giving the
+        last values written for each key and omitting deleted keys.
+        """
+        low = None if start_key is None else start_key.sort_key()
+        high = None if end_key is None else end_key.sort_key()
+        return self.scan_sort_keys(low, high)
+
+    def prefix_scan(self, prefix):
+        """
+        Generate (key, values) like scan for the key prefix and the keys
+        extending it (see key.prefix_sort_key_ranges).
+        """
+        for (low, high) in key.prefix_sort_key_ranges(prefix):
+            for item in self.scan_sort_keys(low, high):
+                yield item
+
+    def scan_sort_keys(self, low, high, chunk_size=SCAN_CHUNK_SIZE):
+        "scan for keys with low <= k.sort_key() < high."
+        return self.latest(self.pellets_in_range(low, high, chunk_size))
+
+    def pellets_in_range(self, low, high, chunk_size=SCAN_CHUNK_SIZE):
+        """
+        Generate all pellets (with lazy values) with low <= key.sort_key() < high,
+        in file order.  The search jumps to the last pellet before low and
+        reads forward until passing high.
+        """
+        if low is None:
+            start_seek = 0
+        else:
+            before = self.find_last(lambda k: not (k.sort_key() < low))
+            start_seek = 0 if before is None else before[0]
+        found = pellet.iter_pellets(self.data_source, start_seek, chunk_size, lazy=True)
+        return in_range((p for (seek, p) in found), low, high)
+
+    def latest(self, pellets):
+        "Generate (key, values) for the last of each run of equal keys, omitting deleted keys."
+        return latest_values(pellets, self.lazy)
+
+    def pellet_at(self, seek):
+        (result, end) = read_pellet(self.data_source, seek, estimate=self.estimate, lazy=True)
+        return (seek, result)
+
+
+class SCatWriter(object):
+
+    """
+    Append pellets in nondecreasing key order, filling in skip offsets.
+    A writer opened on a non empty source recovers its state from the
+    tail by following O(log(number of pellets)) pointers.
+    If an index.KeyIndex or a bloom.BloomFilter covering the source is
+    given it is kept current.  Values are compressed by compressor (a
+    compress.Compressor) if given; a new file starts with its dictionary,
+    and an existing one must already start with it.
+    """
+
+    def __init__(self, data_source, index=None, bloom=None, compressor=None):
+        data_source.assertIsWriteable()
+        self.data_source = data_source
+        self.index = index
+        self.bloom = bloom
+        self.compressor = compressor
+        self.end_seek = data_source.length()
+        self.count = 0
+        self.last_key = None
+        # level_seeks[l]: seek of the latest pellet with index divisible by 2**l
+        # for levels not yet reached that is the first pellet.
+        self.level_seeks = []
+        self.first_seek = None
+        dictionary = None if compressor is None else compressor.dictionary
+        if self.end_seek > 0:
+            if dictionary is not None and compress.source_dictionary(data_source) != compress.dictionary_id(dictionary):
+                raise ValueError("compressor dictionary is not the one the data source starts with.")
+            self.recover()
+            return
+        if dictionary is not None:
+            encoded = compress.dictionary_block(dictionary)
+            self.end_seek = data_source.append(encoded) + len(encoded)
+        compress.started_source(data_source, dictionary)
+
+    def recover(self):
+        tail = SCatReader(self.data_source).last_pellet()
+        if tail is None:
+            if self.only_amends():
+                # a dictionary block, say: the first pellet comes next.
+                return
+            raise key.FormatError("no pellets found in non empty source")
+        (seek, current) = tail
+        self.last_key = current.key
+        # the longest pointers lead from the tail back to pellet 0.
+        path = [seek]
+        index = 0
+        while current.skip_levels():
+            (offset, count) = current.skip(-1)
+            index += count
+            seek -= offset
+            (current, end) = read_pellet(self.data_source, seek, lazy=True)
+            path.append(seek)
+        self.count = index + 1
+        self.first_seek = path[-1]
+        # path[j] has the index of the tail with its j lowest set bits cleared.
+        remaining = index
+        for path_seek in path:
+            top = lowest_level(remaining) if remaining else 0
+            while len(self.level_seeks) <= top:
+                self.level_seeks.append(path_seek)
+            remaining &= remaining - 1
+
+    def only_amends(self):
+        "True if the (non empty) source holds amends tokens and no pellets."
+        (first, at_eof) = self.data_source.get_bytes(0, 1)
+        if bytes(first) != pellet.AMENDS_INDICATOR:
+            return False
+        for found in pellet.iter_pellets(self.data_source, lazy=True):
+            return False
+        return True
+
+    def add(self, pkey, pvalues):
+        "Append a pellet for pkey and pvalues, returning its seek."
+        if self.last_key is not None and pkey < self.last_key:
+            raise OrderError("key out of order: " + repr(pkey))
+        index = self.count
+        separator = b"\n" if self.end_seek > 0 else b""
+        seek = self.end_seek + len(separator)
+        offsets = []
+        level_seeks = self.level_seeks
+        if index > 0:
+            for level in range(lowest_level(index) + 1):
+                if level < len(level_seeks):
+                    target = level_seeks[level]
+                else:
+                    target = self.first_seek
+                offsets.append((seek - target, 1 << level))
+        if self.compressor is not None and isinstance(pvalues, (value.Values, value.LazyValues)):
+            pvalues = value.PackedValues.pack(pvalues.sequence, self.compressor)
+        result = pellet.Pellet(pkey, pvalues)
+        result.set_offsets(None, offsets)
+        encoded = separator + result.to_bytes()
+        self.end_seek = self.append(encoded)
+        if index == 0:
+            self.first_seek = seek
+        top = lowest_level(index) if index > 0 else 0
+        for level in range(top + 1):
+            if level < len(level_seeks):
+                level_seeks[level] = seek
+            else:
+                level_seeks.append(seek)
+        self.count = index + 1
+        self.last_key = pkey
+        if self.index is not None:
+            self.index.record(pkey.to_bytes(), seek, result.payload_length, self.end_seek)
+        if self.bloom is not None:
+            self.bloom.record(pkey.sort_key(), seek, result.payload_length, self.end_seek)
+        return seek
+
+    def write_footer(self, index=None):
+        """
+        Append a footer (see footer) recording the last pellet and, if
+        index (an index.KeyIndex of the source) is given, an index block.
+        """
+        if self.count == 0:
+            raise ValueError("no pellets for the footer to record.")
+        encoded = footer.footer_block(self.level_seeks[0], self.end_seek, index)
+        self.end_seek = self.append(encoded)
+
+    def append(self, encoded):
+        """
+        Append encoded at end_seek, returning the new end.  The offsets in
+        encoded are relative to end_seek, so if another writer has extended
+        the source nothing is written.
+        """
+        if self.data_source.length() != self.end_seek:
+            raise IOError("data source was extended by another writer.")
+        chunk_seek = self.data_source.append(encoded)
+        if chunk_seek != self.end_seek:
+            raise IOError("data source was extended by another writer.")
+        return chunk_seek + len(encoded)
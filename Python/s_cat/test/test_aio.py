@@ -0,0 +1,90 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import unittest
+from .. import aio
+from .. import data_source
+from .. import index
+from .. import key
+from .. import pellet
+from .. import store
+from .. import value
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+class TestAsyncSource(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "data.scat")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_reads(self):
+        s = aio.ExecutorSource(data_source.BytesSource(b"abc def\nghi"), max_workers=2)
+        try:
+            self.assertEqual(run(s.length()), 11)
+            (chunk, at_eof) = run(s.get_bytes(4, 3))
+            self.assertEqual(bytes(chunk), b"def")
+            self.assertFalse(at_eof)
+            self.assertIsNone(run(s.get_bytes(8, 5)))
+            self.assertEqual(bytes(run(s.get_bytes_to_ws_or_eof(4, initial_length=1))), b"def")
+            self.assertEqual(bytes(run(s.get_bytes_to_ws_or_eof(8))), b"ghi")
+            (tail, seek) = run(s.get_bytes_from_ws_to_eof(initial_length=2))
+            self.assertEqual((bytes(tail), seek), (b"ghi", 8))
+        finally:
+            s.close()
+
+    def test_coalesced(self):
+        s = aio.ExecutorSource(data_source.BytesSource(b"x" * 1000), max_workers=2)
+
+        async def many():
+            return await asyncio.gather(*[s.get_bytes(100, 50) for i in range(100)])
+
+        try:
+            found = run(many())
+            self.assertEqual(len(found), 100)
+            self.assertTrue(all(bytes(chunk) == b"x" * 50 for (chunk, at_eof) in found))
+            self.assertEqual(s.reads, 1)
+            self.assertEqual(s.in_flight, {})
+        finally:
+            s.close()
+
+    def test_fetch(self):
+        pairs = [(key.CompositeKey(key.StringKey(u"t%d" % (n % 3)), key.NumberKey(n)),
+                  value.Values([b"v" * n])) for n in range(200)]
+        pairs.sort(key=lambda pair: pair[0].sort_key())
+        with open(self.path, "w+b") as f:
+            sync = data_source.BytesSource(b"", writeable=True)
+            w = store.SCatWriter(sync)
+            seeks = [w.add(k, v) for (k, v) in pairs]
+            f.write(sync.byte_data)
+        i = index.KeyIndex(sync)
+        i.catch_up()
+        s = aio.AsyncFileSource.open(self.path, max_workers=4)
+
+        async def fetch_all():
+            keys = await asyncio.gather(*[aio.key_from_data_source_seek(s, seek) for seek in seeks])
+            pellets = await asyncio.gather(*[aio.pellet_from_data_source_seek(s, seek) for seek in seeks])
+            found = await asyncio.gather(*[aio.index_get(i, s, k) for (k, v) in pairs])
+            missing = await aio.index_get(i, s, key.NumberKey(-1))
+            return (keys, pellets, found, missing)
+
+        try:
+            (keys, pellets, found, missing) = run(fetch_all())
+            self.assertEqual([k.to_bytes() for (k, end) in keys], [k.to_bytes() for (k, v) in pairs])
+            for ((p, end), (k, v)) in zip(pellets, pairs):
+                self.assertEqual(p.key.to_bytes(), k.to_bytes())
+                self.assertEqual(p.values.sequence, v.sequence)
+            self.assertEqual([v.sequence for v in found], [v.sequence for (k, v) in pairs])
+            self.assertIsNone(missing)
+            self.assertEqual(run(s.length()), sync.length())
+            self.assertEqual(pellet.pellet_from_data_source_seek(sync, seeks[5])[0].to_bytes(),
+                             pellets[5][0].to_bytes())
+        finally:
+            s.close()
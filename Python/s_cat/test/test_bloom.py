@@ -0,0 +1,149 @@
+import os
+import shutil
+import tempfile
+import unittest
+from .. import bloom
+from .. import data_source
+from .. import index
+from .. import key
+from .. import merge
+from .. import store
+from .. import value
+from .test_index import ReadCountingSource, add_pellet
+
+
+def number_bytes(i):
+    return key.NumberKey(i).sort_key()
+
+
+class TestBloomFilter(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "data.scat.bloom")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_no_false_negatives(self):
+        b = bloom.BloomFilter(None, 0.01, capacity=100)
+        for i in range(1000):
+            b.add(number_bytes(i))
+        # grew by layers rather than saturating the first.
+        self.assertGreater(len(b.layers), 1)
+        for i in range(1000):
+            self.assertIn(number_bytes(i), b)
+        self.assertTrue(b.might_contain(key.NumberKey(5)))
+
+    def test_false_positive_rate(self):
+        rate = 0.02
+        b = bloom.BloomFilter(None, rate, capacity=64)
+        for i in range(2000):
+            b.add(number_bytes(i))
+        trials = 20000
+        false = sum(1 for i in range(trials) if number_bytes(-1 - i) in b)
+        self.assertLess(false / float(trials), 2 * rate)
+        self.assertLessEqual(len(b), 2000)
+
+    def test_duplicates_do_not_fill(self):
+        b = bloom.BloomFilter(None, capacity=8)
+        for i in range(100):
+            b.add(number_bytes(1))
+        self.assertEqual(len(b), 1)
+        self.assertEqual(len(b.layers), 1)
+
+    def test_invalid_rate(self):
+        self.assertRaises(ValueError, bloom.BloomFilter, None, 0)
+        self.assertRaises(ValueError, bloom.BloomFilter, None, 1.5)
+
+    def test_sidecar(self):
+        s = data_source.BytesSource(b"", writeable=True)
+        add_pellet(s, key.StringKey(u"b"), value.Values([b"1"]))
+        add_pellet(s, key.NumberKey(7), value.Deleted())
+        b = bloom.BloomFilter.open(s, self.path, capacity=2)
+        self.assertEqual(b.covered_length, s.length())
+        self.assertTrue(os.path.exists(self.path))
+        add_pellet(s, key.CompositeKey(key.StringKey(u"c"), key.NumberKey(1)), value.Values([b"2"]))
+        add_pellet(s, key.StringKey(u"d"), value.Values([b"3"]))
+        b = bloom.BloomFilter.open(s, self.path)
+        self.assertEqual(b.capacity, 2)
+        self.assertEqual(b.covered_length, s.length())
+        for k in [key.StringKey(u"b"), key.NumberKey(7), key.StringKey(u"d"),
+                  key.CompositeKey(key.StringKey(u"c"), key.NumberKey(1))]:
+            self.assertTrue(b.might_contain(k))
+        loaded = bloom.BloomFilter.load(s, self.path)
+        self.assertEqual(loaded.to_bytes(), b.to_bytes())
+        # a sidecar for longer data, or a damaged one, is rebuilt.
+        shorter = data_source.BytesSource(b"", writeable=True)
+        add_pellet(shorter, key.StringKey(u"e"), value.Values([b"4"]))
+        b = bloom.BloomFilter.open(shorter, self.path)
+        self.assertFalse(b.might_contain(key.StringKey(u"d")))
+        self.assertTrue(b.might_contain(key.StringKey(u"e")))
+        with open(self.path, "wb") as f:
+            f.write(bloom.SIDECAR_MAGIC + b"short")
+        self.assertRaises(index.SidecarError, bloom.BloomFilter.load, shorter, self.path)
+        b = bloom.BloomFilter.open(shorter, self.path)
+        self.assertTrue(b.might_contain(key.StringKey(u"e")))
+        same_length = data_source.BytesSource(b"", writeable=True)
+        add_pellet(same_length, key.StringKey(u"f"), value.Values([b"4"]))
+        self.assertEqual(same_length.length(), shorter.length())
+        self.assertRaises(index.SidecarError, bloom.BloomFilter.load, same_length, self.path)
+        b = bloom.BloomFilter.open(same_length, self.path)
+        self.assertTrue(b.might_contain(key.StringKey(u"f")))
+        self.assertFalse(b.might_contain(key.StringKey(u"e")))
+
+    def test_negative_lookup_reads_nothing(self):
+        s = ReadCountingSource(b"", writeable=True)
+        b = bloom.BloomFilter(s, 0.001)
+        w = store.SCatWriter(s, bloom=b)
+        for i in range(0, 400, 2):
+            w.add(key.NumberKey(i), value.Values([str(i).encode("ascii")]))
+        self.assertEqual(b.covered_length, s.length())
+        r = store.SCatReader(s, bloom=b)
+        s.requested = []
+        false = 0
+        for i in range(1, 400, 2):
+            self.assertIsNone(r.get(key.NumberKey(i)))
+            if b.might_contain(key.NumberKey(i)):
+                false += 1
+        self.assertLess(false, 5)
+        if not false:
+            self.assertEqual(s.requested, [])
+        self.assertEqual(r.get(key.NumberKey(10)).sequence, [b"10"])
+        # an appended pellet the filter does not cover is still found.
+        stale = store.SCatReader(s, bloom=bloom.BloomFilter(s))
+        self.assertEqual(stale.get(key.NumberKey(10)).sequence, [b"10"])
+
+    def test_equal_keys_of_other_types(self):
+        s = data_source.BytesSource(b"", writeable=True)
+        b = bloom.BloomFilter(s)
+        w = store.SCatWriter(s, bloom=b)
+        w.add(key.NumberKey(3), value.Values([b"three"]))
+        w.add(key.NumberKey(4.5), value.Values([b"four and a half"]))
+        self.assertNotEqual(key.NumberKey(3).to_bytes(), key.NumberKey(3.0).to_bytes())
+        caught_up = bloom.BloomFilter(s)
+        caught_up.catch_up()
+        for filter in (b, caught_up):
+            self.assertTrue(filter.might_contain(key.NumberKey(3.0)))
+            r = store.SCatReader(s, bloom=filter)
+            self.assertEqual(r.get(key.NumberKey(3.0)).sequence, [b"three"])
+            self.assertEqual(r.get(key.NumberKey(3)).sequence, [b"three"])
+
+    def test_segment_view(self):
+        old = data_source.BytesSource(b"", writeable=True)
+        new = ReadCountingSource(b"", writeable=True)
+        old_bloom = bloom.BloomFilter(old)
+        new_bloom = bloom.BloomFilter(new)
+        w = store.SCatWriter(old, bloom=old_bloom)
+        for i in range(50):
+            w.add(key.NumberKey(i), value.Values([b"old"]))
+        w = store.SCatWriter(new, bloom=new_bloom)
+        for i in range(40, 60):
+            w.add(key.NumberKey(i), value.Values([b"new"]))
+        view = merge.SegmentView([old, new], blooms=[old_bloom, new_bloom])
+        new.requested = []
+        self.assertEqual(view.get(key.NumberKey(3)).sequence, [b"old"])
+        if not new_bloom.might_contain(key.NumberKey(3)):
+            self.assertEqual(new.requested, [])
+        self.assertEqual(view.get(key.NumberKey(45)).sequence, [b"new"])
+        self.assertIsNone(view.get(key.NumberKey(99)))
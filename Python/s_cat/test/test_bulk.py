@@ -0,0 +1,100 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from .. import bulk
+from .. import data_source
+from .. import file_source
+from .. import index
+from .. import key
+from .. import store
+from .. import value
+
+
+def shuffled_pairs(count, seed=1):
+    numbers = list(range(count))
+    random.Random(seed).shuffle(numbers)
+    for n in numbers:
+        yield (key.NumberKey(n), [str(n).encode("ascii")])
+
+
+class TestBulkLoad(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def check_store(self, source, count):
+        r = store.SCatReader(source)
+        for n in (0, 1, count // 2, count - 1):
+            self.assertEqual(r.get(key.NumberKey(n)).sequence, [str(n).encode("ascii")])
+        self.assertIsNone(r.get(key.NumberKey(count)))
+
+    def test_in_memory(self):
+        s = data_source.BytesSource(b"", writeable=True)
+        self.assertEqual(bulk.bulk_load(s, shuffled_pairs(100)), 100)
+        self.check_store(s, 100)
+
+    def test_spilled_runs(self):
+        s = data_source.BytesSource(b"", writeable=True)
+        i = index.KeyIndex(s)
+        count = bulk.bulk_load(s, shuffled_pairs(1000), run_size=64, temp_dir=self.directory, index=i)
+        self.assertEqual(count, 1000)
+        self.check_store(s, 1000)
+        self.assertEqual(i.covered_length, s.length())
+        self.assertEqual(len(i), 1000)
+        self.assertEqual(i.get(key.NumberKey(999)).sequence, [b"999"])
+        fresh = index.KeyIndex(s)
+        fresh.catch_up()
+        self.assertEqual(sorted(fresh.items()), sorted(i.items()))
+        # temporary runs are removed.
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_stable_duplicates(self):
+        pairs = [(key.StringKey(u"k%d" % (n % 3)), [str(n).encode("ascii")]) for n in range(10)]
+        pairs.append((key.StringKey(u"k0"), value.Deleted()))
+        for run_size in (2, 3, 100):
+            s = data_source.BytesSource(b"", writeable=True)
+            i = index.KeyIndex(s)
+            bulk.bulk_load(s, pairs, run_size=run_size, index=i)
+            for r in (store.SCatReader(s), i):
+                self.assertIsNone(r.get(key.StringKey(u"k0")))
+                self.assertEqual(r.get(key.StringKey(u"k1")).sequence, [b"7"])
+                self.assertEqual(r.get(key.StringKey(u"k2")).sequence, [b"8"])
+
+    def test_bounded_fan_in(self):
+        pairs = [(key.NumberKey(n % 37), value.Values([str(n).encode("ascii")])) for n in range(500)]
+        expected = [(k, v.sequence) for (k, v) in sorted(pairs, key=bulk.pair_key)]
+        # 125 runs merged 3 at a time take several passes.
+        merged = bulk.sorted_pairs(iter(pairs), run_size=4, temp_dir=self.directory, fan_in=3)
+        self.assertEqual([(k, v.sequence) for (k, v) in merged], expected)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_index_of_existing_data(self):
+        s = data_source.BytesSource(b"", writeable=True)
+        i = index.KeyIndex(s)
+        bulk.bulk_load(s, shuffled_pairs(50), index=i)
+        bulk.bulk_load(s, [(key.NumberKey(n), [b"again"]) for n in range(49, 60)], presorted=True, index=i)
+        self.assertEqual(len(i), 60)
+        self.assertEqual(i.covered_length, s.length())
+        self.assertEqual(i.get(key.NumberKey(48)).sequence, [b"48"])
+        self.assertEqual(i.get(key.NumberKey(49)).sequence, [b"again"])
+        self.assertEqual(i.get(key.NumberKey(55)).sequence, [b"again"])
+        self.assertEqual(i.entries, {})
+
+    def test_presorted(self):
+        s = data_source.BytesSource(b"", writeable=True)
+        pairs = [(key.NumberKey(n), [str(n).encode("ascii")]) for n in range(20)]
+        self.assertEqual(bulk.bulk_load(s, iter(pairs), presorted=True), 20)
+        self.check_store(s, 20)
+        with self.assertRaises(store.OrderError):
+            bulk.bulk_load(s, [(key.NumberKey(3), [b"y"])], presorted=True)
+
+    def test_file(self):
+        path = os.path.join(self.directory, "bulk.scat")
+        bulk.bulk_load_file(path, shuffled_pairs(500), run_size=100, temp_dir=self.directory)
+        with open(path, "rb") as f:
+            self.check_store(file_source.FileSource(f), 500)
@@ -0,0 +1,49 @@
+from . import test_data_source
+from .. import data_source
+from .. import caching_source
+from .. import key
+
+
+class TestCachingSource(test_data_source.TestByteSource):
+
+    def get_source(self, byte_data, writeable=False, **kwargs):
+        inner = data_source.BytesSource(byte_data, writeable=writeable)
+        kwargs.setdefault("block_size", 7)
+        return caching_source.CachingDataSource(inner, **kwargs)
+
+    def test_counters(self):
+        s = self.get_source(b"C S3 abc N43 " * 10, block_size=16)
+        (k, end) = key.key_from_data_source_seek(s, 0)
+        self.assertEqual(k.value(), (u"abc", 43))
+        misses = s.misses
+        self.assertTrue(misses > 0)
+        (k, end) = key.key_from_data_source_seek(s, 0)
+        self.assertEqual(s.misses, misses)
+        self.assertTrue(s.hits > 0)
+        self.assertEqual(s.evictions, 0)
+        self.assertEqual(s.stats()["cached_bytes"], s.cached_bytes)
+
+    def test_eviction(self):
+        text = bytes(bytearray(range(100)))
+        s = self.get_source(text, block_size=10, max_bytes=30)
+        for start in range(0, 100, 10):
+            self.assertEqual(s.get_bytes(start, 10), (text[start:start + 10], start == 90))
+        self.assertEqual(len(s.blocks), 3)
+        self.assertEqual(s.cached_bytes, 30)
+        self.assertEqual(s.evictions, 7)
+        # most recently used blocks survive.
+        self.assertEqual(list(s.blocks), [7, 8, 9])
+        s.get_bytes(75, 10)
+        self.assertEqual(s.misses, 10)
+        s.clear()
+        self.assertEqual(s.cached_bytes, 0)
+
+    def test_append_refreshes_tail(self):
+        s = self.get_source(b"abc", writeable=True, block_size=4)
+        self.assertEqual(s.get_bytes(0, 3), (b"abc", True))
+        self.assertEqual(s.append(b"defgh"), 3)
+        self.assertEqual(s.get_bytes(0, 8), (b"abcdefgh", True))
+        self.assertEqual(s.get_bytes_from_ws_to_eof(), None)
+        # growth behind the wrapper's back is also noticed.
+        s.source.append(b"ij")
+        self.assertEqual(s.get_bytes(6, 4), (b"ghij", True))
@@ -0,0 +1,116 @@
+import contextlib
+import io
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from .. import bulk
+from .. import compact
+from .. import compress
+from .. import data_source
+from .. import file_source
+from .. import key
+from .. import pellet
+from .. import store
+from .. import value
+
+
+def write_unsorted(path, pairs):
+    with open(path, "wb") as f:
+        f.write(b"\n".join(pellet.Pellet(k, v).to_bytes() for (k, v) in pairs))
+
+
+class TestCompact(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.paths = [os.path.join(self.directory, "part%d.scat" % i) for i in range(2)]
+        self.output = os.path.join(self.directory, "compacted.scat")
+        rng = random.Random(4)
+        self.latest = {}
+        for path in self.paths:
+            pairs = []
+            for i in range(400):
+                n = rng.randrange(150)
+                if rng.randrange(4) == 0:
+                    v = value.Deleted()
+                else:
+                    v = value.Values([b"%d:%d" % (n, i), b"x" * rng.randrange(50)])
+                pairs.append((key.NumberKey(n), v))
+                self.latest[n] = v
+            write_unsorted(path, pairs)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def check(self, path):
+        with open(path, "rb") as f:
+            r = store.SCatReader(file_source.FileSource(f, positional=True))
+            found = [(k.value(), [bytes(x) for x in v.sequence]) for (k, v) in r.scan()]
+        expected = [(n, v.sequence) for (n, v) in sorted(self.latest.items())
+                    if not isinstance(v, value.Deleted)]
+        self.assertEqual(found, expected)
+        return len(expected)
+
+    def test_compact_files(self):
+        for run_size in (7, 100000):
+            stats = compact.compact_files(self.paths, self.output, run_size=run_size, temp_dir=self.directory)
+            live = self.check(self.output)
+            self.assertEqual(stats["pellets_read"], 800)
+            self.assertEqual(stats["pellets_written"], live)
+            self.assertEqual(stats["bytes_read"], sum(os.path.getsize(p) for p in self.paths))
+            self.assertEqual(stats["bytes_written"], os.path.getsize(self.output))
+            self.assertEqual(stats["bytes_reclaimed"], stats["bytes_read"] - stats["bytes_written"])
+            self.assertTrue(stats["bytes_reclaimed"] > 0)
+        self.assertEqual(sorted(os.listdir(self.directory)), ["compacted.scat", "part0.scat", "part1.scat"])
+
+    def test_in_place_and_main(self):
+        # compacting a compacted file changes nothing.
+        compact.compact_files(self.paths, self.output)
+        with open(self.output, "rb") as f:
+            before = f.read()
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            stats = compact.main([self.output, self.output])
+        with open(self.output, "rb") as f:
+            self.assertEqual(f.read(), before)
+        self.assertEqual(stats["bytes_reclaimed"], 0)
+        self.assertIn("reclaimed", out.getvalue())
+
+    def test_dictionary(self):
+        dictionary = b"".join(b"a fairly repetitive description of item %d " % i * 3 for i in range(10))
+        compressor = compress.Compressor(threshold=16, dictionary=dictionary)
+        pairs = [(key.NumberKey(n % 30), [b"a fairly repetitive description of item %d " % n * 3]) for n in range(60)]
+        bulk.bulk_load_file(self.output, pairs, compressor=compressor)
+        # in place: the output replaces the only copy of the dictionary.
+        compact.compact_files([self.output], self.output)
+        with open(self.output, "rb") as f:
+            self.assertTrue(f.read().startswith(compress.DICTIONARY_INDICATOR))
+        # as in a new process: nothing registered, the file opened afresh.
+        compress.dictionaries.clear()
+        with open(self.output, "rb") as f:
+            r = store.SCatReader(file_source.FileSource(f, positional=True))
+            self.assertEqual(r.get(key.NumberKey(7)).sequence, [b"a fairly repetitive description of item 37 " * 3])
+        # values compressed with different dictionaries cannot share a store.
+        other = os.path.join(self.directory, "other.scat")
+        other_compressor = compress.Compressor(threshold=16, dictionary=dictionary[::-1])
+        bulk.bulk_load_file(other, pairs[:5], compressor=other_compressor)
+        target = os.path.join(self.directory, "mixed.scat")
+        self.assertRaises(ValueError, compact.compact_files, [self.output, other], target)
+        self.assertFalse(os.path.exists(target))
+        # sources without a dictionary mix with one that has it.
+        compact.compact_files([self.paths[0], self.output], target)
+        compress.dictionaries.clear()
+        with open(target, "rb") as f:
+            r = store.SCatReader(file_source.FileSource(f, positional=True))
+            self.assertEqual(r.get(key.NumberKey(8)).sequence, [b"a fairly repetitive description of item 38 " * 3])
+
+    def test_latest_pairs(self):
+        k = key.StringKey
+        pairs = [(k(u"a"), value.Values([b"1"])), (k(u"a"), value.Deleted()), (k(u"b"), value.Deleted()),
+                 (k(u"b"), value.Values([b"2"])), (k(u"c"), value.Values([b"3"]))]
+        self.assertEqual([(a.value(), v.sequence) for (a, v) in store.latest_pairs(pairs)],
+                         [(u"b", [b"2"]), (u"c", [b"3"])])
+        self.assertEqual(list(store.latest_pairs([])), [])
+        self.assertEqual([a.value() for (a, v) in store.latest_pairs(pairs, keep_deleted=True)], [u"a", u"b", u"c"])
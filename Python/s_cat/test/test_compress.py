@@ -0,0 +1,164 @@
+import json
+import os
+import tempfile
+import unittest
+from .. import compress
+from .. import data_source
+from .. import fast_parse
+from .. import file_source
+from .. import footer
+from .. import index
+from .. import key
+from .. import pellet
+from .. import store
+from .. import value
+
+
+def document(i):
+    "A JSON-ish value that compresses well."
+    record = {"id": i, "name": "item %d" % i, "tags": ["alpha", "beta", "gamma"] * 4,
+              "description": "a fairly repetitive description of item number %d " % i * 3}
+    return json.dumps(record, sort_keys=True).encode("utf8")
+
+
+class TestCompress(unittest.TestCase):
+
+    def decoders(self, encoded):
+        "Values decoded from encoded by each parser, eagerly and lazily."
+        yield value.values_from_bytes(encoded)[0]
+        yield value.values_from_bytes(encoded, lazy=True)[0]
+        yield fast_parse.values_from_bytes(encoded)[0]
+        yield fast_parse.values_from_bytes(encoded, lazy=True)[0]
+
+    def test_codecs(self):
+        sequence = [b"small", document(1), b"", document(2)]
+        for codec in sorted(compress.CODECS):
+            compressor = compress.Compressor(codec, threshold=64)
+            packed = value.PackedValues.pack(sequence, compressor)
+            self.assertIsInstance(packed, value.PackedValues)
+            self.assertEqual([p for (p, item) in packed.items], [False, True, False, True])
+            encoded = packed.to_bytes()
+            self.assertLess(len(encoded), len(value.Values(sequence).to_bytes()))
+            for decoded in self.decoders(encoded):
+                self.assertIsInstance(decoded, value.PackedValues)
+                self.assertEqual(decoded.sequence, sequence)
+                self.assertEqual(decoded.to_bytes(), encoded)
+                self.assertEqual(decoded.materialize().sequence, sequence)
+                self.assertEqual(decoded[-1], document(2))
+                self.assertEqual(len(decoded), 4)
+
+    def test_raw_below_threshold(self):
+        compressor = compress.Compressor(threshold=1000)
+        packed = value.PackedValues.pack([document(1)], compressor)
+        self.assertIsInstance(packed, value.Values)
+        # incompressible values stay raw too.
+        noise = os.urandom(2000)
+        self.assertIsNone(compressor.pack(noise))
+        self.assertIsInstance(value.PackedValues.pack([noise], compressor), value.Values)
+        self.assertRaises(ValueError, compress.Compressor, "snappy")
+        self.assertRaises(ValueError, compress.Compressor, "lzma", dictionary=b"x")
+
+    def test_lazy_decompression(self):
+        encoded = value.PackedValues.pack([document(1), document(2)], compress.Compressor()).to_bytes()
+        decoded = fast_parse.values_from_bytes(encoded)[0]
+        self.assertEqual(decoded.decoded, [None, None])
+        self.assertEqual(decoded[1], document(2))
+        self.assertEqual(decoded.decoded, [None, document(2)])
+
+    def test_dictionary(self):
+        dictionary = b"".join(document(i) for i in range(1000, 1005))
+        compressor = compress.Compressor(threshold=16, dictionary=dictionary)
+        plain = compress.Compressor(threshold=16)
+        self.assertLess(len(compressor.pack(document(7))), len(plain.pack(document(7))))
+        encoded = value.PackedValues.pack([document(7)], compressor).to_bytes()
+        ident = compress.dictionary_id(dictionary)
+        del compress.dictionaries[ident]
+        decoded = value.values_from_bytes(encoded)[0]
+        self.assertRaises(key.FormatError, decoded.__getitem__, 0)
+        # the file written with the dictionary carries it.
+        s = data_source.BytesSource(b"", writeable=True)
+        w = store.SCatWriter(s, compressor=compressor)
+        for i in range(10):
+            w.add(key.NumberKey(i), value.Values([document(i)]))
+        self.assertNotIn(ident, compress.dictionaries)
+        self.assertEqual(compress.read_dictionary(s), ident)
+        self.assertEqual(decoded[0], document(7))
+        self.assertIsNone(compress.read_dictionary(data_source.BytesSource(b"N1\nD\nO3")))
+        r = store.SCatReader(s)
+        self.assertEqual(r.get(key.NumberKey(3)).sequence, [document(3)])
+        self.assertEqual([p.key for (seek, p) in pellet.iter_pellets(s)], [key.NumberKey(i) for i in range(10)])
+        # a store holding only its dictionary reopens as empty.
+        started = data_source.BytesSource(b"", writeable=True)
+        store.SCatWriter(started, compressor=compressor)
+        reopened = store.SCatWriter(started, compressor=compressor)
+        self.assertEqual((reopened.count, reopened.end_seek), (0, started.length()))
+        reopened.add(key.NumberKey(1), value.Values([document(1)]))
+        self.assertEqual(store.SCatReader(started).get(key.NumberKey(1)).sequence, [document(1)])
+        self.assertEqual(store.SCatWriter(started).count, 1)
+        self.assertRaises(key.FormatError, store.SCatWriter, data_source.BytesSource(b"xyz", writeable=True))
+        # reopening a store with another dictionary, or none, would write undecodable values.
+        other = compress.Compressor(threshold=16, dictionary=dictionary[::-1])
+        self.assertRaises(ValueError, store.SCatWriter, s, compressor=other)
+        plain_store = data_source.BytesSource(b"", writeable=True)
+        store.SCatWriter(plain_store).add(key.NumberKey(1), value.Values([b"1"]))
+        self.assertRaises(ValueError, store.SCatWriter, plain_store, compressor=compressor)
+        store.SCatWriter(plain_store, compressor=plain).add(key.NumberKey(2), value.Values([document(2)]))
+        # a writer reopening the file recovers past the dictionary.
+        w = store.SCatWriter(s, compressor=compressor)
+        w.add(key.NumberKey(10), value.Values([document(10)]))
+        self.assertEqual(r.get(key.NumberKey(10)).sequence, [document(10)])
+
+    def test_store(self):
+        raw = data_source.BytesSource(b"", writeable=True)
+        s = data_source.BytesSource(b"", writeable=True)
+        i = index.KeyIndex(s)
+        w = store.SCatWriter(s, index=i, compressor=compress.Compressor())
+        raw_writer = store.SCatWriter(raw)
+        for n in range(200):
+            values = value.Values([document(n), b"short"])
+            w.add(key.NumberKey(n), values)
+            raw_writer.add(key.NumberKey(n), values)
+        w.add(key.NumberKey(200), value.Deleted())
+        self.assertLess(s.length() * 2, raw.length())
+        for lazy in (False, True):
+            r = store.SCatReader(s, lazy=lazy)
+            self.assertEqual(r.get(key.NumberKey(77)).sequence, [document(77), b"short"])
+            self.assertEqual(i.get(key.NumberKey(78), lazy=lazy).sequence, [document(78), b"short"])
+            self.assertIsNone(r.get(key.NumberKey(200)))
+        scanned = [(k, v.sequence) for (k, v) in store.SCatReader(s).scan(key.NumberKey(10), key.NumberKey(12))]
+        self.assertEqual(scanned, [(key.NumberKey(n), [document(n), b"short"]) for n in (10, 11)])
+        # reads guided by the length headers of compressed values.
+        estimate = pellet.ReadEstimate()
+        seek = i.find(key.NumberKey(5))[0]
+        (result, end) = pellet.pellet_from_data_source_seek(s, seek, estimate=estimate)
+        self.assertEqual(result.values.sequence, [document(5), b"short"])
+        self.assertEqual(footer.open_index(s).get(key.NumberKey(9)).sequence, [document(9), b"short"])
+
+    def test_fresh_registry(self):
+        dictionary = b"".join(document(i) for i in range(2000, 2005))
+        with tempfile.NamedTemporaryFile() as f:
+            source = file_source.FileSource(f, writeable=True)
+            i = index.KeyIndex(source)
+            w = store.SCatWriter(source, index=i, compressor=compress.Compressor(threshold=16, dictionary=dictionary))
+            for n in range(20):
+                w.add(key.NumberKey(n), value.Values([document(n)]))
+            w.write_footer(i)
+            f.flush()
+            # as in a new process: nothing registered, sources opened afresh.
+            compress.dictionaries.clear()
+            reopened = [file_source.FileSource(open(f.name, "rb"), positional=True) for n in range(3)]
+            try:
+                self.assertEqual(store.SCatReader(reopened[0]).get(key.NumberKey(3)).sequence, [document(3)])
+                compress.dictionaries.clear()
+                self.assertEqual(footer.open_index(reopened[1]).get(key.NumberKey(4)).sequence, [document(4)])
+                compress.dictionaries.clear()
+                fresh = index.KeyIndex(reopened[2])
+                fresh.catch_up()
+                self.assertEqual(fresh.get(key.NumberKey(5)).sequence, [document(5)])
+                # the start of a source is read again only if the registry lost it.
+                ident = compress.dictionary_id(dictionary)
+                self.assertEqual(compress.source_dictionaries[reopened[2]], ident)
+                self.assertEqual(compress.source_dictionary(reopened[2]), ident)
+            finally:
+                for reopened_source in reopened:
+                    reopened_source.close()
@@ -31,6 +31,18 @@ class TestByteSource(unittest.TestCase):
         (one_byte, eof) = s.get_bytes(0, 1, strict=True)
         self.assertEqual(one_byte, b"1")
         self.assertTrue(eof)
+        if isinstance(s, data_source.BytesSource):
+            self.assertEqual(s.byte_data, b"1")
+
+    def test_append_keeps_views(self):
+        s = self.get_source(b"ab", writeable=True)
+        (first, at_eof) = s.get_bytes(0, 2)
+        for i in range(100):
+            self.assertEqual(s.append(b"%03d" % i), 2 + 3 * i)
+        self.assertEqual(first, b"ab")
+        self.assertEqual(s.length(), 302)
+        self.assertEqual(s.get_bytes(299, 3), (b"099", True))
+        self.assertEqual(s.get_bytes(2, 6, strict=False), (b"000001", False))
 
     def test_space(self):
         space = self.get_source(b" ")
@@ -95,6 +107,15 @@ class TestByteSource(unittest.TestCase):
         some_bytes = space.get_bytes_to_ws_or_eof(422)
         self.assertEqual(some_bytes, b"x")
 
+    def test_end_seek(self):
+        text = (b"a" * 300) + b" " + (b"b" * 300) + b" ccc"
+        space = self.get_source(text)
+        (some_bytes, start_seek) = space.get_bytes_from_ws_to_eof(initial_length=2)
+        self.assertEqual((bytes(some_bytes), start_seek), (b"ccc", 602))
+        (some_bytes, start_seek) = space.get_bytes_from_ws_to_eof(initial_length=2, end_seek=601)
+        self.assertEqual((bytes(some_bytes), start_seek), (b"b" * 300, 301))
+        self.assertIsNone(space.get_bytes_from_ws_to_eof(initial_length=2, end_seek=300))
+
     def test_max_offset(self):
         text = b"x" * 10000
         space = self.get_source(text)
@@ -0,0 +1,105 @@
+# This Python file uses the following encoding: utf-8
+
+import random
+import unittest
+from .. import fast_parse
+from .. import key
+from .. import pellet
+from .. import value
+
+
+def random_key(rng, depth=0):
+    choice = rng.randint(0, 4 if depth < 3 else 2)
+    if choice == 0:
+        return key.NumberKey(rng.choice([0, 7, -12, 2**40, -2**62, 10**19]))
+    if choice == 1:
+        return key.NumberKey(rng.choice([0.5, -1.25e-7, 1e300, -1.2345678901234567e-300, float("inf")]))
+    if choice == 2:
+        return key.StringKey(u"".join(rng.choice([u"a", u" ", u"\n", u"Ä", u"漢", u"\x00"])
+                                      for i in range(rng.randint(0, 5))))
+    return key.CompositeKey(random_key(rng, depth + 1), random_key(rng, depth + 1))
+
+
+def random_values(rng):
+    choice = rng.randint(0, 5)
+    if choice == 0:
+        return value.Deleted()
+    if choice == 1:
+        return value.Reference(b"ref \n" * rng.randint(0, 3))
+    return value.Values([bytes(bytearray(rng.randint(0, 255) for i in range(rng.randint(0, 12))))
+                         for j in range(rng.randint(1, 4))])
+
+
+def random_pellet(rng):
+    p = pellet.Pellet(random_key(rng), random_values(rng))
+    p.set_offsets(None, [(rng.randint(1, 10**9), 1 << i) for i in range(rng.randint(0, 4))])
+    return p
+
+
+def summary(parsed):
+    (p, end) = parsed
+    values = p.values
+    if isinstance(values, (value.Values, value.LazyValues)):
+        values = [bytes(v) for v in values.sequence]
+    elif isinstance(values, value.Reference):
+        values = ("R", bytes(values.reference_bytes))
+    else:
+        values = "D"
+    return (type(p.key), p.key.value(), p.key.to_bytes(), values,
+            p.payload_length, p.skips_offsets_and_counts, end)
+
+
+class TestDifferential(unittest.TestCase):
+
+    def test_random_pellets(self):
+        rng = random.Random(7)
+        for i in range(500):
+            encoded = random_pellet(rng).to_bytes()
+            for padded in (encoded, b"xx " + encoded + b" yy"):
+                start = padded.index(encoded)
+                reference = pellet.pellet_from_bytes(padded, start)
+                fast = fast_parse.pellet_from_bytes(padded, start)
+                self.assertEqual(summary(fast), summary(reference), encoded)
+                self.assertEqual(fast[0].to_bytes(), encoded)
+                self.assertEqual(
+                    summary(fast_parse.pellet_from_bytes(padded, start, with_offsets=False)),
+                    summary(pellet.pellet_from_bytes(padded, start, with_offsets=False)))
+
+    def test_lazy_values(self):
+        rng = random.Random(11)
+        for i in range(300):
+            encoded = random_pellet(rng).to_bytes()
+            padded = b"xx " + encoded + b" yy"
+            eager = summary(pellet.pellet_from_bytes(padded, 3))
+            for parse in (pellet.pellet_from_bytes, fast_parse.pellet_from_bytes):
+                lazy = parse(padded, 3, lazy=True)
+                self.assertEqual(summary(lazy), eager)
+                self.assertEqual(lazy[0].to_bytes(), encoded)
+
+    def test_keys_and_offsets(self):
+        cases = [b"N12", b"N-3 ", b"N5.7 90", b"N1e+300\n", b"S0\n", b"S1 a", b"C S1 a N5.7 xxx",
+                 b"C\nC\nN1\nN2\nS2\nab"]
+        for encoded in cases:
+            self.assertEqual(fast_parse.key_from_bytes(encoded), key.key_from_bytes(encoded))
+        for encoded in [b"O321", b"O3991 more", b"O321-221:2-341:3", b"O1-2:3\n"]:
+            self.assertEqual(fast_parse.offsets_from_bytes(encoded), pellet.offsets_from_bytes(encoded))
+
+    def test_same_failures(self):
+        bad = [b"", b"N", b"Y3 xxx", b"S-4 xxx", b"S9 abc", b"S3 abcX", b"CxS1 a N1",
+               b"N1 V2 abc", b"N1 X", b"N1 V1 aXO3", b"N1 V1 a Q3", b"N1 V1 a O12-3", b"N1 V1 a O" + b"1" * 5000,
+               b"N1 D", b"N1 Dx O3", b"N1  V1 a O5", b"N1 V1 a O1-2:3-", b"S\xff\xfe", b"S2 \xff\xfe O3"]
+        for encoded in bad:
+            with self.assertRaises((ValueError, AssertionError)):
+                pellet.pellet_from_bytes(encoded)
+            with self.assertRaises(ValueError):
+                fast_parse.pellet_from_bytes(encoded)
+
+    def test_white_token(self):
+        for (data, start, max_length) in [(b"012 45 789", 0, 20), (b"012 45 789", 7, 20),
+                                          (b" 1", 0, 20), (b"x" * 30, 0, 20), (b"12", 2, 20), (b"123\n", 0, 3)]:
+            (segment, end) = key.white_delimited(data, start, max_length)
+            if segment is None:
+                with self.assertRaises(key.FormatError):
+                    fast_parse.token(data, start, max_length)
+            else:
+                self.assertEqual(fast_parse.token(data, start, max_length), (segment.encode("utf8"), end))
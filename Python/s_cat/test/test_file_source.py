@@ -1,7 +1,13 @@
 
 from . import test_data_source
 from .. import file_source
+from .. import data_source
+from .. import key
+from .. import pellet
 import tempfile
+import time
+import unittest
+import threading
 
 class TestFileSource(test_data_source.TestByteSource):
 
@@ -24,3 +30,219 @@ class TestFileSource(test_data_source.TestByteSource):
         xxx.close()
         with self.assertRaises(IOError):
             xxx.get_bytes(1, 1)
+
+
+class TestPositionalFileSource(TestFileSource):
+
+    def get_source(self, byte_data, writeable=False):
+        f = self.file
+        f.write(byte_data)
+        return file_source.FileSource(f, writeable=writeable, positional=True)
+
+    def test_refresh_length(self):
+        s = self.get_source(b"abc", writeable=True)
+        self.assertEqual(s.append(b" def"), 3)
+        self.assertEqual(s.length(), 7)
+        # another writer extends the file.
+        with open(self.file.name, "ab") as other:
+            other.write(b" ghi")
+        self.assertEqual(s.length(), 7)
+        self.assertEqual(s.get_bytes_from_ws_to_eof(), (b"def", 4))
+        self.assertEqual(s.refresh_length(), 11)
+        self.assertEqual(s.get_bytes(4, 7), (b"def ghi", True))
+
+    def test_threads(self):
+        chunks = [(b"%05d " % i) for i in range(200)]
+        s = self.get_source(b"".join(chunks))
+        failures = []
+        def reader(offset):
+            for i in range(offset, 200, 7):
+                token = s.get_bytes_to_ws_or_eof(i * 6)
+                if token != chunks[i][:-1]:
+                    failures.append((i, token))
+        threads = [threading.Thread(target=reader, args=(n,)) for n in range(7)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(failures, [])
+
+
+class TestBufferedFileSource(unittest.TestCase):
+
+    def setUp(self):
+        self.file = tempfile.NamedTemporaryFile()
+
+    def tearDown(self):
+        f = self.file
+        if f and not f.closed:
+            f.close()
+
+    def file_bytes(self):
+        with open(self.file.name, "rb") as f:
+            return f.read()
+
+    def test_explicit(self, positional=False):
+        self.file.write(b"N0")
+        s = file_source.BufferedFileSource(self.file, positional=positional)
+        self.assertEqual(s.append(b" N1"), 2)
+        self.assertEqual(s.append(b" N22"), 5)
+        self.assertEqual(s.length(), 9)
+        self.assertEqual(self.file_bytes(), b"N0")
+        self.assertEqual(s.flushed_length, 2)
+        # reading pending bytes flushes them.
+        self.assertEqual(s.get_bytes_from_ws_to_eof(), (b"N22", 6))
+        self.assertEqual(self.file_bytes(), b"N0 N1 N22")
+        self.assertEqual(s.append(b" N3"), 9)
+        s.sync()
+        self.assertEqual(self.file_bytes(), b"N0 N1 N22 N3")
+        self.assertEqual(s.synced_length, 12)
+        s.append(b" N4")
+        s.close()
+        self.file = None
+        self.assertIsNone(s.open_file)
+
+    def test_positional(self):
+        self.test_explicit(positional=True)
+
+    def test_policies(self):
+        s = file_source.BufferedFileSource(
+            self.file,
+            flush_policy=file_source.every_bytes(10),
+            fsync_policy=file_source.every_milliseconds(60000))
+        s.append(b"12345")
+        self.assertEqual(s.flushed_length, 0)
+        s.append(b"67890")
+        self.assertEqual(s.flushed_length, 10)
+        self.assertEqual(s.synced_length, 0)
+        s.sync_time -= 61
+        s.append(b"x")
+        self.assertEqual(s.synced_length, 11)
+        self.assertEqual(self.file_bytes(), b"1234567890x")
+        each = file_source.BufferedFileSource(self.file, flush_policy=file_source.EACH_APPEND)
+        self.assertEqual(each.append(b"y"), 11)
+        self.assertEqual(each.flushed_length, 12)
+        timed = file_source.BufferedFileSource(self.file, flush_policy=file_source.every_milliseconds(10))
+        timed.append(b"z")
+        self.assertEqual(timed.flushed_length, 12)
+        timed.flush_time -= 1
+        timed.append(b"z")
+        self.assertEqual(timed.flushed_length, 14)
+        self.assertFalse(file_source.EXPLICIT.due(100, 1e9))
+
+    def wait_for(self, condition, seconds=5.0):
+        deadline = time.time() + seconds
+        while not condition() and time.time() < deadline:
+            time.sleep(0.005)
+        return condition()
+
+    def test_idle_commits(self):
+        s = file_source.BufferedFileSource(
+            self.file,
+            flush_policy=file_source.every_milliseconds(20),
+            fsync_policy=file_source.every_milliseconds(50))
+        s.append(b"abc")
+        self.assertEqual(s.flushed_length, 0)
+        # no further appends: the timer commits the outstanding bytes.
+        self.assertTrue(self.wait_for(lambda: s.flushed_length == 3))
+        self.assertEqual(self.file_bytes(), b"abc")
+        self.assertTrue(self.wait_for(lambda: s.synced_length == 3))
+        s.append(b"de")
+        self.assertTrue(self.wait_for(lambda: s.synced_length == 5))
+        self.assertIsNone(s.timer)
+        # untimed policies start no timer; close cancels a pending one.
+        explicit = file_source.BufferedFileSource(self.file)
+        explicit.append(b"f")
+        self.assertIsNone(explicit.timer)
+        timed = file_source.BufferedFileSource(self.file, flush_policy=file_source.every_milliseconds(60000))
+        timed.append(b"g")
+        self.assertIsNotNone(timed.timer)
+        timed.flush()
+        self.assertEqual(self.file_bytes(), b"abcdeg")
+        timed.close()
+        self.assertIsNone(timed.timer)
+        self.file = None
+
+
+class TestMmapSource(test_data_source.TestByteSource):
+
+    def get_source(self, byte_data, writeable=False):
+        f = self.file
+        f.write(byte_data)
+        f.flush()
+        return file_source.MmapSource(f)
+
+    def setUp(self):
+        self.file = tempfile.NamedTemporaryFile()
+
+    def tearDown(self):
+        f = self.file
+        if f and not f.closed:
+            f.close()
+
+    def test_append(self):
+        s = self.get_source(b"")
+        with self.assertRaises(data_source.ReadOnlyError):
+            s.append(b"1")
+
+    def test_append_keeps_views(self):
+        self.test_append()
+
+    def test_refresh(self):
+        s = self.get_source(b"")
+        self.assertEqual(s.length(), 0)
+        self.file.write(b"S3 abc N1")
+        s.refresh()
+        self.assertEqual(s.length(), 9)
+        (some_bytes, at_eof) = s.get_bytes(3, 3)
+        self.assertIsInstance(some_bytes, memoryview)
+        self.assertEqual(some_bytes, b"abc")
+        self.assertFalse(at_eof)
+        some_bytes.release()
+        (k, end) = key.key_from_data_source_seek(s, 0)
+        self.assertEqual(k.value(), u"abc")
+        self.assertEqual(end, 7)
+
+    def test_refresh_with_live_slice(self):
+        s = self.get_source(b"N1\nV3\nabc\nO8")
+        (held, at_eof) = s.get_bytes(6, 3)
+        self.file.write(b"\nN2\nD\nO4")
+        self.file.flush()
+        s.refresh()
+        self.assertEqual(s.length(), 20)
+        # the slice of the old map is still readable.
+        self.assertEqual(held, b"abc")
+        (more, at_eof) = s.get_bytes(13, 7)
+        self.assertEqual(more, b"N2\nD\nO4")
+        s.close()
+        self.assertEqual(bytes(held), b"abc")
+
+    def test_zero_copy_parse(self):
+        encoded = b"C\nS3\nabc\nN4\nV2\nxy\nV1\nz\nO22-5:1"
+        s = self.get_source(b"XX " + encoded)
+        (chunk, at_eof) = s.get_bytes(3, len(encoded))
+        (p, end) = pellet.pellet_from_bytes(chunk)
+        self.assertEqual(end, len(encoded))
+        self.assertEqual(p.key.value(), (u"abc", 4))
+        [v1, v2] = p.values.sequence
+        self.assertIsInstance(v1, memoryview)
+        self.assertEqual(v1, b"xy")
+        self.assertEqual(v2, b"z")
+        self.assertEqual(p.to_bytes(), encoded)
+        (tail, tail_seek) = s.get_bytes_from_ws_to_eof()
+        self.assertEqual(tail, b"O22-5:1")
+        self.assertEqual(tail_seek, 3 + encoded.index(b"O"))
+        tail.release()
+        v1.release()
+        v2.release()
+        chunk.release()
+        s.close()
+        self.assertIsNone(s.open_file)
+        self.file = None
+
+    def test_close(self):
+        xxx = self.get_source(b"")
+        xxx.close()
+        self.file = None
+        with self.assertRaises(IOError):
+            xxx.get_bytes(1, 1)
@@ -0,0 +1,97 @@
+import unittest
+from .. import data_source
+from .. import footer
+from .. import index
+from .. import key
+from .. import pellet
+from .. import store
+from .. import value
+from .test_index import ReadCountingSource
+
+
+def write_numbers(source, numbers, key_index=None):
+    w = store.SCatWriter(source, index=key_index)
+    for i in numbers:
+        w.add(key.NumberKey(i), value.Values([str(i).encode("ascii")]))
+    return w
+
+
+class TestFooter(unittest.TestCase):
+
+    def test_round_trip(self):
+        f = footer.Footer(12345, 678, 90)
+        encoded = f.to_bytes()
+        self.assertEqual(len(encoded), footer.FOOTER_SIZE)
+        self.assertEqual(encoded.split(), [encoded])
+        decoded = footer.Footer.from_bytes(encoded)
+        self.assertEqual((decoded.last_seek, decoded.index_seek, decoded.index_length), (12345, 678, 90))
+        self.assertIsNone(footer.Footer.from_bytes(encoded[:-1]))
+        self.assertIsNone(footer.Footer.from_bytes(b">Fxyz" + encoded[5:]))
+        self.assertIsNone(footer.Footer.from_bytes(b"O" * footer.FOOTER_SIZE))
+
+    def test_tail_from_footer(self):
+        s = ReadCountingSource(b"", writeable=True)
+        w = write_numbers(s, range(100))
+        last_seek = w.level_seeks[0]
+        self.assertIsNone(footer.read_footer(s))
+        w.write_footer()
+        found = footer.read_footer(s)
+        self.assertEqual(found.last_seek, last_seek)
+        self.assertEqual(found.index_length, 0)
+        r = store.SCatReader(s)
+        s.requested = []
+        (seek, result) = r.tail()
+        self.assertEqual(seek, last_seek)
+        self.assertEqual(result.key, key.NumberKey(99))
+        # the footer read, then the pellet: no search for white space.
+        self.assertEqual(s.requested[0], footer.FOOTER_SIZE + 1)
+        self.assertEqual(r.get(key.NumberKey(42)).sequence, [b"42"])
+        self.assertEqual([k for (k, v) in r.scan()], [key.NumberKey(i) for i in range(100)])
+
+    def test_append_after_footer(self):
+        s = data_source.BytesSource(b"", writeable=True)
+        write_numbers(s, range(10)).write_footer()
+        # a new writer recovers through the footer and appends past it.
+        write_numbers(s, range(10, 20))
+        self.assertIsNone(footer.read_footer(s))
+        r = store.SCatReader(s)
+        self.assertEqual(r.tail()[1].key, key.NumberKey(19))
+        for i in range(20):
+            self.assertEqual(r.get(key.NumberKey(i)).sequence, [str(i).encode("ascii")])
+        keys = [result.key for (seek, result) in pellet.iter_pellets(s)]
+        self.assertEqual(keys, [key.NumberKey(i) for i in range(20)])
+
+    def test_trailing_amends_skipped(self):
+        s = data_source.BytesSource(b"", writeable=True)
+        write_numbers(s, range(5))
+        s.append(b"\n>partial\n>amends")
+        r = store.SCatReader(s)
+        self.assertEqual(r.tail()[1].key, key.NumberKey(4))
+        self.assertEqual(r.get(key.NumberKey(2)).sequence, [b"2"])
+        write_numbers(s, range(5, 7))
+        self.assertEqual(r.get(key.NumberKey(6)).sequence, [b"6"])
+        self.assertIsNone(footer.last_token(data_source.BytesSource(b">only")))
+
+    def test_index_block(self):
+        s = ReadCountingSource(b"", writeable=True)
+        i = index.KeyIndex(s)
+        w = write_numbers(s, range(0, 200, 2), i)
+        w.write_footer(i)
+        found = footer.read_footer(s)
+        self.assertGreater(found.index_length, 0)
+        s.requested = []
+        loaded = footer.open_index(s)
+        # footer, index block and a catch up read finding nothing new.
+        self.assertLessEqual(len(s.requested), 3)
+        self.assertEqual(len(loaded), 100)
+        self.assertEqual(loaded.get(key.NumberKey(64)).sequence, [b"64"])
+        self.assertIsNone(loaded.get(key.NumberKey(65)))
+        # pellets appended after the footer are caught up.
+        write_numbers(s, [300])
+        loaded = footer.open_index(s)
+        self.assertEqual(loaded.get(key.NumberKey(300)).sequence, [b"300"])
+        self.assertEqual(len(footer.open_index(data_source.BytesSource(b"", writeable=True))), 0)
+
+    def test_empty_writer(self):
+        w = store.SCatWriter(data_source.BytesSource(b"", writeable=True))
+        self.assertRaises(ValueError, w.write_footer)
@@ -0,0 +1,203 @@
+import os
+import shutil
+import tempfile
+import unittest
+from .. import data_source
+from .. import file_source
+from .. import index
+from .. import key
+from .. import value
+from .. import pellet
+from .test_store import report_items, expected_scan, scanned
+import random
+
+
+def add_pellet(source, pkey, pvalues):
+    separator = b"\n" if source.length() else b""
+    seek = source.append(separator + pellet.Pellet(pkey, pvalues).to_bytes())
+    return seek + len(separator)
+
+
+class ReadCountingSource(data_source.BytesSource):
+
+    requested = None
+
+    def get_bytes(self, start_seek, length, strict=True):
+        if self.requested is not None:
+            self.requested.append(length)
+        return data_source.BytesSource.get_bytes(self, start_seek, length, strict)
+
+
+class TestKeyIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "data.scat.idx")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_unsorted_last_wins(self):
+        s = data_source.BytesSource(b"", writeable=True)
+        add_pellet(s, key.StringKey(u"b"), value.Values([b"1"]))
+        add_pellet(s, key.NumberKey(7), value.Values([b"2", b"22"]))
+        seek = add_pellet(s, key.StringKey(u"b"), value.Values([b"3"]))
+        add_pellet(s, key.NumberKey(7), value.Deleted())
+        add_pellet(s, key.NumberKey(8), value.Reference(b"elsewhere"))
+        i = index.KeyIndex(s)
+        self.assertEqual(i.catch_up(), 5)
+        self.assertEqual(len(i), 3)
+        self.assertEqual(i.find(key.StringKey(u"b"))[0], seek)
+        self.assertEqual(i.get(key.StringKey(u"b")).sequence, [b"3"])
+        self.assertIsNone(i.get(key.NumberKey(7)))
+        self.assertIsNotNone(i.find(key.NumberKey(7)))
+        self.assertEqual(i.get(key.NumberKey(8)).reference_bytes, b"elsewhere")
+        self.assertIsNone(i.get(key.StringKey(u"zz")))
+        self.assertEqual(i.catch_up(), 0)
+
+    def test_one_read_lookup(self):
+        s = ReadCountingSource(b"", writeable=True)
+        c = key.CompositeKey(key.StringKey(u"t"), key.NumberKey(2))
+        add_pellet(s, c, value.Values([b"x" * 1000]))
+        i = index.KeyIndex(s)
+        i.catch_up()
+        s.requested = []
+        self.assertEqual(i.get(c).sequence, [b"x" * 1000])
+        (seek, payload_length) = i.find(c)
+        self.assertEqual(s.requested, [payload_length])
+        lazy = i.get(c, lazy=True)
+        self.assertIsInstance(lazy, value.LazyValues)
+        self.assertEqual(lazy.sequence, [b"x" * 1000])
+
+    def test_scan(self):
+        items = report_items()
+        # unsorted data: key order comes from the index.
+        random.Random(3).shuffle(items)
+        s = data_source.BytesSource(b"", writeable=True)
+        for (k, v) in items:
+            add_pellet(s, k, v)
+        i = index.KeyIndex(s)
+        i.catch_up()
+        S = key.StringKey
+        C = key.CompositeKey
+        lowest = key.NumberKey(-float("inf"))
+        prefix = C(S(u"a"), S(u"d3"))
+        tests = [
+            (i.scan(), lambda k: True),
+            (i.scan(C(S(u"b"), lowest), C(S(u"c"), lowest)), lambda k: k.key1 == S(u"b")),
+            (i.prefix_scan(prefix), lambda k: k.key1 == S(u"a") and
+                isinstance(k.key2, key.CompositeKey) and k.key2.key1 == S(u"d3")),
+        ]
+        for (found, accept) in tests:
+            self.assertEqual(scanned(found), expected_scan(items, accept))
+        # keys added later are seen.
+        add_pellet(s, C(S(u"a"), C(S(u"d3"), S(u"new"))), value.Values([b"n"]))
+        i.catch_up()
+        self.assertEqual(scanned(i.prefix_scan(prefix))[-1][1], [b"n"])
+
+    def test_get_many(self):
+        s = ReadCountingSource(b"", writeable=True)
+        for n in range(300):
+            add_pellet(s, key.NumberKey(n), value.Values([b"v%d" % n, b"w" * (n % 7)]))
+        add_pellet(s, key.NumberKey(5), value.Deleted())
+        add_pellet(s, key.NumberKey(6), value.Reference(b"ref"))
+        i = index.KeyIndex(s)
+        i.catch_up()
+        wanted = [key.NumberKey(n) for n in (250, 3, 5, 6, 999, 3, 120, 121, -1)]
+        s.requested = []
+        (results, missing) = i.get_many(wanted)
+        self.assertEqual(len(s.requested), 1)
+        self.assertEqual([k.value() for k in missing], [5, 999, -1])
+        for (k, result) in zip(wanted, results):
+            self.assertEqual(getattr(i.get(k), "sequence", None), getattr(result, "sequence", None))
+        self.assertEqual(results[3].reference_bytes, b"ref")
+        self.assertEqual(results[0].sequence, [b"v250", b"w" * (250 % 7)])
+        # no coalescing: one read per distinct pellet.
+        s.requested = []
+        (results2, missing2) = i.get_many(wanted, gap=0)
+        self.assertEqual(len(s.requested), 6)
+        lazy = i.get_many(wanted, lazy=True, max_read=100)[0]
+        self.assertEqual([bytes(v) for v in lazy[6]], results[6].sequence)
+        self.assertEqual(i.get_many([]), ([], []))
+
+    def test_coalesce(self):
+        extents = [(0, 10), (12, 20), (100, 110), (111, 400), (400, 401)]
+        self.assertEqual(list(index.coalesce(extents, gap=5, max_read=1000)),
+                         [[(0, 10), (12, 20)], [(100, 110), (111, 400), (400, 401)]])
+        self.assertEqual(list(index.coalesce(extents, gap=5, max_read=100)),
+                         [[(0, 10), (12, 20)], [(100, 110)], [(111, 400)], [(400, 401)]])
+        self.assertEqual(list(index.coalesce([], gap=5)), [])
+
+    def test_sidecar(self):
+        s = data_source.BytesSource(b"", writeable=True)
+        for n in range(50):
+            add_pellet(s, key.NumberKey(n % 20), value.Values([str(n).encode("ascii")]))
+        i = index.KeyIndex.open(s, self.path)
+        self.assertTrue(os.path.exists(self.path))
+        self.assertEqual(i.covered_length, s.length())
+        self.assertEqual(len(i), 20)
+        # reopen: nothing to catch up.
+        i2 = index.KeyIndex.open(s, self.path)
+        self.assertEqual(i2.catch_up(), 0)
+        self.assertEqual(len(i2.table), 20)
+        self.assertEqual(sorted(i2.items()), sorted(i.items()))
+        # extend the data and reopen: only new pellets are indexed.
+        add_pellet(s, key.NumberKey(3), value.Values([b"new"]))
+        add_pellet(s, key.NumberKey(100), value.Values([b"hundred"]))
+        i3 = index.KeyIndex.load(s, self.path)
+        self.assertEqual(i3.catch_up(), 2)
+        self.assertEqual(len(i3), 21)
+        self.assertEqual(i3.get(key.NumberKey(3)).sequence, [b"new"])
+        self.assertEqual(i3.get(key.NumberKey(4)).sequence, [b"44"])
+        i3.save(self.path)
+        i4 = index.KeyIndex.load(s, self.path)
+        self.assertEqual(i4.get(key.NumberKey(100)).sequence, [b"hundred"])
+        self.assertIsNone(i4.find(key.NumberKey(101)))
+
+    def test_save_sidecar(self):
+        s = data_source.BytesSource(b"N1\nV1\nA\nO7", writeable=True)
+        # the temporary file of another save in progress is left alone.
+        with open(self.path + ".tmp", "wb") as f:
+            f.write(b"another save")
+        index.KeyIndex.open(s, self.path)
+        with open(self.path + ".tmp", "rb") as f:
+            self.assertEqual(f.read(), b"another save")
+        umask = os.umask(0)
+        os.umask(umask)
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o666 & ~umask)
+        # a failed save leaves the previous sidecar and no temporary file.
+        self.assertRaises(TypeError, index.save_sidecar, self.path, None)
+        self.assertEqual(sorted(os.listdir(self.directory)), ["data.scat.idx", "data.scat.idx.tmp"])
+        self.assertEqual(index.KeyIndex.load(s, self.path).get(key.NumberKey(1)).sequence, [b"A"])
+
+    def test_bad_sidecar(self):
+        s = data_source.BytesSource(b"N1\nV1\nA\nO7", writeable=True)
+        with open(self.path, "wb") as f:
+            f.write(b"garbage")
+        i = index.KeyIndex.open(s, self.path)
+        self.assertEqual(i.get(key.NumberKey(1)).sequence, [b"A"])
+        with self.assertRaises(index.SidecarError):
+            index.KeyIndex.from_bytes(s, index.SIDECAR_MAGIC)
+        with self.assertRaises(index.SidecarError):
+            index.KeyIndex.from_bytes(s, index.KeyIndex(s).to_bytes()[:-8])
+        # sidecar for longer data is ignored.
+        long_source = data_source.BytesSource(b"N1\nV1\nA\nO7\nN2\nV1\nB\nO7", writeable=True)
+        index.KeyIndex.open(long_source, self.path)
+        i = index.KeyIndex.open(s, self.path)
+        self.assertIsNone(i.find(key.NumberKey(2)))
+        # as is one for other data of the same length.
+        other = data_source.BytesSource(b"N1\nV1\nZ\nO7", writeable=True)
+        self.assertEqual(index.KeyIndex.open(other, self.path).get(key.NumberKey(1)).sequence, [b"Z"])
+        self.assertRaises(index.SidecarError, index.KeyIndex.load, s, self.path)
+        self.assertEqual(index.KeyIndex.open(s, self.path).get(key.NumberKey(1)).sequence, [b"A"])
+        self.assertFalse(os.path.exists(self.path + ".tmp"))
+
+    def test_file_and_amends(self):
+        path = os.path.join(self.directory, "data.scat")
+        with open(path, "wb") as f:
+            f.write(b"N1\nV1\nA\nO7\n>amended\nN2\nV1\nB\nO7")
+        with open(path, "rb") as f:
+            s = file_source.FileSource(f)
+            i = index.KeyIndex.open(s, self.path)
+            self.assertEqual(i.get(key.NumberKey(2)).sequence, [b"B"])
+            self.assertEqual(i.get(key.NumberKey(1)).sequence, [b"A"])
@@ -1,5 +1,7 @@
 # This Python file uses the following encoding: utf-8
 
+import bisect
+import random
 import unittest
 from .. import key
 from .. import data_source
@@ -286,3 +288,87 @@ class TestFromBytesSpec(unittest.TestCase):
         with self.assertRaises(key.FormatError):
             dummy = key.key_from_bytes("Y3 xxx")
 
+
+
+def legacy_less_than(k1, k2):
+    "The ordering defined by class_order and less_than."
+    class_test = key.class_cmp(type(k1), type(k2))
+    if class_test:
+        return class_test < 0
+    if isinstance(k1, key.CompositeKey):
+        if legacy_less_than(k1.key1, k2.key1):
+            return True
+        if legacy_less_than(k2.key1, k1.key1):
+            return False
+        return legacy_less_than(k1.key2, k2.key2)
+    return k1.less_than(k2)
+
+
+def extends(k, prefix):
+    "k is a proper extension of the cons list prefix."
+    if isinstance(prefix, key.CompositeKey):
+        return isinstance(k, key.CompositeKey) and k.key1 == prefix.key1 and extends(k.key2, prefix.key2)
+    return isinstance(k, key.CompositeKey) and k.key1 == prefix
+
+
+class TestSortKey(unittest.TestCase):
+
+    def random_key(self, rng, depth=0):
+        choice = rng.randint(0, 5 if depth < 3 else 3)
+        if choice == 0:
+            return key.NumberKey(rng.randint(-10, 10))
+        if choice == 1:
+            return key.NumberKey(rng.choice([-1.5, -0.0, 0.5, 2.0, 1e300, -1e-300, 2**53 + 1, 2**60, -2**70 - 3, 10**400 // 10**100]))
+        if choice in (2, 3):
+            return key.StringKey(u"".join(rng.choice([u"a", u"b", u"\x00", u"\xc4", u"漢", u"\U0001f600"])
+                                          for i in range(rng.randint(0, 3))))
+        return key.CompositeKey(self.random_key(rng, depth + 1), self.random_key(rng, depth + 1))
+
+    def test_matches_legacy_order(self):
+        rng = random.Random(42)
+        keys = [self.random_key(rng) for i in range(300)]
+        for k1 in keys:
+            for k2 in keys[:60]:
+                self.assertEqual(k1 < k2, legacy_less_than(k1, k2), (k1, k2))
+                self.assertEqual(k1.sort_key() == k2.sort_key(), k1 == k2, (k1, k2))
+
+    def test_prefix_ranges(self):
+        rng = random.Random(5)
+        keys = [self.random_key(rng) for i in range(400)]
+        t = key.StringKey(u"t")
+        d = key.NumberKey(3)
+        keys.append(key.CompositeKey(t, d))
+        keys.extend(key.CompositeKey(t, key.CompositeKey(d, k)) for k in keys[:20])
+        keys.extend(key.CompositeKey(t, k) for k in keys[:20])
+        for prefix in [key.CompositeKey(t, d), t, key.CompositeKey(t, key.CompositeKey(d, key.StringKey(u"a")))]:
+            [exact, extended] = key.prefix_sort_key_ranges(prefix)
+            for k in keys:
+                sort_key = k.sort_key()
+                in_exact = exact[0] <= sort_key < exact[1]
+                in_extended = extended[0] <= sort_key < extended[1]
+                self.assertEqual(in_exact, k == prefix)
+                self.assertEqual(in_extended, extends(k, prefix), (k, prefix))
+        self.assertEqual(key.sort_key_successor(b"ab\xff\xff"), b"ac")
+        self.assertIsNone(key.sort_key_successor(b"\xff"))
+
+    def test_numbers(self):
+        numbers = [-float("inf"), -2**1030, -1e300, -2**64 - 1, -2**64, -1.5, -1, -1e-300, 0,
+                   1e-300, 1, 1 + 1e-10, 2**53, 2**53 + 1, 2**53 + 2, 1e300, 2**1030, float("inf")]
+        sort_keys = [key.NumberKey(n).sort_key() for n in numbers]
+        self.assertEqual(sort_keys, sorted(sort_keys))
+        self.assertEqual(len(set(sort_keys)), len(numbers))
+        self.assertEqual(key.NumberKey(-0.0).sort_key(), key.NumberKey(0).sort_key())
+        self.assertEqual(key.NumberKey(3).sort_key(), key.NumberKey(3.0).sort_key())
+        huge = [key.NumberKey(n).sort_key() for n in (-2**3000, -2**2000, 2**2000, 2**3000)]
+        self.assertEqual(huge, sorted(huge))
+        # between the largest finite numbers and the infinities.
+        self.assertTrue(sort_keys[0] < huge[0] and huge[1] < sort_keys[1])
+        self.assertTrue(sort_keys[-2] < huge[2] and huge[3] < sort_keys[-1])
+
+    def test_cached_and_bisect(self):
+        keys = [key.StringKey(u"k%03d" % i) for i in range(0, 100, 2)]
+        sort_keys = [k.sort_key() for k in keys]
+        self.assertIs(keys[0].sort_key(), sort_keys[0])
+        probe = key.StringKey(u"k051").sort_key()
+        self.assertEqual(bisect.bisect_left(sort_keys, probe), 26)
+        self.assertEqual(sorted(reversed(keys), key=key.Key.sort_key), keys)
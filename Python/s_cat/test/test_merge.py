@@ -0,0 +1,110 @@
+import contextlib
+import io
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from .. import bulk
+from .. import compress
+from .. import file_source
+from .. import key
+from .. import merge
+from .. import store
+from .. import value
+
+
+class TestMerge(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.paths = [os.path.join(self.directory, "segment%d.scat" % i) for i in range(3)]
+        self.output = os.path.join(self.directory, "merged.scat")
+        rng = random.Random(9)
+        self.latest = {}
+        for (number, path) in enumerate(self.paths):
+            pairs = []
+            for i in range(200):
+                k = key.CompositeKey(key.StringKey(u"t%d" % rng.randrange(3)), key.NumberKey(rng.randrange(60)))
+                if rng.randrange(5) == 0:
+                    v = value.Deleted()
+                else:
+                    v = value.Values([b"%d/%d" % (number, i)])
+                pairs.append((k, v))
+                self.latest[k.to_bytes()] = (k, v)
+            bulk.bulk_load_file(path, pairs)
+        self.sources = [file_source.FileSource(open(path, "rb"), positional=True) for path in self.paths]
+
+    def tearDown(self):
+        for source in self.sources:
+            source.close()
+        shutil.rmtree(self.directory)
+
+    def expected(self, accept=lambda k: True):
+        return [(k.to_bytes(), v.sequence) for (k, v) in
+                sorted(self.latest.values(), key=lambda kv: kv[0].sort_key())
+                if accept(k) and not isinstance(v, value.Deleted)]
+
+    def scanned(self, items):
+        return [(k.to_bytes(), [bytes(x) for x in v.sequence]) for (k, v) in items]
+
+    def test_merge(self):
+        stats = merge.merge(self.sources, self.output)
+        self.assertEqual(stats["pellets_read"], 600)
+        with open(self.output, "rb") as f:
+            r = store.SCatReader(file_source.FileSource(f, positional=True))
+            self.assertEqual(self.scanned(r.scan()), self.expected())
+        self.assertEqual(stats["pellets_written"], len(self.expected()))
+
+    def test_dictionary(self):
+        dictionary = b"".join(b"segment value %d " % i * 4 for i in range(10))
+        compressor = compress.Compressor(threshold=16, dictionary=dictionary)
+        paths = [os.path.join(self.directory, "packed%d.scat" % i) for i in range(2)]
+        for (number, path) in enumerate(paths):
+            bulk.bulk_load_file(path, [(key.NumberKey(n), [b"segment value %d " % (n + number) * 4])
+                                       for n in range(number, 40, 2)], compressor=compressor)
+        merge.merge_files(paths, self.output)
+        compress.dictionaries.clear()
+        with open(self.output, "rb") as f:
+            r = store.SCatReader(file_source.FileSource(f, positional=True))
+            self.assertEqual(r.get(key.NumberKey(5)).sequence, [b"segment value 6 " * 4])
+            self.assertEqual(r.get(key.NumberKey(6)).sequence, [b"segment value 6 " * 4])
+
+    def test_keep_deleted(self):
+        stats = merge.merge_files(self.paths[1:], self.output, keep_deleted=True)
+        with open(self.output, "rb") as f:
+            merged = file_source.FileSource(f, positional=True)
+            # the merged segment still shadows the oldest one.
+            view = merge.SegmentView([self.sources[0], merged])
+            self.assertEqual(self.scanned(view.scan()), self.expected())
+            deleted = [k for (k, v) in self.latest.values() if isinstance(v, value.Deleted)]
+            self.assertTrue(deleted)
+            for k in deleted:
+                self.assertIsInstance(view.find(k)[2].values, value.Deleted)
+
+    def test_segment_view(self):
+        view = merge.SegmentView(self.sources)
+        for (k, v) in self.latest.values():
+            found = view.get(k)
+            if isinstance(v, value.Deleted):
+                self.assertIsNone(found)
+            else:
+                self.assertEqual(found.sequence, v.sequence)
+                self.assertEqual(view.find(k)[2].values.sequence, v.sequence)
+        self.assertIsNone(view.get(key.NumberKey(1)))
+        self.assertIsNone(view.find(key.NumberKey(1)))
+        t1 = key.StringKey(u"t1")
+        self.assertEqual(self.scanned(view.prefix_scan(t1)), self.expected(lambda k: k.key1 == t1))
+        low = key.CompositeKey(key.StringKey(u"t0"), key.NumberKey(20))
+        high = key.CompositeKey(key.StringKey(u"t2"), key.NumberKey(5))
+        self.assertEqual(self.scanned(view.scan(low, high)),
+                         self.expected(lambda k: not (k < low) and k < high))
+        lazy = merge.SegmentView(self.sources, lazy=True)
+        self.assertIsInstance(next(lazy.scan())[1], value.LazyValues)
+
+    def test_main(self):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            stats = merge.main([self.output] + self.paths)
+        self.assertIn("pellets read", out.getvalue())
+        self.assertEqual(stats["pellets_written"], len(self.expected()))
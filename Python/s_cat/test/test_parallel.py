@@ -0,0 +1,107 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from .. import data_source
+from .. import file_source
+from .. import index
+from .. import key
+from .. import parallel
+from .. import pellet
+from .. import value
+
+
+def write_pellets(path, count, seed=1):
+    "Unsorted pellets with repeated keys, amends, and values imitating pellets."
+    rng = random.Random(seed)
+    decoy = pellet.Pellet(key.NumberKey(-5), value.Values([b"decoy"])).to_bytes()
+    chunks = []
+    for n in range(count):
+        k = key.CompositeKey(key.StringKey(u"k%d" % rng.randrange(count // 2)), key.NumberKey(n % 7))
+        choice = rng.randrange(10)
+        if choice == 0:
+            v = value.Deleted()
+        elif choice == 1:
+            # values containing white space and whole encoded pellets.
+            v = value.Values([b"\n" + decoy + b"\n", b" " * rng.randrange(5)])
+        else:
+            v = value.Values([b"x" * rng.randrange(300)])
+        chunks.append(pellet.Pellet(k, v).to_bytes())
+        if choice == 2:
+            chunks.append(b">amend")
+    with open(path, "wb") as f:
+        f.write(b"\n".join(chunks))
+
+
+class TestParallel(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "data.scat")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def sequential(self):
+        with open(self.path, "rb") as f:
+            i = index.KeyIndex(data_source.BytesSource(f.read()))
+        i.catch_up()
+        return sorted(i.items())
+
+    def test_resync(self):
+        write_pellets(self.path, 300)
+        with open(self.path, "rb") as f:
+            data = f.read()
+        source = data_source.BytesSource(data)
+        starts = [seek for (seek, p) in pellet.iter_pellets(source)]
+        for start in range(0, len(data), 97):
+            expected = min([s for s in starts if s >= start] or [len(data)])
+            found = parallel.resync(source, start, window=50)
+            if found != expected:
+                # only a decoy inside a value may fool resync.
+                self.assertTrue(data[found:].startswith(b"N-5"), (start, found, expected))
+        self.assertEqual(parallel.resync(source, len(data) - 1), len(data))
+
+    def test_build_index(self):
+        write_pellets(self.path, 2000)
+        expected = self.sequential()
+        for (processes, range_count) in [(1, 1), (1, 13), (3, 5)]:
+            with parallel.build_index(self.path, processes=processes, range_count=range_count, min_range=100) as i:
+                self.assertEqual(sorted(i.items()), expected)
+                self.assertEqual(i.covered_length, os.path.getsize(self.path))
+                self.assertEqual(i.catch_up(), 0)
+            self.assertIsNone(i.data_source.open_file)
+        # a source given by the caller stays open.
+        with open(self.path, "rb") as f:
+            source = file_source.FileSource(f, positional=True)
+            with parallel.build_index(self.path, source, processes=1) as i:
+                self.assertEqual(sorted(i.items()), expected)
+            self.assertIs(source.open_file, f)
+        # the file opened is closed on failure too.
+        opened = []
+        def failing(path, source, *arguments):
+            opened.append(source)
+            raise IOError("scan failed")
+        index_source = parallel.index_source
+        parallel.index_source = failing
+        try:
+            self.assertRaises(IOError, parallel.build_index, self.path, processes=1)
+        finally:
+            parallel.index_source = index_source
+        self.assertIsNone(opened[-1].open_file)
+
+    def test_fooled(self):
+        # a range starting inside a decoy value is rescanned from the chain.
+        decoy = pellet.Pellet(key.NumberKey(-5), value.Values([b"decoy"])).to_bytes()
+        big = pellet.Pellet(key.NumberKey(1), value.Values([b"y" * 60 + b"\n" + decoy + b"\n" + b"y" * 50])).to_bytes()
+        small = pellet.Pellet(key.NumberKey(2), value.Values([b"z"])).to_bytes()
+        with open(self.path, "wb") as f:
+            f.write(big + b"\n" + small)
+        fooled = parallel.resync(data_source.BytesSource(big), 30)
+        self.assertEqual(fooled, big.index(decoy))
+        for range_count in (2, 3, 4):
+            with parallel.build_index(self.path, processes=1, range_count=range_count, min_range=1) as i:
+                self.assertEqual(sorted(i.items()), self.sequential())
+                self.assertIsNone(i.find(key.NumberKey(-5)))
+        self.assertEqual(parallel.split(10, 3), [0, 3, 6, 10])
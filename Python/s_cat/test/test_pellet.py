@@ -4,6 +4,8 @@ import unittest
 from .. import pellet
 from .. import value
 from .. import key
+from .. import data_source
+from .. import fast_parse
 
 class TestPelletFromBytes(unittest.TestCase):
 
@@ -34,6 +36,10 @@ class TestPelletFromBytes(unittest.TestCase):
         self.assertEqual(from_bytes.values.sequence, values_bytes)
         self.assertEqual(from_bytes.key, k)
         self.assertEqual(from_bytes.skips_offsets_and_counts, offsets)
+        self.assertEqual(from_bytes.skip_levels(), 3)
+        self.assertEqual([from_bytes.skip(level) for level in range(3)], offsets)
+        self.assertEqual(from_bytes.skip(-1), (444, 4))
+        self.assertEqual(pellet.Pellet(k, v).skip_levels(), 0)
 
 class TestOffsets(unittest.TestCase):
 
@@ -68,3 +74,126 @@ class TestOffsets(unittest.TestCase):
         with self.assertRaises(key.FormatError): 
             encoded = b"O" * 10000
             (length, offsets, end) = pellet.offsets_from_bytes(encoded, 3)
+
+class TestIterPellets(unittest.TestCase):
+
+    def encoded_pellets(self, count):
+        result = []
+        for i in range(count):
+            k = key.CompositeKey(key.StringKey(u"k%d" % i), key.NumberKey(i))
+            p = pellet.Pellet(k, value.Values([b"v" * i, b"w"]))
+            p.set_offsets(None, [(i, 1)] if i else [])
+            result.append(p.to_bytes())
+        return result
+
+    def test_chunk_sizes(self):
+        encoded = self.encoded_pellets(30)
+        text = b"\n".join(encoded)
+        seeks = []
+        seek = 0
+        for e in encoded:
+            seeks.append(seek)
+            seek += len(e) + 1
+        source = data_source.BytesSource(text)
+        for chunk_size in (1, 7, 64, 1000, 1 << 20):
+            found = list(pellet.iter_pellets(source, chunk_size=chunk_size))
+            self.assertEqual([s for (s, p) in found], seeks)
+            self.assertEqual([p.to_bytes() for (s, p) in found], encoded)
+        found = list(pellet.iter_pellets(source, start=seeks[20], chunk_size=16))
+        self.assertEqual([s for (s, p) in found], seeks[20:])
+
+    def test_amends_and_errors(self):
+        [p1, p2] = self.encoded_pellets(2)
+        text = p1 + b"\n>amend1\n" + p2 + b"\n>amend2"
+        source = data_source.BytesSource(text)
+        for chunk_size in (3, 100):
+            found = list(pellet.iter_pellets(source, chunk_size=chunk_size))
+            self.assertEqual([p.to_bytes() for (s, p) in found], [p1, p2])
+        self.assertEqual(list(pellet.iter_pellets(data_source.BytesSource(b""))), [])
+        truncated = data_source.BytesSource(p1 + b"\n" + p2[:-3])
+        with self.assertRaises(key.FormatError):
+            list(pellet.iter_pellets(truncated, chunk_size=5))
+
+    def test_malformed_fails_fast(self):
+        encoded = self.encoded_pellets(2000)
+        text = b"\n".join(encoded)
+        for (corrupt_at, replacement) in [(text.index(encoded[50]), b"Q"),
+                                          (text.index(encoded[60]) + len(encoded[60]) - 1, b"x")]:
+            source = CountingSource(text[:corrupt_at] + replacement + text[corrupt_at + 1:])
+            with self.assertRaises(key.FormatError):
+                for found in pellet.iter_pellets(source, chunk_size=256):
+                    pass
+            # a malformed pellet is not mistaken for one cut by the chunk.
+            self.assertLess(source.bytes_read, corrupt_at + 1024)
+            self.assertLess(corrupt_at + 4096, len(text))
+
+
+class CountingSource(data_source.BytesSource):
+
+    def __init__(self, byte_data):
+        data_source.BytesSource.__init__(self, byte_data)
+        self.reads = 0
+        self.bytes_read = 0
+
+    def get_bytes(self, start_seek, length, strict=True):
+        self.reads += 1
+        found = data_source.BytesSource.get_bytes(self, start_seek, length, strict)
+        if found is not None:
+            self.bytes_read += len(found[0])
+        return found
+
+
+class TestPelletFromDataSourceSeek(unittest.TestCase):
+
+    def encoded(self, values_bytes, skips=()):
+        k = key.CompositeKey(key.StringKey(u"name"), key.NumberKey(7))
+        p = pellet.Pellet(k, value.Values(values_bytes))
+        p.set_offsets(None, list(skips))
+        return p.to_bytes()
+
+    def test_reads(self):
+        small = self.encoded([b"x"], [(10, 1)])
+        large = self.encoded([b"a" * 5000, b"b" * 30], [(100000, 1), (200000, 2)])
+        for text in (small, large, b"D\n" + large):
+            for suffix in (b"", b"\nN1\nD\nO4"):
+                source = CountingSource(text + suffix)
+                estimate = pellet.ReadEstimate()
+                start = 2 if text.startswith(b"D\n") else 0
+                (p, end) = pellet.pellet_from_data_source_seek(source, start, estimate=estimate)
+                self.assertEqual(start + len(p.to_bytes()) + (1 if suffix else 0), end)
+                self.assertEqual(p.to_bytes(), text[start:])
+                self.assertLessEqual(source.reads, 2)
+                # the estimate now covers pellets of this size in one read.
+                source.reads = 0
+                pellet.pellet_from_data_source_seek(source, start, estimate=estimate)
+                self.assertEqual(source.reads, 1)
+                # as does a known payload length.
+                source.reads = 0
+                pellet.pellet_from_data_source_seek(source, start, p.payload_length)
+                self.assertEqual(source.reads, 1)
+
+    def test_many_values(self):
+        # each large value is found after its predecessor is read.
+        text = self.encoded([b"v" * (i * 40) for i in range(100)])
+        source = CountingSource(text)
+        (p, end) = pellet.pellet_from_data_source_seek(source, 0, estimate=pellet.ReadEstimate())
+        self.assertEqual(p.to_bytes(), text)
+        self.assertEqual(end, len(text))
+
+    def test_truncated(self):
+        text = self.encoded([b"a" * 1000])
+        for length in (3, 200, text.index(b"\nO") + 1):
+            with self.assertRaises(key.FormatError):
+                pellet.pellet_from_data_source_seek(data_source.BytesSource(text[:length]), 0)
+
+    def test_payload_extent(self):
+        text = self.encoded([b"a" * 1000, b"bb"], [(5, 1)])
+        payload_end = text.index(b"\nO") + 1
+        self.assertEqual(fast_parse.payload_extent(text), (payload_end, True))
+        self.assertEqual(fast_parse.payload_extent(text[:50])[1], False)
+        # the first value header gives the start of the second.
+        self.assertEqual(fast_parse.payload_extent(text[:50]), (text.index(b"V2\n"), False))
+        for length in range(len(text)):
+            (position, complete) = fast_parse.payload_extent(text[:length])
+            self.assertFalse(complete and length <= payload_end)
+            self.assertLessEqual(position, payload_end)
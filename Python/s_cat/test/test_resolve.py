@@ -0,0 +1,229 @@
+import os
+import shutil
+import tempfile
+import unittest
+from .. import bulk
+from .. import data_source
+from .. import file_source
+from .. import index
+from .. import key
+from .. import pellet
+from .. import resolve
+from .. import store
+from .. import value
+
+
+class CountingFileSource(file_source.FileSource):
+
+    reads = 0
+
+    def get_bytes(self, start_seek, length, strict=True):
+        CountingFileSource.reads += 1
+        return file_source.FileSource.get_bytes(self, start_seek, length, strict)
+
+
+def counting_opener(path):
+    return CountingFileSource(open(path, "rb"), positional=True)
+
+
+class TestResolve(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.catalog = os.path.join(self.directory, "catalog.scat")
+        self.items = os.path.join(self.directory, "items.scat")
+        self.blob = os.path.join(self.directory, "blob.bin")
+        self.log = os.path.join(self.directory, "log.scat")
+        item_pairs = [(key.NumberKey(i), value.Values([b"item %d" % i])) for i in range(100)]
+        item_pairs.append((key.NumberKey(100), value.Deleted()))
+        bulk.bulk_load_file(self.items, item_pairs)
+        with open(self.blob, "wb") as f:
+            f.write(b"".join(b"%04d" % i for i in range(1000)))
+        # catalog entries refer to items (by relative path) and to each other.
+        catalog_pairs = [
+            (key.StringKey(u"direct"), resolve.scat_reference("items.scat", key.NumberKey(7))),
+            (key.StringKey(u"chained"), resolve.scat_reference("catalog.scat", key.StringKey(u"direct"))),
+            (key.StringKey(u"loop"), resolve.scat_reference("catalog.scat", key.StringKey(u"loop"))),
+        ]
+        bulk.bulk_load_file(self.catalog, catalog_pairs)
+        # an unsorted file, later pellets overriding earlier ones.
+        log = data_source.BytesSource(b"", writeable=True)
+        for (k, v) in [(key.StringKey(u"b"), b"1"), (key.StringKey(u"a"), b"2"), (key.StringKey(u"b"), b"3")]:
+            separator = b"\n" if log.length() else b""
+            log.append(separator + pellet.Pellet(k, value.Values([v])).to_bytes())
+        with open(self.log, "wb") as f:
+            f.write(log.byte_data)
+        CountingFileSource.reads = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_schemes(self):
+        with resolve.Resolver(self.directory) as resolver:
+            self.assertEqual(resolver.resolve(resolve.scat_reference("items.scat", key.NumberKey(3))).sequence,
+                             [b"item 3"])
+            self.assertIsNone(resolver.resolve(resolve.scat_reference("items.scat", key.NumberKey(100))))
+            self.assertIsNone(resolver.resolve(resolve.scat_reference("items.scat", key.NumberKey(500))))
+            found = resolver.resolve(resolve.range_reference(self.blob, 40, 8))
+            self.assertEqual(found.sequence, [b"00100011"])
+            self.assertRaises(resolve.ResolveError, resolver.resolve, resolve.range_reference(self.blob, 3999, 2))
+            self.assertRaises(resolve.ResolveError, resolver.resolve, b"ftp:somewhere")
+            self.assertRaises(resolve.ResolveError, resolver.resolve, b"scat:items.scat")
+            self.assertRaises(resolve.ResolveError, resolver.resolve, b"range:blob.bin\nx:y")
+            self.assertRaises(resolve.ResolveError, resolver.resolve, resolve.scat_reference("nothing.scat", key.NumberKey(1)))
+            # an unsorted file without a footer is indexed, not searched.
+            self.assertEqual(resolver.resolve(resolve.scat_reference("log.scat", key.StringKey(u"b"))).sequence, [b"3"])
+            self.assertEqual(resolver.resolve(resolve.scat_reference("log.scat", key.StringKey(u"a"))).sequence, [b"2"])
+            self.assertIsNotNone(resolver.pool.get(self.log).index)
+
+    def test_confined_paths(self):
+        outside = tempfile.mkdtemp()
+        try:
+            secret = os.path.join(outside, "secret.scat")
+            bulk.bulk_load_file(secret, [(key.NumberKey(1), [b"secret"])])
+            os.symlink(secret, os.path.join(self.directory, "link.scat"))
+            with resolve.Resolver(self.directory) as resolver:
+                relative = os.path.join("..", os.path.basename(outside), "secret.scat")
+                for path in (secret, relative, "link.scat", "/etc/passwd"):
+                    self.assertRaises(resolve.ResolveError, resolver.resolve, resolve.scat_reference(path, key.NumberKey(1)))
+                    self.assertRaises(resolve.ResolveError, resolver.resolve, resolve.range_reference(path, 0, 1))
+                self.assertRaises(resolve.ResolveError, resolver.pool.get, secret)
+                self.assertEqual(resolver.stats()["opens"], 0)
+                # paths inside the base directory may still be absolute or use "..".
+                inside = os.path.join("sub", "..", "blob.bin")
+                self.assertEqual(resolver.resolve(resolve.range_reference(inside, 0, 4)).sequence, [b"0000"])
+                self.assertEqual(resolver.resolve(resolve.range_reference(self.blob, 4, 4)).sequence, [b"0001"])
+        finally:
+            shutil.rmtree(outside)
+
+    def test_chains(self):
+        with resolve.Resolver(self.directory) as resolver:
+            found = resolver.resolve(resolve.scat_reference("catalog.scat", key.StringKey(u"chained")))
+            self.assertEqual(found.sequence, [b"item 7"])
+            # each reference of the chain is cached.
+            self.assertEqual(resolver.stats()["cached"], 3)
+            self.assertRaises(resolve.ResolveError, resolver.resolve,
+                              resolve.scat_reference("catalog.scat", key.StringKey(u"loop")))
+        short = resolve.Resolver(self.directory, max_depth=1)
+        self.assertRaises(resolve.ResolveError, short.resolve,
+                          resolve.scat_reference("catalog.scat", key.StringKey(u"chained")))
+        short.close()
+
+    def test_batch_pool_and_cache(self):
+        resolver = resolve.Resolver(self.directory, opener=counting_opener)
+        references = [resolve.scat_reference("items.scat", key.NumberKey(i)) for i in range(50, 0, -1)]
+        references += [resolve.range_reference("blob.bin", 4 * i, 4) for i in range(0, 1000, 10)]
+        references.append(references[0])
+        results = resolver.resolve_many(references)
+        self.assertEqual(results[0].sequence, [b"item 50"])
+        self.assertEqual(results[-1].sequence, [b"item 50"])
+        self.assertEqual(results[50].sequence, [b"0000"])
+        self.assertEqual(results[51].sequence, [b"0010"])
+        self.assertEqual(resolver.stats()["opens"], 2)
+        reads = CountingFileSource.reads
+        # the ranges are within the coalescing gap: one read.
+        blob_results = resolver.resolve_many([resolve.range_reference("blob.bin", 4 * i, 4) for i in range(1, 1000, 10)])
+        self.assertEqual(CountingFileSource.reads, reads + 1)
+        self.assertEqual(blob_results[1].sequence, [b"0011"])
+        reads = CountingFileSource.reads
+        again = resolver.resolve_many(references)
+        self.assertEqual(CountingFileSource.reads, reads)
+        self.assertEqual([r.sequence for r in again], [r.sequence for r in results])
+        self.assertGreaterEqual(resolver.stats()["hits"], len(references))
+        resolver.clear()
+        resolver.resolve(references[0])
+        self.assertGreater(CountingFileSource.reads, reads)
+        self.assertEqual(resolver.stats()["opens"], 2)
+        resolver.close()
+
+    def test_cache_follows_growth(self):
+        resolver = resolve.Resolver(self.directory, opener=counting_opener)
+        missing = resolve.scat_reference("catalog.scat", key.StringKey(u"more"))
+        chained = resolve.scat_reference("catalog.scat", key.StringKey(u"chained"))
+        self.assertIsNone(resolver.resolve(missing))
+        self.assertEqual(resolver.resolve(chained).sequence, [b"item 7"])
+        reads = CountingFileSource.reads
+        self.assertIsNone(resolver.resolve(missing))
+        self.assertEqual(CountingFileSource.reads, reads)
+        # a key appended since is found without clear(), as is a changed chain target.
+        with open(self.catalog, "r+b") as f:
+            w = store.SCatWriter(file_source.FileSource(f, writeable=True))
+            w.add(key.StringKey(u"more"), value.Values([b"appended"]))
+        self.assertEqual(resolver.resolve(missing).sequence, [b"appended"])
+        with open(self.items, "r+b") as f:
+            w = store.SCatWriter(file_source.FileSource(f, writeable=True))
+            w.add(key.NumberKey(200), value.Values([b"item 200"]))
+        self.assertEqual(resolver.resolve(chained).sequence, [b"item 7"])
+        self.assertEqual(resolver.dependents[os.path.realpath(self.items)],
+                         {reference.reference_bytes for reference in
+                          (chained, resolve.scat_reference("catalog.scat", key.StringKey(u"direct")),
+                           resolve.scat_reference("items.scat", key.NumberKey(7)))})
+        # results of files left as they were stay cached.
+        reads = CountingFileSource.reads
+        self.assertEqual(resolver.resolve(missing).sequence, [b"appended"])
+        self.assertEqual(resolver.resolve(chained).sequence, [b"item 7"])
+        self.assertEqual(CountingFileSource.reads, reads)
+        resolver.close()
+
+    def test_footer_index(self):
+        indexed = os.path.join(self.directory, "indexed.scat")
+        with open(indexed, "w+b") as f:
+            source = file_source.FileSource(f, writeable=True)
+            i = index.KeyIndex(source)
+            w = store.SCatWriter(source, index=i)
+            for n in range(200):
+                w.add(key.NumberKey(n), value.Values([b"indexed %d" % n]))
+            w.write_footer(i)
+        resolver = resolve.Resolver(self.directory, opener=counting_opener)
+        references = [resolve.scat_reference("indexed.scat", key.NumberKey(n)) for n in range(0, 200, 3)]
+        references.append(resolve.scat_reference("indexed.scat", key.NumberKey(999)))
+        results = resolver.resolve_many(references)
+        self.assertEqual(results[5].sequence, [b"indexed 15"])
+        self.assertIsNone(results[-1])
+        handle = resolver.pool.get(os.path.join(self.directory, "indexed.scat"))
+        self.assertIsNotNone(handle.index)
+        self.assertIsNone(handle.reader)
+        # footer, index block, catch up and a few coalesced payload reads.
+        self.assertLess(CountingFileSource.reads, 10)
+        # pellets appended to the file since are indexed before the next batch.
+        with open(indexed, "r+b") as f:
+            w = store.SCatWriter(file_source.FileSource(f, writeable=True))
+            w.add(key.NumberKey(500), value.Values([b"appended"]))
+        appended = resolver.resolve(resolve.scat_reference("indexed.scat", key.NumberKey(500)))
+        self.assertEqual(appended.sequence, [b"appended"])
+        self.assertIs(resolver.pool.get(indexed).index, handle.index)
+        self.assertEqual(resolver.resolve(references[5]).sequence, [b"indexed 15"])
+        resolver.close()
+
+    def test_sorted_store(self):
+        sorted_path = os.path.join(self.directory, "sorted.scat")
+        with open(sorted_path, "w+b") as f:
+            w = store.SCatWriter(file_source.FileSource(f, writeable=True))
+            for n in range(50):
+                w.add(key.NumberKey(n), value.Values([b"sorted %d" % n]))
+            w.write_footer()
+        with resolve.Resolver(self.directory) as resolver:
+            self.assertEqual(resolver.resolve(resolve.scat_reference("sorted.scat", key.NumberKey(7))).sequence,
+                             [b"sorted 7"])
+            handle = resolver.pool.get(sorted_path)
+            # a footer without an index marks a sorted store: no index is built.
+            self.assertIsNotNone(handle.reader)
+            self.assertIsNone(handle.index)
+            # once pellets follow the footer, the file is indexed instead.
+            with open(sorted_path, "r+b") as f:
+                store.SCatWriter(file_source.FileSource(f, writeable=True)).add(key.NumberKey(60), value.Values([b"late"]))
+            self.assertEqual(resolver.resolve(resolve.scat_reference("sorted.scat", key.NumberKey(60))).sequence,
+                             [b"late"])
+            self.assertIsNotNone(handle.index)
+
+    def test_limits(self):
+        resolver = resolve.Resolver(self.directory, max_open=1, cache_entries=2)
+        for i in range(5):
+            resolver.resolve(resolve.scat_reference("items.scat", key.NumberKey(i)))
+            resolver.resolve(resolve.range_reference("blob.bin", i, 1))
+        stats = resolver.stats()
+        self.assertEqual(stats["open"], 1)
+        self.assertEqual(stats["opens"], 10)
+        self.assertEqual(stats["cached"], 2)
+        resolver.close()
+        self.assertEqual(resolver.stats()["open"], 0)
@@ -0,0 +1,124 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from .. import data_source
+from .. import file_source
+from .. import index
+from .. import key
+from .. import snapshot
+from .. import store
+from .. import value
+
+
+def values_for(n):
+    return value.Values([b"value %d" % n])
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "data.scat")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_pinned(self):
+        s = data_source.BytesSource(b"", writeable=True)
+        w = store.SCatWriter(s)
+        for n in range(10):
+            w.add(key.NumberKey(n), values_for(n))
+        snap = snapshot.Snapshot(s)
+        length = s.length()
+        for n in range(10, 20):
+            w.add(key.NumberKey(n), values_for(n))
+        self.assertEqual(snap.length(), length)
+        r = snap.reader()
+        self.assertEqual(r.tail()[1].key.value(), 9)
+        self.assertEqual(r.get(key.NumberKey(4)).sequence, [b"value 4"])
+        self.assertIsNone(r.get(key.NumberKey(15)))
+        self.assertEqual([k.value() for (k, v) in r.scan()], list(range(10)))
+        self.assertEqual(store.SCatReader(s).tail()[1].key.value(), 19)
+        (chunk, at_eof) = snap.get_bytes(length - 3, 100, strict=False)
+        self.assertEqual(bytes(chunk), s.byte_data[length - 3:length])
+        self.assertTrue(at_eof)
+        self.assertIsNone(snap.get_bytes(length - 3, 4))
+        with self.assertRaises(IndexError):
+            snap.get_bytes(length + 1, 1)
+        with self.assertRaises(data_source.ReadOnlyError):
+            snap.append(b"x")
+        # an index as of the snapshot, from scratch or from a base index.
+        i = snap.key_index()
+        self.assertEqual(len(i), 10)
+        base = index.KeyIndex(snapshot.Snapshot(s, s.length()))
+        base.catch_up()
+        self.assertEqual(len(snap.key_index(base)), 10)
+        early = snapshot.Snapshot(s, 0).key_index()
+        self.assertEqual(len(snapshot.Snapshot(s).key_index(early)), 20)
+
+    def test_buffered_and_open(self):
+        with open(self.path, "w+b") as f:
+            source = file_source.BufferedFileSource(f, positional=True)
+            w = store.SCatWriter(source)
+            w.add(key.NumberKey(1), values_for(1))
+            source.flush()
+            w.add(key.NumberKey(2), values_for(2))
+            # the second pellet is not yet flushed.
+            snap = snapshot.Snapshot(source)
+            self.assertEqual(snap.length(), source.flushed_length)
+            self.assertEqual(snap.reader().tail()[1].key.value(), 1)
+            source.flush()
+            other = snapshot.Snapshot.open(self.path)
+            try:
+                self.assertEqual(other.reader().tail()[1].key.value(), 2)
+                pinned = snapshot.Snapshot.open(self.path, snap.length())
+                self.assertEqual(pinned.reader().tail()[1].key.value(), 1)
+                pinned.close()
+            finally:
+                other.close()
+
+    def test_concurrent_readers(self):
+        count = 1000
+        failures = []
+        done = threading.Event()
+        with open(self.path, "w+b") as f:
+            source = file_source.BufferedFileSource(f, flush_policy=file_source.every_bytes(300))
+            w = store.SCatWriter(source)
+
+            def read():
+                try:
+                    check()
+                except Exception as e:
+                    failures.append(("error", e))
+
+            def check():
+                seen = 0
+                while not done.is_set() or seen < count:
+                    snap = snapshot.Snapshot(source)
+                    tail = snap.reader().tail()
+                    if tail is None:
+                        continue
+                    last = tail[1].key.value()
+                    if last < seen - 1:
+                        failures.append(("went back", last, seen))
+                    seen = last + 1
+                    probe = last // 2
+                    found = snap.reader().get(key.NumberKey(probe))
+                    if found is None or found.sequence != [b"value %d" % probe]:
+                        failures.append(("lookup", probe, last))
+
+            readers = [threading.Thread(target=read) for i in range(4)]
+            for t in readers:
+                t.start()
+            try:
+                for n in range(count):
+                    w.add(key.NumberKey(n), values_for(n))
+            finally:
+                source.flush()
+                done.set()
+                for t in readers:
+                    t.join()
+            source.close()
+        self.assertEqual(failures, [])
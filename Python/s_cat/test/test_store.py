@@ -0,0 +1,191 @@
+import unittest
+from .. import data_source
+from .. import store
+from .. import key
+from .. import value
+
+
+class CountingSource(data_source.BytesSource):
+
+    "Bytes source counting get_bytes calls."
+
+    reads = 0
+
+    def get_bytes(self, start_seek, length, strict=True):
+        self.reads += 1
+        return data_source.BytesSource.get_bytes(self, start_seek, length, strict)
+
+
+def values_for(i):
+    return value.Values([b"value " + str(i).encode("ascii")])
+
+
+def report_items():
+    "(key, values) for tenant/date keys in key order, with updates and deletions."
+    S = key.StringKey
+    C = key.CompositeKey
+    keys = []
+    for tenant in (u"a", u"b", u"c"):
+        for date in (u"d1", u"d2", u"d3"):
+            keys.extend(C(S(tenant), C(S(date), key.NumberKey(i))) for i in range(4))
+    keys.extend([C(S(u"b"), S(u"d2")), C(S(u"b"), S(u"d2x")), C(S(u"b"), key.NumberKey(5))])
+    keys.sort()
+    items = []
+    for (i, k) in enumerate(keys):
+        items.append((k, value.Values([b"old"])))
+        items.append((k, value.Values([str(i).encode("ascii")])))
+        if i % 5 == 0:
+            items.append((k, value.Deleted()))
+    return items
+
+
+def expected_scan(items, accept):
+    "What a scan should give: last values per accepted key in key order, without deletions."
+    latest = {}
+    for (k, v) in items:
+        latest[k.sort_key()] = (k, v)
+    return [(k.to_bytes(), v.sequence) for (sort_key, (k, v)) in sorted(latest.items())
+            if accept(k) and not isinstance(v, value.Deleted)]
+
+
+def scanned(items):
+    return [(k.to_bytes(), [bytes(x) for x in v.sequence]) for (k, v) in items]
+
+
+class TestSCatStore(unittest.TestCase):
+
+    def build(self, count, step=2):
+        s = CountingSource(b"", writeable=True)
+        w = store.SCatWriter(s)
+        for i in range(count):
+            w.add(key.NumberKey(i * step), values_for(i))
+        return (s, w)
+
+    def test_empty(self):
+        s = data_source.BytesSource(b"", writeable=True)
+        r = store.SCatReader(s)
+        self.assertIsNone(r.tail())
+        self.assertIsNone(r.find(key.NumberKey(1)))
+        self.assertIsNone(r.get(key.NumberKey(1)))
+
+    def test_offsets(self):
+        (s, w) = self.build(5)
+        r = store.SCatReader(s)
+        seeks = []
+        seek = 0
+        for i in range(5):
+            (p, end) = store.read_pellet(s, seek)
+            seeks.append(seek)
+            seek = end
+        for (i, pellet_seek) in enumerate(seeks):
+            (p, end) = store.read_pellet(s, pellet_seek)
+            targets = [(pellet_seek - offset, count) for (offset, count) in p.skips_offsets_and_counts]
+            expected = []
+            level = 0
+            while i > 0 and i % (1 << level) == 0:
+                expected.append((seeks[i - (1 << level)], 1 << level))
+                level += 1
+            self.assertEqual(targets, expected)
+        (tail_seek, tail) = r.tail()
+        self.assertEqual(tail_seek, seeks[-1])
+        self.assertEqual(tail.key.value(), 8)
+        self.assertNotIsInstance(tail.values, value.LazyValues)
+        self.assertIsInstance(store.SCatReader(s, lazy=True).tail()[1].values, value.LazyValues)
+
+    def test_find(self):
+        count = 300
+        (s, w) = self.build(count)
+        r = store.SCatReader(s)
+        for i in range(count):
+            s.reads = 0
+            (seek, p) = r.find(key.NumberKey(2 * i))
+            self.assertEqual(p.values.sequence, values_for(i).sequence)
+            # logarithmic, not linear, in the number of pellets.
+            self.assertTrue(s.reads < 40, (i, s.reads))
+            self.assertIsNone(r.find(key.NumberKey(2 * i + 1)))
+        self.assertIsNone(r.find(key.NumberKey(-1)))
+        self.assertIsNone(r.find(key.StringKey(u"x")))
+        (seek, p) = r.find_at_most(key.NumberKey(33))
+        self.assertEqual(p.key.value(), 32)
+        self.assertEqual(r.find_at_most(key.StringKey(u"x"))[1].key.value(), 598)
+
+    def test_last_wins_and_deleted(self):
+        s = data_source.BytesSource(b"", writeable=True)
+        w = store.SCatWriter(s)
+        w.add(key.StringKey(u"a"), value.Values([b"1"]))
+        w.add(key.StringKey(u"b"), value.Values([b"2"]))
+        w.add(key.StringKey(u"b"), value.Values([b"3"]))
+        w.add(key.StringKey(u"c"), value.Values([b"4"]))
+        w.add(key.StringKey(u"c"), value.Deleted())
+        r = store.SCatReader(s)
+        self.assertEqual(r.get(key.StringKey(u"b")).sequence, [b"3"])
+        self.assertIsNone(r.get(key.StringKey(u"c")))
+        self.assertIsInstance(r.find(key.StringKey(u"c"))[1].values, value.Deleted)
+        with self.assertRaises(store.OrderError):
+            w.add(key.StringKey(u"a"), value.Values([b"5"]))
+        self.assertIsInstance(r.get(key.StringKey(u"a")), value.Values)
+        lazy = store.SCatReader(s, lazy=True).get(key.StringKey(u"b"))
+        self.assertIsInstance(lazy, value.LazyValues)
+        self.assertEqual(lazy.sequence, [b"3"])
+
+    def test_scan(self):
+        items = report_items()
+        s = CountingSource(b"", writeable=True)
+        w = store.SCatWriter(s)
+        for (k, v) in items:
+            w.add(k, v)
+        r = store.SCatReader(s)
+        S = key.StringKey
+        C = key.CompositeKey
+        lowest = key.NumberKey(-float("inf"))
+        prefix = C(S(u"b"), S(u"d2"))
+        tests = [
+            (r.scan(), lambda k: True),
+            (r.scan(C(S(u"b"), lowest), C(S(u"c"), lowest)), lambda k: k.key1 == S(u"b")),
+            (r.scan(end_key=C(S(u"b"), key.NumberKey(0))), lambda k: k.key1 == S(u"a")),
+            (r.prefix_scan(prefix), lambda k: k == prefix or (k.key1 == S(u"b") and
+                isinstance(k.key2, key.CompositeKey) and k.key2.key1 == S(u"d2"))),
+            (r.prefix_scan(C(S(u"z"), S(u"d1"))), lambda k: False),
+        ]
+        for (found, accept) in tests:
+            found = scanned(found)
+            self.assertEqual(found, expected_scan(items, accept))
+        self.assertEqual(len(scanned(r.prefix_scan(prefix))), 4)
+        # a narrow scan reads little of the store.
+        s.reads = 0
+        (k, v) = next(r.scan(C(S(u"c"), S(u""))))
+        self.assertEqual(k.key1, S(u"c"))
+        self.assertIsInstance(v, value.Values)
+        self.assertTrue(s.reads < 20, s.reads)
+        self.assertIsInstance(next(store.SCatReader(s, lazy=True).scan())[1], value.LazyValues)
+
+    def test_reopen(self):
+        for split in (1, 2, 3, 7, 8, 13, 16):
+            (s, w) = self.build(split)
+            w2 = store.SCatWriter(s)
+            self.assertEqual(w2.count, split)
+            self.assertEqual(w2.level_seeks, w.level_seeks)
+            self.assertEqual(w2.first_seek, w.first_seek)
+            for i in range(split, 40):
+                w2.add(key.NumberKey(i * 2), values_for(i))
+            (fresh, w3) = self.build(40)
+            self.assertEqual(s.byte_data, fresh.byte_data)
+
+    def test_other_writer(self):
+        (s, w) = self.build(3)
+        store.SCatWriter(s).add(key.NumberKey(10), values_for(5))
+        before = s.byte_data
+        with self.assertRaises(IOError):
+            w.add(key.NumberKey(100), values_for(100))
+        with self.assertRaises(IOError):
+            w.write_footer()
+        # nothing was written: the store is intact and can be reopened.
+        self.assertEqual(s.byte_data, before)
+        self.assertEqual(store.SCatReader(s).get(key.NumberKey(4)).sequence, values_for(2).sequence)
+        self.assertEqual(store.SCatReader(s).get(key.NumberKey(10)).sequence, values_for(5).sequence)
+        w2 = store.SCatWriter(s)
+        self.assertEqual(w2.count, 4)
+        w2.add(key.NumberKey(100), values_for(100))
+        self.assertEqual(store.SCatReader(s).get(key.NumberKey(100)).sequence, values_for(100).sequence)
+        with self.assertRaises(data_source.ReadOnlyError):
+            store.SCatWriter(data_source.BytesSource(b""))
@@ -68,3 +68,32 @@ class TestValues(unittest.TestCase):
         self.assertEqual(end, len(bytes))
         self.assertIsInstance(v2, value.Values)
         self.assertEqual(v2.sequence, seq)
+        # the same access as lazy and packed values.
+        self.assertEqual(len(v2), 2)
+        self.assertEqual(v2[-1], other)
+        self.assertEqual(list(v2), seq)
+        with self.assertRaises(IndexError):
+            v2[2]
+
+    def test_lazy_values(self):
+        seq = [b"first", b"", b"third value"]
+        encoded = value.Values(seq).to_bytes()
+        padded = b"012" + encoded + b" X"
+        (v, end) = value.values_from_bytes(padded, 3, lazy=True)
+        self.assertIsInstance(v, value.LazyValues)
+        self.assertEqual(padded[end:], b"X")
+        self.assertEqual(len(v), 3)
+        self.assertEqual([bytes(x) for x in v], seq)
+        self.assertIsInstance(v[0], memoryview)
+        self.assertEqual(v[-1], seq[-1])
+        with self.assertRaises(IndexError):
+            v[3]
+        self.assertEqual(v.to_bytes(), encoded)
+        self.assertEqual(v.materialize().sequence, seq)
+        # boundaries found on first access.
+        v = value.LazyValues(padded, 3, 3 + len(encoded))
+        self.assertIsNone(v.bounds)
+        self.assertEqual(v.sequence, seq)
+        self.assertEqual(v.to_bytes(), encoded)
+        with self.assertRaises(key.FormatError):
+            value.values_from_bytes(b"V9 abc", lazy=True)
@@ -1,5 +1,7 @@
 
+from . import compress
 from . import key
+from array import array
 
 def value_from_bytes(encoded_bytes, start=0, expected_indicator=b"V"):
     "get value from encoded bytes, return (value_bytes, end_index) or (None, None)"
@@ -20,17 +22,22 @@ def value_from_bytes(encoded_bytes, start=0, expected_indicator=b"V"):
 
 class ValuesContainer(object):
     "Abstract superclass for values collection."
-    pass
+
+    __slots__ = ()
 
 class Deleted(ValuesContainer):
     "Deletion marker."
-    
+
+    __slots__ = ()
+
     def to_bytes(self):
         return b"D"
 
 class Reference(ValuesContainer):
     "Reference to external mapping."
 
+    __slots__ = ("reference_bytes",)
+
     def __init__(self, reference_bytes):
         self.reference_bytes = reference_bytes
 
@@ -44,12 +51,23 @@ class Reference(ValuesContainer):
 class Values(ValuesContainer):
     "Zero or more values as bytes sequences."
 
+    __slots__ = ("sequence",)
+
     def __init__(self, sequence=()):
         self.sequence = list(sequence)
 
     def add_bytes(self, bytes):
         self.sequence.append(bytes)
 
+    def __len__(self):
+        return len(self.sequence)
+
+    def __getitem__(self, index):
+        return self.sequence[index]
+
+    def __iter__(self):
+        return iter(self.sequence)
+
     def to_bytes(self):
         L = []
         for bytes in self.sequence:
@@ -59,7 +77,153 @@ class Values(ValuesContainer):
             L.append(insert)
         return b"\n".join(L)
 
-def values_from_bytes(encoded_bytes, start=0):
+class LazyValues(ValuesContainer):
+
+    """
+    Values decoded on demand: encoded_bytes[start:end] holds the "V" encoded
+    values.  The value boundaries are found on first access unless given
+    (as a flat array of start, end index pairs) and values are handed out
+    as memoryview slices of the encoded bytes, without copying.
+    """
+
+    __slots__ = ("encoded_bytes", "start", "end", "bounds", "view")
+
+    def __init__(self, encoded_bytes, start, end, bounds=None):
+        self.encoded_bytes = encoded_bytes
+        self.start = start
+        self.end = end
+        self.bounds = bounds
+        self.view = None
+
+    def boundaries(self):
+        bounds = self.bounds
+        if bounds is None:
+            (bounds, end) = value_bounds(self.encoded_bytes, self.start, self.end)
+            self.bounds = bounds
+        return bounds
+
+    def __len__(self):
+        return len(self.boundaries()) // 2
+
+    def __getitem__(self, index):
+        bounds = self.boundaries()
+        index = range(len(bounds) // 2)[index]
+        return self.get_view()[bounds[2 * index]: bounds[2 * index + 1]]
+
+    def __iter__(self):
+        view = self.get_view()
+        bounds = self.boundaries()
+        for i in range(0, len(bounds), 2):
+            yield view[bounds[i]: bounds[i + 1]]
+
+    def get_view(self):
+        view = self.view
+        if view is None:
+            view = self.view = memoryview(self.encoded_bytes)
+        return view
+
+    @property
+    def sequence(self):
+        "List of the values as memoryviews."
+        return list(self)
+
+    def materialize(self):
+        "Values holding copies of the values as bytes."
+        return Values([bytes(v) for v in self])
+
+    def to_bytes(self):
+        return bytes(self.get_view()[self.start:self.end])
+
+class PackedValues(ValuesContainer):
+
+    """
+    Values some of which are compressed (see compress): items holds
+    (packed, item) pairs where item is the codec byte and compressed bytes
+    if packed, else the value bytes.  Values are decompressed on first
+    access.
+    """
+
+    __slots__ = ("items", "decoded")
+
+    def __init__(self, items):
+        self.items = list(items)
+        self.decoded = [None] * len(self.items)
+
+    @classmethod
+    def pack(cls, sequence, compressor):
+        "Values for the byte strings of sequence, compressed by compressor where worthwhile."
+        items = []
+        packed_any = False
+        for value_bytes in sequence:
+            packed = compressor.pack(value_bytes)
+            if packed is None:
+                items.append((False, value_bytes))
+            else:
+                items.append((True, packed))
+                packed_any = True
+        if not packed_any:
+            return Values(sequence)
+        return cls(items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, index):
+        index = range(len(self.items))[index]
+        found = self.decoded[index]
+        if found is None:
+            (packed, item) = self.items[index]
+            found = compress.decompress(item) if packed else item
+            self.decoded[index] = found
+        return found
+
+    def __iter__(self):
+        for i in range(len(self.items)):
+            yield self[i]
+
+    @property
+    def sequence(self):
+        "List of the values, decompressed."
+        return list(self)
+
+    def materialize(self):
+        "Values holding the values as bytes."
+        return Values([bytes(v) for v in self])
+
+    def to_bytes(self):
+        L = []
+        for (packed, item) in self.items:
+            indicator = compress.PACKED_INDICATOR if packed else b"V"
+            blength = key.unicode_(len(item)).encode("utf8")
+            L.append(b"".join([indicator, blength, b"\n", item]))
+        return b"\n".join(L)
+
+def value_bounds(encoded_bytes, start=0, end=None):
+    """
+    Find the "V" encoded values from start (up to end if given) without
+    copying them.  Return (flat array of value start, end pairs, end_index)
+    where end_index is the end of the last value.
+    """
+    nbytes = len(encoded_bytes)
+    if end is None:
+        end = nbytes
+    bounds = array("q")
+    value_end = start
+    while start < end and encoded_bytes[start:start + 1] == b"V":
+        (length, len_end) = key.white_delimited_int(encoded_bytes, start+1)
+        value_end = len_end + length
+        if value_end > nbytes:
+            raise key.FormatError("value extends past end of data")
+        bounds.append(len_end)
+        bounds.append(value_end)
+        start = value_end
+        # also consume the white delimiter if available
+        if start < nbytes:
+            key.assert_is_white(encoded_bytes, start)
+            start = start + 1
+    return (bounds, value_end)
+
+def values_from_bytes(encoded_bytes, start=0, lazy=False):
     values = end = None
     nbytes = len(encoded_bytes)
     indicator = encoded_bytes[start:start + 1]
@@ -73,13 +237,29 @@ def values_from_bytes(encoded_bytes, start=0):
     elif indicator == b"R":
         (bytes, end) = value_from_bytes(encoded_bytes, start, expected_indicator=b"R")
         values = Reference(bytes)
-    elif indicator == b"V":
-        values = Values()
-        while indicator == b"V":
-            (bytes, end) = value_from_bytes(encoded_bytes, start)
-            values.add_bytes(bytes)
+    elif indicator == b"V" or indicator == compress.PACKED_INDICATOR:
+        if lazy and indicator == b"V":
+            (bounds, values_end) = value_bounds(encoded_bytes, start)
+            # compressed values after these are decoded below instead.
+            if encoded_bytes[values_end + 1:values_end + 2] != compress.PACKED_INDICATOR:
+                end = values_end
+                # also consume the white delimiter if available
+                if end < nbytes:
+                    end = end + 1
+                return (LazyValues(encoded_bytes, start, values_end, bounds), end)
+        items = []
+        packed_any = False
+        while indicator == b"V" or indicator == compress.PACKED_INDICATOR:
+            (bytes, end) = value_from_bytes(encoded_bytes, start, expected_indicator=indicator)
+            packed = indicator == compress.PACKED_INDICATOR
+            packed_any = packed_any or packed
+            items.append((packed, bytes))
             start = end
             indicator = encoded_bytes[start: start+1]
+        if packed_any:
+            values = PackedValues(items)
+        else:
+            values = Values([item for (packed, item) in items])
     else:
         raise key.FormatError("unknown values indicator " + repr(indicator))
     return (values, end)
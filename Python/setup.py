@@ -2,7 +2,7 @@ import os
 import sys
 from setuptools import setup
 
-tests_require = ["coverage", "nose"]
+tests_require = ["coverage"]
 
 base_dir = os.path.dirname(os.path.abspath(__file__))
 
@@ -22,8 +22,10 @@ setup(
     maintainer = "Aaron Watters",
     maintainer_email = "awatters@simonsfoundation.org",
     packages = ["s_cat"],
+    # memoryview.toreadonly, async I/O, hashlib.blake2b.
+    python_requires = ">=3.8",
     zip_safe = False,
     #install_requires = install_requires,
     tests_require = tests_require,
-    test_suite = "nose.collector",
+    test_suite = "s_cat.test",
 )